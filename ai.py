@@ -0,0 +1,211 @@
+import logging
+import os
+import time
+
+# Score for winning, less the number of moves it takes so
+# quicker wins are preferred and losses are put off
+WIN = 1000000
+# Score for a line of five cells holding this many of one
+# player's counters and none of the other's
+LINE_WEIGHTS = [0, 1, 8, 64, 512]
+# Statuses after which the computer won't be asked to move again
+GAME_OVER = ["200 WIN", "200 LOSS", "200 DRAW", "200 DISC"]
+
+class SearchTimeout(Exception):
+    """Raised inside the search once the time for a move runs out"""
+
+class ComputerPlayer():
+    """Opponent for players who don't want to wait for a person.
+    Sits in a game in place of a connection: the game sends it
+    messages like any other player and the server asks it for a
+    move whenever it's been told it's its turn
+
+    Moves are chosen by negamax search with alpha-beta pruning,
+    deepening one move at a time until depth or time runs out"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        self.name = kwargs.get("name", "Computer")
+        # Deepest search in moves and seconds to spend on each move
+        self.depth = kwargs.get("depth", 6)
+        self.time_limit = kwargs.get("time_limit", 0.03)
+        # Best replies for the first few moves, if we have them
+        self.opening_book = kwargs.get("opening_book", None)
+        # Games only talk to the computer through send
+        self.binary = False
+        self.ready = False
+        self.game_over = False
+        self.deadline = 0
+        self.nodes = 0
+
+    def send(self, message):
+        # Note when it's our turn. Anything else is ignored
+        status = message.get("status")
+        if status in GAME_OVER:
+            self.game_over = True
+        elif status == "200 READY" and not self.game_over:
+            self.ready = True
+
+    def close(self):
+        self.game_over = True
+
+    def play(self, game):
+        """Take our turn in game. Called with the game's lock held"""
+        self.ready = False
+        self.move(game, self.choose_move(
+            game.bitboard,
+            game.markers[self.name],
+            game.markers[game.waiting]
+        ))
+
+    def move(self, game, column):
+        """Play column, counted from 0, in game. Called with the
+        game's lock held"""
+        logging.info("%s plays column %s", self.name, column + 1)
+        game.play_move(column + 1)
+
+    def choose_move(self, board, marker, opponent=None):
+        """Best column for marker to play on board, counted from 0"""
+        if opponent is None:
+            opponent = self.opponent_of(board, marker)
+        # Openings were searched ahead of time
+        if self.opening_book is not None:
+            column = self.opening_book.lookup(board, marker, opponent)
+            if column is not None:
+                return column
+        column, score, depth = self.search(board, marker, opponent)
+        return column
+
+    def opponent_of(self, board, marker):
+        # Whoever else has counters on the board
+        return next(
+            (other for other in board.bitboards if other != marker),
+            "O" if marker == "X" else "X"
+        )
+
+    def search(self, board, marker, opponent=None):
+        """Returns the best column for marker, its score and
+        how many moves ahead we managed to look"""
+        board = board.copy()
+        if opponent is None:
+            opponent = self.opponent_of(board, marker)
+        columns = self.column_order(board)
+        best = columns[0]
+
+        self.deadline = time.perf_counter() + self.time_limit
+        self.nodes = 0
+        best_score = 0
+        searched = 0
+        for depth in range(1, self.depth + 1):
+            try:
+                # Start with the best move from the last depth
+                score, column = self.search_root(
+                    board, depth, marker, opponent,
+                    [best] + [other for other in columns if other != best]
+                )
+            except SearchTimeout:
+                # Always finish the first depth so we have a move
+                if depth > 1:
+                    break
+                raise
+            best = column
+            best_score = score
+            searched = depth
+            # No point looking further once the result is known
+            # or we've looked all the way to the end of the game
+            if (abs(score) >= WIN - self.depth
+                    or depth >= board.width * board.height - board.moves):
+                break
+        logging.info(
+            "Searched %s positions to depth %s", self.nodes, searched
+        )
+        return best, best_score, searched
+
+    def search_root(self, board, depth, marker, opponent, columns):
+        best_score = -WIN - 1
+        best_column = None
+        alpha = -WIN - 1
+        for column in columns:
+            if board.heights[column] >= board.height:
+                continue
+            row = self.drop(board, column, marker)
+            if board.has_five_through(column, row, marker):
+                score = WIN
+            else:
+                score = -self.negamax(
+                    board, depth - 1, -WIN - 1, -alpha,
+                    opponent, marker, 1, depth > 1
+                )
+            self.undo(board, column, row, marker)
+            if score > best_score:
+                best_score = score
+                best_column = column
+            alpha = max(alpha, score)
+        return best_score, best_column
+
+    def negamax(self, board, depth, alpha, beta, marker, opponent, ply,
+                timed=True):
+        """Score of the position for marker, who is to move"""
+        self.nodes += 1
+        # Checking the clock is slow so only do it now and then
+        if timed and self.nodes & 63 == 0:
+            if time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+
+        if board.is_full():
+            return 0
+        if depth == 0:
+            return self.evaluate(board, marker, opponent)
+
+        best = -WIN - 1
+        for column in self.column_order(board):
+            if board.heights[column] >= board.height:
+                continue
+            row = self.drop(board, column, marker)
+            if board.has_five_through(column, row, marker):
+                score = WIN - ply
+            else:
+                score = -self.negamax(
+                    board, depth - 1, -beta, -alpha,
+                    opponent, marker, ply + 1, timed
+                )
+            self.undo(board, column, row, marker)
+
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+    def drop(self, board, column, marker):
+        # Every move the search makes goes through here
+        # and undo so subclasses can keep track of them
+        return board.drop(column, marker)
+
+    def undo(self, board, column, row, marker):
+        board.undo(column)
+
+    def column_order(self, board):
+        # Centre columns are part of the most lines so try them first
+        middle = (board.width - 1) / 2
+        return sorted(
+            range(board.width),
+            key=lambda column: abs(column - middle)
+        )
+
+    def evaluate(self, board, marker, opponent):
+        """Rough score for marker from the lines of five each
+        player could still complete"""
+        mine = board.bitboards.get(marker, 0)
+        theirs = board.bitboards.get(opponent, 0)
+        score = 0
+        for line in board.lines:
+            if not line & theirs:
+                score += LINE_WEIGHTS[(line & mine).bit_count()]
+            elif not line & mine:
+                score -= LINE_WEIGHTS[(line & theirs).bit_count()]
+        return score
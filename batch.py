@@ -0,0 +1,65 @@
+"""Win and draw checks for large batches of boards at once
+
+Needs NumPy, which the server itself doesn't:
+
+    pip install numpy
+
+Boards are arrays of cell codes laid out like the grids the server
+sends, top row first: 0 for an empty cell, 1 for X and 2 for O. A
+batch is an array of shape (boards, height, width)"""
+import numpy as np
+from protocol import CELL_CODES
+
+EMPTY = 0
+X = 1
+O = 2
+# Boards checked at a time, so the temporary arrays stay
+# a few tens of megabytes however big the batch is
+CHUNK = 1 << 16
+
+def encode_grids(grids):
+    """Batch array from a list of grids of "[X]" strings"""
+    return np.array(
+        [[[CELL_CODES[cell] for cell in row] for row in grid]
+         for grid in grids],
+        dtype=np.uint8
+    )
+
+def has_five(boards, marker):
+    """Which boards have five of marker in a row in any direction"""
+    result = np.zeros(len(boards), dtype=bool)
+    for start in range(0, len(boards), CHUNK):
+        cells = boards[start:start + CHUNK] == marker
+        result[start:start + CHUNK] = five_in_a_row(cells)
+    return result
+
+def five_in_a_row(cells):
+    # AND each cell with the next four in the same direction,
+    # using slices of the whole batch rather than looping
+    height, width = cells.shape[1:]
+    found = np.zeros(len(cells), dtype=bool)
+    # Vertical, horizontal, \ diagonal and / diagonal
+    for step_row, step_column in [(1, 0), (0, 1), (1, 1), (1, -1)]:
+        rows = height - 4 * step_row
+        columns = width - 4 * abs(step_column)
+        if rows <= 0 or columns <= 0:
+            continue
+        first_column = 4 if step_column < 0 else 0
+        run = np.ones((len(cells), rows, columns), dtype=bool)
+        for i in range(5):
+            row = i * step_row
+            column = first_column + i * step_column
+            run &= cells[:, row:row + rows, column:column + columns]
+        found |= run.any(axis=(1, 2))
+    return found
+
+def evaluate(boards):
+    """Returns arrays saying which boards X has won, which O has
+    won and which are draws. Like Game.check_draw a board is only
+    a draw once it's full and nobody has won"""
+    boards = np.asarray(boards, dtype=np.uint8)
+    x_wins = has_five(boards, X)
+    o_wins = has_five(boards, O)
+    full = (boards != EMPTY).all(axis=(1, 2))
+    draws = full & ~x_wins & ~o_wins
+    return x_wins, o_wins, draws
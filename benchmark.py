@@ -0,0 +1,426 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+from protocol import BINARY, COMPUTER, DELTA, Connection
+
+class Bot():
+    """Simulated client that speaks the same protocol as Client
+    and plays games back to back without any user input"""
+
+    def __init__(self, name, host, port, kwargs={}):
+        self.name = name
+        self.host = host
+        self.port = port
+        # Called with the result of each game. Returns False
+        # once enough games have been played
+        self.record = kwargs.get("record", lambda result: True)
+        self.stopped = False
+        self.connection = None
+        self.binary = kwargs.get("binary", False)
+        self.delta = kwargs.get("delta", False)
+        # Play the server's computer player instead of other bots
+        self.computer = kwargs.get("computer", False)
+        # Columns to play in order, or random if there aren't any
+        self.script = kwargs.get("script", [])
+        self.random = random.Random(kwargs.get("seed"))
+        # Give up on a game if the server goes quiet for this long
+        self.timeout = kwargs.get("timeout", 10)
+        # Results collected while playing
+        self.latencies = []
+        self.moves = 0
+        self.results = {}
+        self.errors = 0
+
+    def run(self):
+        while not self.stopped:
+            try:
+                result = self.play_game()
+            except (OSError, ValueError) as err:
+                if not self.stopped:
+                    logging.info("Bot %s error: %s", self.name, err)
+                    self.errors += 1
+                continue
+            if self.stopped:
+                break
+            self.results[result] = self.results.get(result, 0) + 1
+            if not self.record(result):
+                break
+
+    def stop(self):
+        """Stop playing, including waiting for an opponent
+        who will never arrive"""
+        self.stopped = True
+        connection = self.connection
+        if connection is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def play_game(self):
+        connection = Connection(socket.create_connection(
+            (self.host, self.port), timeout=self.timeout
+        ))
+        self.connection = connection
+        join = {"new_player": self.name}
+        if self.binary:
+            join["protocol"] = BINARY
+        if self.delta:
+            join["updates"] = DELTA
+        if self.computer:
+            join["opponent"] = COMPUTER
+        connection.send(join)
+        response = connection.recv()
+        if response is None:
+            return "200 DISC"
+        connection.binary = response.get("protocol") == BINARY
+
+        # Free rows in each column, filled in once we see the board
+        heights = []
+        script = list(self.script)
+        try:
+            while True:
+                response = connection.recv()
+                if response is None:
+                    return "200 DISC"
+                status = response["status"]
+                self.track_board(response, heights)
+
+                if status in ("200 WIN", "200 LOSS", "200 DRAW", "200 DISC"):
+                    return status
+
+                if status == "200 READY":
+                    status = self.make_move(connection, heights, script)
+                    if status in ("200 WIN", "200 LOSS", "200 DRAW",
+                                  "200 DISC"):
+                        return status
+        finally:
+            try:
+                connection.send({
+                    "current_player": self.name,
+                    "next_move": "exit"
+                })
+            except OSError:
+                pass
+            connection.close()
+            self.connection = None
+
+    def make_move(self, connection, heights, script):
+        """Send moves until the server accepts one. Returns the
+        status of the server's response"""
+        while True:
+            if script:
+                column = script.pop(0)
+            else:
+                open_columns = [
+                    i for i, height in enumerate(heights) if height > 0
+                ]
+                column = self.random.choice(open_columns or [0])
+
+            start = time.perf_counter()
+            connection.send({
+                "current_player": self.name,
+                "next_move": str(column + 1)
+            })
+            response = connection.recv()
+            self.latencies.append(time.perf_counter() - start)
+            self.moves += 1
+
+            if response is None:
+                return "200 DISC"
+            if response["status"] == "400 COL_FULL":
+                heights[column] = 0
+                continue
+            self.track_board(response, heights)
+            return response["status"]
+
+    def track_board(self, response, heights):
+        # Count free rows in each column from whatever the server sent
+        if "board" in response:
+            board = response["board"]
+            heights[:] = [
+                sum(1 for row in board if row[column] == "[ ]")
+                for column in range(len(board[0]))
+            ]
+        elif "move" in response and heights:
+            column = response["move"][0]
+            heights[column] = max(heights[column] - 1, 0)
+
+class Benchmark():
+    """Starts a server and drives it with bots over loopback sockets,
+    then reports throughput, move latency and the server's peak RSS"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        self.engine = kwargs.get("engine", "threads")
+        # Worker processes for the server, or 0 for just the one
+        self.workers = kwargs.get("workers", 0)
+        self.host = kwargs.get("host", "127.0.0.1")
+        # Use an already running server instead of starting one
+        self.port = kwargs.get("port", None)
+        self.bots = kwargs.get("bots", 20)
+        # Total number of games to play
+        self.games = kwargs.get("games", 100)
+        self.games_played = 0
+        self.lock = threading.Lock()
+        self.binary = kwargs.get("binary", False)
+        self.delta = kwargs.get("delta", False)
+        self.computer = kwargs.get("computer", False)
+        self.script = kwargs.get("script", [])
+        self.seed = kwargs.get("seed", 0)
+        self.timeout = kwargs.get("timeout", 10)
+        # Directory for the server to log games to, if any
+        self.game_log = kwargs.get("game_log", None)
+        self.server_process = None
+        self.finished = threading.Event()
+
+    def start_server(self):
+        # Grab a free port for the server to listen on
+        probe = socket.socket()
+        probe.bind((self.host, 0))
+        self.port = probe.getsockname()[1]
+        probe.close()
+
+        server_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "server.py"
+        )
+        command = [
+            sys.executable, server_path,
+            "--engine", self.engine,
+            "--host", self.host,
+            "--port", str(self.port),
+            "--workers", str(self.workers)
+        ]
+        if self.game_log is not None:
+            command += ["--game-log", str(self.game_log)]
+        self.server_process = subprocess.Popen(command)
+
+        # Wait for it to start listening
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((self.host, self.port)).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("Server did not start listening")
+
+    def server_peak_rss(self):
+        """Peak resident set size of the server in KB, if we know it.
+        With worker processes that's the acceptor's and every
+        worker's added together, as the games are played in the
+        workers"""
+        if self.server_process is None:
+            return None
+        pid = self.server_process.pid
+        peaks = [
+            peak for peak in map(peak_rss, [pid] + child_pids(pid))
+            if peak is not None
+        ]
+        return sum(peaks) if peaks else None
+
+    def stop_server(self):
+        if self.server_process is None:
+            return None
+        self.server_process.terminate()
+        self.server_process.wait()
+        # Children's peak RSS is only reported once they've exited,
+        # and then only the largest of the server and its workers
+        return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    def run(self):
+        if self.port is None:
+            self.start_server()
+
+        bots = [
+            Bot(f"bot{i}", self.host, self.port, {
+                "record": self.record,
+                "binary": self.binary,
+                "delta": self.delta,
+                "computer": self.computer,
+                "script": self.script,
+                "seed": self.seed + i,
+                "timeout": self.timeout
+            })
+            for i in range(self.bots)
+        ]
+        threads = [threading.Thread(target=bot.run) for bot in bots]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        # Once enough games are played the bots still
+        # waiting for an opponent have to be stopped
+        self.finished.wait()
+        elapsed = time.perf_counter() - start
+        for bot in bots:
+            bot.stop()
+        for thread in threads:
+            thread.join()
+
+        peak_rss = self.server_peak_rss()
+        exit_rss = self.stop_server()
+        return self.report(bots, elapsed, peak_rss or exit_rss)
+
+    def record(self, result):
+        """Count finished games. Every game between bots is seen
+        by both of its players so only the winner counts a win,
+        and a draw counts as half a game from each side"""
+        self.lock.acquire()
+        if self.computer and result in ("200 WIN", "200 LOSS", "200 DRAW"):
+            self.games_played += 1
+        elif result == "200 WIN":
+            self.games_played += 1
+        elif result == "200 DRAW":
+            self.games_played += 0.5
+        done = self.games_played >= self.games
+        self.lock.release()
+        if done:
+            self.finished.set()
+        return not done
+
+    def report(self, bots, elapsed, peak_rss):
+        latencies = sorted(
+            latency for bot in bots for latency in bot.latencies
+        )
+        results = {}
+        for bot in bots:
+            for result, count in bot.results.items():
+                results[result] = results.get(result, 0) + count
+
+        # Every finished game between bots is seen by both of its
+        # players. Games against the computer are only seen by one
+        if self.computer:
+            games = (
+                results.get("200 WIN", 0) + results.get("200 LOSS", 0)
+                + results.get("200 DRAW", 0)
+            )
+        else:
+            games = (
+                results.get("200 WIN", 0) + results.get("200 DRAW", 0) / 2
+            )
+        moves = sum(bot.moves for bot in bots)
+        return {
+            "engine": self.engine,
+            "workers": self.workers,
+            "bots": self.bots,
+            "elapsed": elapsed,
+            "games": games,
+            "games_per_sec": games / elapsed,
+            "moves": moves,
+            "moves_per_sec": moves / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "results": results,
+            "errors": sum(bot.errors for bot in bots),
+            "server_peak_rss_kb": peak_rss
+        }
+
+def peak_rss(pid):
+    # VmHWM of a process in KB, or None if we can't read it
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def child_pids(pid):
+    # Processes whose parent is pid, found by their stat files
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The name in brackets can hold spaces, so the
+                # parent's pid is counted from after it
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+def percentile(values, percent):
+    # values must already be sorted
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test the 5-in-a-row server"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "asyncio"],
+        default="threads"
+    )
+    parser.add_argument("--workers", type=int, default=0,
+                        help="number of server worker processes")
+    parser.add_argument("--bots", type=int, default=20,
+                        help="number of simulated clients")
+    parser.add_argument("--games", type=int, default=100,
+                        help="total number of games to play")
+    parser.add_argument("--binary", action="store_true",
+                        help="use the binary protocol")
+    parser.add_argument("--delta", action="store_true",
+                        help="ask for delta board updates")
+    parser.add_argument("--computer", action="store_true",
+                        help="play against the server's computer player")
+    parser.add_argument("--script", default="",
+                        help="comma separated columns to play, from 1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=10,
+                        help="seconds to wait for the server before a "
+                        "bot gives up on its game")
+    parser.add_argument("--game-log", default=None,
+                        help="have the server log games to this directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None,
+                        help="benchmark a server that's already running")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    results = Benchmark({
+        "engine": args.engine,
+        "workers": args.workers,
+        "host": args.host,
+        "port": args.port,
+        "bots": args.bots,
+        "games": args.games,
+        "binary": args.binary,
+        "delta": args.delta,
+        "computer": args.computer,
+        "script": [int(c) - 1 for c in args.script.split(",") if c],
+        "seed": args.seed,
+        "timeout": args.timeout,
+        "game_log": args.game_log
+    }).run()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{results['games']:.0f} games in {results['elapsed']:.2f}s "
+              f"with {results['bots']} bots on the {results['engine']} engine")
+        print(f"games/sec: {results['games_per_sec']:.1f}")
+        print(f"moves/sec: {results['moves_per_sec']:.1f}")
+        print(f"move round trip p50: {results['p50_ms']:.2f}ms "
+              f"p99: {results['p99_ms']:.2f}ms")
+        print(f"results: {results['results']} errors: {results['errors']}")
+        print(f"server peak RSS: {results['server_peak_rss_kb']} KB")
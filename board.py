@@ -0,0 +1,170 @@
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def line_table(width, height):
+    """Every line of five cells on a board of this size as a bit
+    mask, and the lines through each cell indexed by the cell's bit.
+    Worked out once per board size and shared by every board"""
+    lines = []
+    cell_lines = [[] for cell in range(width * (height + 1))]
+    # Vertical, horizontal, / diagonal and \ diagonal
+    for step_column, step_row in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        for column in range(width):
+            for row in range(height):
+                end_column = column + 4 * step_column
+                end_row = row + 4 * step_row
+                if not (end_column < width and 0 <= end_row < height):
+                    continue
+                cells = [
+                    (column + i * step_column) * (height + 1)
+                    + row + i * step_row
+                    for i in range(5)
+                ]
+                line = 0
+                for cell in cells:
+                    line |= 1 << cell
+                lines.append(line)
+                for cell in cells:
+                    cell_lines[cell].append(line)
+    return tuple(lines), tuple(tuple(cell) for cell in cell_lines)
+
+class Board():
+    """Bitboard representation of a 5-in-a-row board
+
+    Each marker gets an integer with one bit per cell. Bits are laid
+    out column by column starting from the bottom of column 0, with a
+    spare bit on top of every column so that lines can't wrap around
+    from the top of one column into the bottom of the next"""
+
+    def __init__(self, width=9, height=6):
+        self.width = width
+        self.height = height
+        # Distance between neighbouring cells in each direction:
+        # vertical, horizontal, / diagonal and \ diagonal
+        self.shifts = (1, height + 1, height + 2, height)
+        # Lines of five on the board and the lines through each cell
+        self.lines, self.cell_lines = line_table(width, height)
+        self.clear()
+
+    def clear(self):
+        # One bitboard per marker
+        self.bitboards = {}
+        # Every cell that has a counter in it
+        self.occupied = 0
+        # Next free row in each column, counted from the bottom
+        self.heights = [0] * self.width
+        # Number of counters on the board
+        self.moves = 0
+
+    def copy(self):
+        # Independent board in the same position
+        board = Board(self.width, self.height)
+        board.bitboards = dict(self.bitboards)
+        board.occupied = self.occupied
+        board.heights = list(self.heights)
+        board.moves = self.moves
+        return board
+
+    def bit(self, column, row):
+        # row is counted from the bottom of the board
+        return 1 << (column * (self.height + 1) + row)
+
+    def drop(self, column, marker):
+        """Drop marker into column, both counted from 0. Returns
+        the row it landed in counted from the bottom, or None
+        if the column is full"""
+        row = self.heights[column]
+        # Skip over any counters left floating by load_grid
+        while row < self.height and self.occupied & self.bit(column, row):
+            row += 1
+        if row >= self.height:
+            return None
+
+        cell = self.bit(column, row)
+        self.bitboards[marker] = self.bitboards.get(marker, 0) | cell
+        self.occupied |= cell
+        self.heights[column] = row + 1
+        self.moves += 1
+        return row
+
+    def undo(self, column):
+        """Take the top counter back out of column"""
+        row = self.heights[column] - 1
+        cell = self.bit(column, row)
+        for marker in self.bitboards:
+            self.bitboards[marker] &= ~cell
+        self.occupied &= ~cell
+        self.heights[column] = row
+        self.moves -= 1
+
+    def has_five(self, marker):
+        """Shift and AND test for five in a row in any direction"""
+        bitboard = self.bitboards.get(marker, 0)
+        for shift in self.shifts:
+            # Bits that start a run of two, then of four, then of five
+            pairs = bitboard & (bitboard >> shift)
+            if pairs & (pairs >> 2 * shift) & (bitboard >> 4 * shift):
+                return True
+        return False
+
+    def has_five_through(self, column, row, marker):
+        """Check only the lines through the given cell, which
+        is all that can change when a counter is dropped there"""
+        bitboard = self.bitboards.get(marker, 0)
+        for line in self.cell_lines[column * (self.height + 1) + row]:
+            if bitboard & line == line:
+                return True
+        return False
+
+    def is_full(self):
+        return self.moves == self.width * self.height
+
+    def is_dead(self):
+        """True once nobody can get five in a row, because every
+        line already has counters from both players in it"""
+        for line in self.lines:
+            owners = 0
+            for bitboard in self.bitboards.values():
+                if bitboard & line:
+                    owners += 1
+            if owners < 2:
+                return False
+        return True
+
+    def to_grid(self):
+        """Render as a list of rows of "[X]" strings, top row first"""
+        grid = []
+        for row in range(self.height - 1, -1, -1):
+            cells = []
+            for column in range(self.width):
+                cell = self.bit(column, row)
+                cells.append("[ ]")
+                if self.occupied & cell:
+                    for marker, bitboard in self.bitboards.items():
+                        if bitboard & cell:
+                            cells[-1] = f"[{marker}]"
+            grid.append(cells)
+        return grid
+
+    def load_grid(self, grid):
+        """Load a list of rows of "[X]" strings, top row first"""
+        self.clear()
+        for i, cells in enumerate(grid):
+            row = self.height - 1 - i
+            for column, cell in enumerate(cells):
+                marker = cell.strip("[]").strip()
+                if marker:
+                    bit = self.bit(column, row)
+                    self.bitboards[marker] = (
+                        self.bitboards.get(marker, 0) | bit
+                    )
+                    self.occupied |= bit
+                    self.moves += 1
+
+        # Columns fill from the bottom up
+        for column in range(self.width):
+            row = 0
+            while (row < self.height
+                    and self.occupied & self.bit(column, row)):
+                row += 1
+            self.heights[column] = row
@@ -1,17 +1,25 @@
+import argparse
 import socket
-import json
 import logging
 import os
 import sys
+from protocol import BINARY, COMPUTER, DELTA, Connection
 
 class Client():
     # Set log level to environment variable LOGLEVEL
     # or default to ERROR
     logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
 
-    def __init__(self, username=''):
+    def __init__(self, username='', opponent=None):
         #Current user
         self.username = username
+        # Set to COMPUTER to play the computer
+        # instead of waiting for another player
+        self.opponent = opponent
+        # Our copy of the board and the number of the
+        # last move the server told us about
+        self.board = []
+        self.seq = 0
 
     def get_username(self):
         # Prompt client for username
@@ -51,19 +59,28 @@ class Client():
             )
             sys.exit()
 
+        # Sends and receives whole messages over the socket
+        self.connection = Connection(self.server_socket)
+
     def send_username(self):
         # Send username to server to register as a new player
-        client_message = json.dumps({
-            "new_player": self.username
-        })
-        self.server_socket.send(client_message.encode())
+        # Ask for the compact binary protocol and to only be sent
+        # the last move each turn. Servers that don't support them
+        # leave them out of their response and we carry on as before
+        join = {
+            "new_player": self.username,
+            "protocol": BINARY,
+            "updates": DELTA
+        }
+        if self.opponent is not None:
+            join["opponent"] = self.opponent
+        self.connection.send(join)
         logging.info("User %s sent to server", self.username)
 
         # Get response from server
-        user_response =json.loads(
-            self.server_socket.recv(4096).decode()
-        )
+        user_response = self.recv_response()
         logging.info("user_response %s ", user_response)
+        self.connection.binary = user_response.get("protocol") == BINARY
 
         # Print message on successful join
         if user_response["status"] == "200 JOIN":
@@ -81,7 +98,7 @@ class Client():
         instructions and not taking user input or taking
         user input and returning server response"""
         while True:
-            self.response=json.loads(self.server_socket.recv(4096).decode())
+            self.response=self.recv_response()
             logging.debug(
                 "Start of client loop. Response from server %s: ",
                 self.response
@@ -93,9 +110,11 @@ class Client():
             # Wait for second player to join
             while self.response["status"] == "200 WAIT_PLAYER":
                 print("We are waiting for one more player")
-                self.response=json.loads(
-                    self.server_socket.recv(4096).decode()
-                )
+                self.response=self.recv_response()
+
+            # Wait for the whole board if we've lost track of it
+            if not self.update_board(self.response):
+                continue
 
             # Wait for your first turn
             if self.response["status"] == "200 WAIT_TURN":
@@ -103,11 +122,9 @@ class Client():
 
             if self.response["status"] == "200 READY":
                 logging.info("Taking turn")
-                if ("board" in self.response.keys() and
-                        "marker" in self.response.keys()):
-                    board = self.response["board"]
+                if "marker" in self.response.keys():
                     marker = self.response["marker"]
-                    self.make_move(board, marker)
+                    self.make_move(self.board, marker)
 
                 # Wait for your turn
                 if self.response["status"] == "200 WAIT_TURN":
@@ -121,19 +138,31 @@ class Client():
             #Take user input from command line interface
             user_input=input("5row->")
 
+            # Ask the server for the best move
+            if user_input == "hint":
+                self.connection.send({"hint": True})
+                self.response=self.recv_response()
+                if self.response["status"] == "200 HINT":
+                    print(f"Try column {self.response['column']}")
+                    continue
+                self.check_game_over(self.response)
+                # Refused, as there's already a search going for us.
+                # Ask again rather than send "hint" as a move
+                print(f"Sorry {self.username}, no hint right now "
+                      f"({self.response['status']})")
+                continue
+
             #Send user input to server, and collect response
-            client_message = json.dumps({
+            self.connection.send({
                 "current_player": self.username,
                 "next_move": user_input
             })
-            self.server_socket.send(client_message.encode())
-            self.response=json.loads(
-                self.server_socket.recv(4096).decode()
-            )
+            self.response=self.recv_response()
             logging.debug(
                 "After move, response from server %s: ",
                 self.response
             )
+            self.update_board(self.response)
 
             self.check_game_over(self.response)
             # Close socket and quit if user chooses to exit
@@ -151,6 +180,36 @@ class Client():
             else:
                 input_validated = True
 
+    def update_board(self, response):
+        """Keep our copy of the board in step with the server.
+        Returns False if we've missed a move, in which case we
+        ask the server to send the whole board again"""
+        if "board" in response.keys():
+            self.board = response["board"]
+            self.seq = response.get("seq", self.seq)
+        elif "move" in response.keys():
+            if response["seq"] != self.seq + 1 or not self.board:
+                logging.info("Missed a move, asking for the board")
+                self.connection.send({"resync": True})
+                return False
+            column, row, marker = response["move"]
+            self.board[row][column] = f"[{marker}]"
+            self.seq = response["seq"]
+        elif "seq" in response.keys() and response["seq"] != self.seq:
+            # The server left the board out as we fell behind
+            logging.info("Missed the board, asking for it")
+            self.connection.send({"resync": True})
+            return False
+        return True
+
+    def recv_response(self):
+        # Wait for the next whole message from the server
+        response = self.connection.recv()
+        if response is None:
+            # Server went away without telling us
+            response = {"status": "200 DISC"}
+        return response
+
     def print_board(self, board, marker):
         print("The current state of the board is:")
         boardwidth = len(board[0])
@@ -159,6 +218,7 @@ class Client():
         print(
             f"Please enter a number between 1-{boardwidth} to place an {marker}"
         )
+        print("or enter hint for a suggestion")
 
     def check_game_over(self, response):
         # Close socket and quit if server says to disconnect
@@ -184,11 +244,10 @@ class Client():
     def exit(self):
         try:
             # Send exit message to server
-            client_message = json.dumps({
+            self.connection.send({
                 "current_player": self.username,
                 "next_move": "exit"
             })
-            self.server_socket.send(client_message.encode())
 
             # Make sure to close the socket when we're done
             self.server_socket.close()
@@ -213,4 +272,11 @@ class Client():
 
 
 if __name__ == "__main__":
-    Client().run()
+    parser = argparse.ArgumentParser(description="5-in-a-row client")
+    parser.add_argument(
+        "--computer",
+        action="store_true",
+        help="play against the computer"
+    )
+    args = parser.parse_args()
+    Client(opponent=COMPUTER if args.computer else None).run()
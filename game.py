@@ -0,0 +1,300 @@
+import logging
+import os
+import sys
+import time
+from threading import RLock
+from board import Board
+from gamelog import ABANDONED, DRAW, FIRST_PLAYER_WON, SECOND_PLAYER_WON
+
+class Game():
+    """State and rules for a single match between two players.
+    The server keeps one of these per room"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        # Guards all of this game's state. Kept across resets so
+        # nobody waiting on it ends up holding a stale lock
+        self.lock = RLock()
+        # Where finished games are recorded, if anywhere
+        self.game_log = kwargs.get("game_log", None)
+        # Server metrics to count moves and time them in, if any
+        self.metrics = kwargs.get("metrics", None)
+        # Server's timer for the player whose turn it is, if any
+        self.turn_timer = None
+        self.reset_game(kwargs)
+
+    def reset_game(self, kwargs={}):
+        # Room id assigned by the server
+        self.game_id = kwargs.get("game_id", None)
+        # Keep track of players currently in the game
+        self.players = kwargs.get("players", [])
+        # Keep track of connections
+        self.connections = kwargs.get("connections", {})
+        # Players who keep their own copy of the board and
+        # only need to be told the last move
+        self.delta_players = kwargs.get("delta_players", set())
+        # Keep track of who's turn it is
+        self.turn = kwargs.get("turn", "")
+        self.waiting = kwargs.get("waiting", "")
+        self.markers = kwargs.get("markers", {})
+        # Keep track of whether we've started the game
+        # So that we don't try start it multiple times
+        self.game_started = kwargs.get("game_started", False)
+        # Board size
+        self.boardheight = kwargs.get("boardheight", 6)
+        self.boardwidth = kwargs.get("boardwidth", 9)
+        # Board state, kept as bitboards and only rendered
+        # as a grid of strings when sent to the players
+        self.bitboard = Board(self.boardwidth, self.boardheight)
+        self.board = kwargs.get("board", [])
+        # Column and grid row of the last counter dropped and its marker
+        self.last_move = None
+        # Every column played so far, counted from 0, and
+        # the player who went first
+        self.move_history = []
+        self.first_turn = None
+        # How the game ended, once it has
+        self.result = None
+        # Check if column is full
+        self.column_full = False
+
+        # Don't start the game unless the board is the right size
+        if not(5 <= self.boardwidth <= 9 and 5 <= self.boardheight <= 9):
+            logging.error(
+                "SERVER ERROR: Board height and width \
+                must be between 5 and 9"
+            )
+            sys.exit()
+
+    # Add player to the game if there is space
+    def add_player(self, player):
+        self.lock.acquire()
+        if len(self.players) < 2:
+            self.players.append(player)
+            self.lock.release()
+            logging.info("New player %s added", player)
+            logging.info("Current players: %s", self.players)
+            return True
+        else:
+            self.lock.release()
+            return False
+
+    def start_game(self):
+        """Start the game once both players have joined.
+        Returns False if the game was already started"""
+        with self.lock:
+            if len(self.players) != 2 or self.game_started:
+                return False
+            self.game_started = True
+
+            # Initialise turn and markers
+            self.turn = self.players[0]
+            self.markers[self.players[0]] = 'X'
+            self.waiting = self.players[1]
+            self.markers[self.players[1]] = 'O'
+            logging.info(
+                "Starting game %s: %s goes first: ",
+                self.game_id,
+                self.turn
+            )
+            self.generate_board()
+            self.prompt_players()
+            self.first_turn = self.turn
+            return True
+
+    @property
+    def board(self):
+        # Grid of "[X]" strings sent to the players
+        return self.bitboard.to_grid()
+
+    @board.setter
+    def board(self, grid):
+        self.bitboard.load_grid(grid)
+
+    def prompt_players(self):
+        """Prompts players for move and automatically switches turn"""
+
+        # Switch turn
+        if self.turn==self.players[0]:
+            self.turn=self.players[1]
+            self.waiting=self.players[0]
+        else:
+            self.turn=self.players[0]
+            self.waiting=self.players[1]
+        logging.info(
+            "It's: %s's turn. %s is waiting",
+            self.turn,
+            self.waiting
+        )
+
+        # Only render the grid if someone needs the whole board
+        board = None
+        if (self.last_move is None
+                or not set(self.players) <= self.delta_players):
+            board = self.board
+
+        # Tell each player whether to go or else to wait
+        ready_json = self.board_update("200 READY", self.turn, board)
+        self.connections[self.turn].send(ready_json)
+        wait_json = self.board_update("200 WAIT_TURN", self.waiting, board)
+        self.connections[self.waiting].send(wait_json)
+
+    def board_update(self, status, player, board=None):
+        """Message telling player the state of the board. Players
+        who asked for delta updates just get the last move. The
+        sequence number lets them spot if they've missed one"""
+        message = {
+            "status": status,
+            "marker": self.markers[player],
+            "seq": self.bitboard.moves
+        }
+        if player in self.delta_players and self.last_move is not None:
+            message["move"] = list(self.last_move)
+        else:
+            message["board"] = board if board is not None else self.board
+        return message
+
+    def send_snapshot(self, player):
+        """Send the whole board to a player who has lost track of it"""
+        status = "200 READY" if player == self.turn else "200 WAIT_TURN"
+        message = self.board_update(status, player)
+        if "move" in message:
+            del message["move"]
+            message["board"] = self.board
+        self.connections[player].send(message)
+
+
+    #generate empty board
+    def generate_board(self):
+        self.bitboard.clear()
+        self.last_move = None
+        self.move_history = []
+
+    def mark_board(self, move):
+        # Decrement move as columns start at 0
+        move -= 1
+        marker = self.markers[self.turn]
+        row = self.bitboard.drop(move, marker)
+
+        # If the counter can't be dropped in
+        # the column must be full
+        if row is None:
+            self.column_full = True
+            self.connections[self.turn].send({"status": "400 COL_FULL"})
+            logging.info("Column full")
+            return
+        self.last_move = (move, self.boardheight - 1 - row, marker)
+        self.move_history.append(move)
+
+        # Only lines through the counter just dropped can have changed
+        if self.bitboard.has_five_through(move, row, marker):
+            # Record the result before telling the players, so a
+            # game they've seen end is never missing from the log
+            logging.info("%s has won!", self.turn)
+            if list(self.markers).index(self.turn) == 0:
+                self.finish(FIRST_PLAYER_WON)
+            else:
+                self.finish(SECOND_PLAYER_WON)
+            self.connections[self.turn].send({"status": "200 WIN"})
+            self.connections[self.waiting].send({"status": "200 LOSS"})
+            # TODO exit gracefully
+            # sys.exit()
+
+        # Nobody won with the last counter so a full board is a draw
+        elif self.bitboard.is_full():
+            # Record the result then inform players of it
+            logging.info("The game has ended in a draw")
+            self.finish(DRAW)
+            draw_response = {"status": "200 DRAW"}
+            self.connections[self.turn].send(draw_response)
+            self.connections[self.waiting].send(draw_response)
+            # TODO exit gracefully
+            # sys.exit()
+
+    def play_move(self, move):
+        """Drop the current player's counter in column move, counted
+        from 1, and prompt the players for the next turn"""
+        if self.metrics is None:
+            self.mark_board(move)
+        else:
+            start = time.perf_counter()
+            self.mark_board(move)
+            self.metrics.observe(
+                "mark_board_seconds", time.perf_counter() - start
+            )
+            self.metrics.inc("moves_total")
+
+        # Don't prompt both players if the
+        # last column chosen was full
+        if not self.column_full:
+            self.prompt_players()
+        else:
+            self.column_full = False
+
+    def finish(self, result):
+        """Note how the game ended and record it in the game log"""
+        if self.result is not None:
+            return
+        self.result = result
+        if self.game_log is not None:
+            # Players can leave before the game is closed but
+            # their markers stay, in the order they joined
+            players = list(self.markers)
+            self.game_log.record({
+                "game_id": self.game_id,
+                "players": players,
+                "width": self.boardwidth,
+                "height": self.boardheight,
+                "first": (players.index(self.first_turn)
+                          if self.first_turn in players else 0),
+                "moves": self.move_history,
+                "result": result
+            })
+
+    def forfeit(self, player):
+        """player has run out of time so the other player wins.
+        Returns False if the game wasn't in progress"""
+        with self.lock:
+            if (not self.game_started or self.result is not None
+                    or player not in self.players
+                    or len(self.players) != 2):
+                return False
+            winner = next(other for other in self.players if other != player)
+            logging.info("%s ran out of time", player)
+            if list(self.markers).index(winner) == 0:
+                self.finish(FIRST_PLAYER_WON)
+            else:
+                self.finish(SECOND_PLAYER_WON)
+            for name, status in ((winner, "200 WIN"), (player, "200 LOSS")):
+                try:
+                    self.connections[name].send({"status": status})
+                except OSError:
+                    logging.info("Socket for %s already closed", name)
+            return True
+
+    def check_winner(self):
+        # Five in a row in any direction for the player whose turn it is
+        return self.bitboard.has_five(self.markers[self.turn])
+
+    def check_draw(self):
+        # Check if every cell is taken
+        if self.bitboard.is_full():
+            if not self.check_winner():
+                return True
+        return False
+
+    def disconnect_clients(self):
+        logging.info("Disconnecting all players in game %s", self.game_id)
+        # Someone left before the end
+        if self.game_started:
+            self.finish(ABANDONED)
+        for player in list(self.players):
+            # Try tell each player to disconnect and remove them from list
+            try:
+                self.players.remove(player)
+                self.connections[player].send({"status": "200 DISC"})
+            except:
+                logging.info("Socket for %s already closed", player)
+        self.reset_game({"game_id": self.game_id})
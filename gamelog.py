@@ -0,0 +1,189 @@
+import glob
+import logging
+import os
+import struct
+import threading
+import time
+
+# Start of every log file: what it is and the format version
+MAGIC = b"5ROWLOG1"
+# Fixed size start of every record: when the game finished, its
+# room id, the board's width and height, the result, which player
+# moved first, the number of moves and the length of each player's
+# name. The names follow, then one byte per move giving the column
+RECORD = struct.Struct("!IIBBBBHBB")
+# Results
+DRAW = 0
+FIRST_PLAYER_WON = 1
+SECOND_PLAYER_WON = 2
+ABANDONED = 3
+RESULTS = ["draw", "first player won", "second player won", "abandoned"]
+
+class GameLog():
+    """Append only log of every finished game, kept in a directory
+    of numbered files. Recording a game only adds it to a buffer in
+    memory. A background thread writes the buffer out and fsyncs it
+    every flush_interval seconds, or sooner once flush_bytes are
+    waiting, so the server never waits on the disk. A new file is
+    started once the current one reaches max_bytes"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        self.directory = kwargs.get("directory", "gamelogs")
+        self.max_bytes = kwargs.get("max_bytes", 64 * 1024 * 1024)
+        self.flush_interval = kwargs.get("flush_interval", 1.0)
+        self.flush_bytes = kwargs.get("flush_bytes", 64 * 1024)
+        # Everything else is set up by the process that writes to the
+        # log, so workers forked from the server each get their own
+        self.pid = None
+        # Guards starting up, so two games finishing together in a
+        # new process don't both start the log
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        # Called with the start lock held
+        # Guards the buffer
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        # Only held by whoever is writing to the file
+        self.file_lock = threading.Lock()
+        self.file = None
+        self.wakeup = threading.Event()
+        self.closed = False
+        os.makedirs(self.directory, exist_ok=True)
+        self.flusher = threading.Thread(target=self.run_flusher, daemon=True)
+        self.flusher.start()
+        # Set last, as nobody takes the start lock once it's ours
+        self.pid = os.getpid()
+
+    def record(self, game):
+        """Queue a finished game to be written. game is a dict of
+        game_id, players, width, height, first, moves and result"""
+        if self.pid != os.getpid():
+            with self.start_lock:
+                if self.pid != os.getpid():
+                    self.start()
+        data = encode_record(game)
+        self.lock.acquire()
+        self.buffer += data
+        waiting = len(self.buffer)
+        self.lock.release()
+        if waiting >= self.flush_bytes:
+            self.wakeup.set()
+
+    def run_flusher(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except OSError as err:
+                logging.error("Could not write game log: %s", err)
+
+    def flush(self):
+        """Write out and fsync everything recorded so far"""
+        if self.pid != os.getpid():
+            return
+        self.lock.acquire()
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.lock.release()
+        if not data:
+            return
+
+        with self.file_lock:
+            if self.file is None or self.file.tell() >= self.max_bytes:
+                self.rotate()
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def rotate(self):
+        # Start the next numbered file. Numbers include our pid so
+        # processes sharing the directory never share a file
+        if self.file is not None:
+            self.file.close()
+        # One past the highest, as older files may have been removed
+        number = max(
+            (file_number(path) for path in log_files(self.directory)),
+            default=-1
+        ) + 1
+        path = os.path.join(
+            self.directory, f"games-{number:06d}-{os.getpid()}.log"
+        )
+        self.file = open(path, "ab")
+        self.file.write(MAGIC)
+        logging.info("Writing games to %s", path)
+
+    def close(self):
+        if self.pid != os.getpid():
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.flusher.join()
+        self.flush()
+        with self.file_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+def log_files(directory):
+    # Oldest first
+    return sorted(glob.glob(os.path.join(directory, "games-*.log")))
+
+def file_number(path):
+    # games-000012-1234.log is number 12
+    return int(os.path.basename(path).split("-")[1])
+
+def encode_record(game):
+    names = [name.encode()[:255] for name in game["players"]]
+    return RECORD.pack(
+        int(game.get("finished", time.time())),
+        game["game_id"] or 0,
+        game["width"],
+        game["height"],
+        game["result"],
+        game["first"],
+        len(game["moves"]),
+        len(names[0]),
+        len(names[1])
+    ) + names[0] + names[1] + bytes(game["moves"])
+
+def decode_records(data, offset=0):
+    """Yields (offset, game) for each record in data from offset,
+    which should be just after a file's MAGIC. Stops at a record
+    that was only partly written"""
+    while offset + RECORD.size <= len(data):
+        (finished, game_id, width, height, result, first, moves,
+         first_name, second_name) = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        end = start + first_name + second_name + moves
+        if end > len(data):
+            return
+        yield offset, {
+            "finished": finished,
+            "game_id": game_id,
+            "width": width,
+            "height": height,
+            "result": result,
+            "first": first,
+            "players": [
+                bytes(data[start:start + first_name]).decode(
+                    errors="replace"),
+                bytes(data[start + first_name:
+                           start + first_name + second_name]).decode(
+                    errors="replace")
+            ],
+            "moves": list(data[end - moves:end])
+        }
+        offset = end
+
+def read_log(path):
+    """Every game in one log file"""
+    with open(path, "rb") as log:
+        data = log.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a game log")
+    return [game for offset, game in decode_records(data, len(MAGIC))]
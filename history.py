@@ -0,0 +1,198 @@
+import argparse
+import bisect
+import datetime
+import logging
+import mmap
+import os
+from board import Board
+from gamelog import (
+    DRAW, FIRST_PLAYER_WON, MAGIC, RECORD, RESULTS, SECOND_PLAYER_WON,
+    decode_records, log_files
+)
+
+class GameHistory():
+    """Reads the games the server has recorded in its game log.
+
+    Log files are memory mapped rather than read in, and only the
+    fixed size start of each record is looked at to build indexes by
+    player, finish time and result. Games are decoded from the
+    mapped file when a query asks for them, so memory use doesn't
+    grow with the size of the log"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        self.directory = kwargs.get("directory", "gamelogs")
+        # Memory map of each log file and how far we've indexed it
+        self.paths = []
+        self.maps = []
+        self.indexed = []
+        # A game is found by its file's number and its offset
+        # in the file. These lists are all oldest first
+        self.by_player = {}
+        self.by_result = {}
+        self.by_time = []
+        # Finish times in the same order as by_time for bisecting
+        self.times = []
+        # Wins, losses and draws for every player
+        self.scores = {}
+        self.refresh()
+
+    def refresh(self):
+        """Index any games written since we last looked"""
+        for path in log_files(self.directory):
+            if path not in self.paths:
+                self.paths.append(path)
+                self.maps.append(None)
+                self.indexed.append(len(MAGIC))
+            number = self.paths.index(path)
+            if os.path.getsize(path) > self.indexed[number]:
+                self.index_file(number)
+
+    def index_file(self, number):
+        # Map the whole file again as it may have grown
+        if self.maps[number] is not None:
+            self.maps[number].close()
+        with open(self.paths[number], "rb") as log:
+            data = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps[number] = data
+        if data[:len(MAGIC)] != MAGIC:
+            logging.error("%s is not a game log", self.paths[number])
+            self.indexed[number] = len(data)
+            return
+
+        offset = self.indexed[number]
+        while offset + RECORD.size <= len(data):
+            (finished, game_id, width, height, result, first, moves,
+             first_name, second_name) = RECORD.unpack_from(data, offset)
+            start = offset + RECORD.size
+            end = start + first_name + second_name + moves
+            if end > len(data):
+                # Still being written
+                break
+            players = (
+                data[start:start + first_name].decode(errors="replace"),
+                data[start + first_name:
+                     start + first_name + second_name].decode(
+                    errors="replace")
+            )
+            self.add_to_index((number, offset), finished, players, result)
+            offset = end
+        self.indexed[number] = offset
+
+    def add_to_index(self, game, finished, players, result):
+        for player in set(players):
+            self.by_player.setdefault(player, []).append(game)
+        self.by_result.setdefault(result, []).append(game)
+        # Files are mostly in finishing order already
+        position = bisect.bisect_right(self.times, finished)
+        self.times.insert(position, finished)
+        self.by_time.insert(position, game)
+
+        for player in players:
+            self.scores.setdefault(
+                player, {"wins": 0, "losses": 0, "draws": 0}
+            )
+        if result == DRAW:
+            for player in players:
+                self.scores[player]["draws"] += 1
+        elif result in (FIRST_PLAYER_WON, SECOND_PLAYER_WON):
+            winner = result - FIRST_PLAYER_WON
+            self.scores[players[winner]]["wins"] += 1
+            self.scores[players[1 - winner]]["losses"] += 1
+
+    def game(self, game):
+        """Decode a game found by one of the queries"""
+        number, offset = game
+        for offset, record in decode_records(self.maps[number], offset):
+            return record
+
+    def latest(self, games, limit):
+        # Newest first
+        games = games[-limit:] if limit else games
+        return [self.game(game) for game in reversed(games)]
+
+    def player_games(self, player, limit=None):
+        """Player's last limit games, newest first"""
+        return self.latest(self.by_player.get(player, []), limit)
+
+    def head_to_head(self, player, opponent, limit=None):
+        """Games between two players, newest first"""
+        mine = self.by_player.get(player, [])
+        theirs = set(self.by_player.get(opponent, []))
+        return self.latest([game for game in mine if game in theirs], limit)
+
+    def result_games(self, result, limit=None):
+        """Games with the given result, newest first"""
+        return self.latest(self.by_result.get(result, []), limit)
+
+    def games_between(self, start, end):
+        """Games finished from start up to but not including end,
+        both as datetimes or unix times, oldest first"""
+        if isinstance(start, datetime.datetime):
+            start = start.timestamp()
+        if isinstance(end, datetime.datetime):
+            end = end.timestamp()
+        first = bisect.bisect_left(self.times, start)
+        last = bisect.bisect_left(self.times, end)
+        return [self.game(game) for game in self.by_time[first:last]]
+
+    def leaderboard(self, limit=10):
+        """Players with the most wins as (player, scores) pairs"""
+        players = sorted(
+            self.scores.items(),
+            key=lambda item: (-item[1]["wins"], item[1]["losses"], item[0])
+        )
+        return players[:limit]
+
+    def close(self):
+        for data in self.maps:
+            if data is not None:
+                data.close()
+        self.maps = [None] * len(self.paths)
+
+def replay(game):
+    """Board after each move of a recorded game, as grids"""
+    board = Board(game["width"], game["height"])
+    # The first player to join is X
+    markers = ["X", "O"]
+    turn = game["first"]
+    for column in game["moves"]:
+        board.drop(column, markers[turn])
+        turn = 1 - turn
+        yield board.to_grid()
+
+def describe(game):
+    finished = datetime.datetime.fromtimestamp(game["finished"])
+    return (f"{finished:%Y-%m-%d %H:%M} {game['players'][0]} v "
+            f"{game['players'][1]} on {game['width']}x{game['height']}: "
+            f"{RESULTS[game['result']]} after {len(game['moves'])} moves")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Look through the games the server has recorded"
+    )
+    parser.add_argument("directory", nargs="?", default="gamelogs",
+                        help="directory the server logged games to")
+    parser.add_argument("--player", help="show this player's games")
+    parser.add_argument("--opponent",
+                        help="only show games against this player")
+    parser.add_argument("--last", type=int, default=10,
+                        help="number of games to show")
+    args = parser.parse_args()
+
+    history = GameHistory({"directory": args.directory})
+    if args.player and args.opponent:
+        games = history.head_to_head(args.player, args.opponent, args.last)
+    elif args.player:
+        games = history.player_games(args.player, args.last)
+    else:
+        games = []
+        for position, (player, scores) in enumerate(
+                history.leaderboard(args.last)):
+            print(f"{position + 1}. {player}: {scores['wins']} wins, "
+                  f"{scores['losses']} losses, {scores['draws']} draws")
+    for game in games:
+        print(describe(game))
+    history.close()
@@ -0,0 +1,75 @@
+import logging
+import os
+from collections import deque
+from threading import Lock
+
+class Matchmaker():
+    """First in first out queue of rooms waiting for a second player.
+    Nothing polls the queue: the arrival of an opponent pairs them
+    straight away and starting the game tells the waiting player"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self):
+        self.queue = deque()
+        self.lock = Lock()
+
+    def find_game(self, player):
+        """Take the room that has been waiting longest for an
+        opponent, skipping rooms where player's name is already
+        taken. Returns None if nobody is waiting"""
+        self.lock.acquire()
+        try:
+            return self.take(player)
+        finally:
+            self.lock.release()
+
+    def join(self, player, open_room):
+        """Take a room as find_game does, or if nobody is waiting
+        call open_room and queue the room it opens before anyone
+        else can look. Two players arriving together can't each
+        open a room that way. Returns the room and whether it was
+        just opened"""
+        self.lock.acquire()
+        try:
+            game = self.take(player)
+            if game is not None:
+                return game, False
+            game = open_room()
+            self.queue.append(game)
+            logging.info("Game %s waiting for a player", game.game_id)
+            return game, True
+        finally:
+            self.lock.release()
+
+    def take(self, player):
+        # Called with the lock held
+        for game in self.queue:
+            if player not in game.players:
+                self.queue.remove(game)
+                logging.info("Paired %s with game %s", player, game.game_id)
+                return game
+        return None
+
+    def wait(self, game):
+        # Queue a room until someone arrives to play in it
+        self.lock.acquire()
+        self.queue.append(game)
+        self.lock.release()
+        logging.info("Game %s waiting for a player", game.game_id)
+
+    def remove(self, game):
+        # Room was closed before anyone arrived. Returns whether
+        # it was still waiting
+        self.lock.acquire()
+        try:
+            self.queue.remove(game)
+            return True
+        except ValueError:
+            return False
+        finally:
+            self.lock.release()
+
+    def waiting(self):
+        return len(self.queue)
@@ -0,0 +1,121 @@
+import bisect
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the buckets latencies are counted in
+LATENCY_BUCKETS = [
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025,
+    0.0005, 0.001, 0.0025, 0.005, 0.01
+]
+
+class Histogram():
+    """Counts of observed values in fixed buckets, plus their sum"""
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket and one for anything bigger
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class Metrics():
+    """Counters, gauges and histograms for the server, rendered in
+    the Prometheus text format.
+
+    Updating a counter or histogram is a dict lookup and an add,
+    with no lock, so it costs next to nothing on the hot path. With
+    the threads engine an update can very occasionally be lost to a
+    race, which is fine for monitoring. Gauges are functions only
+    called when someone scrapes, so they cost nothing otherwise"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        # Put in front of every metric's name
+        self.prefix = kwargs.get("prefix", "fiveinarow_")
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # Description of each metric
+        self.help = {}
+
+    def counter(self, name, help):
+        self.help[name] = help
+        self.counters.setdefault(name, 0)
+
+    def gauge(self, name, help, read):
+        """read is called for the current value at each scrape"""
+        self.help[name] = help
+        self.gauges[name] = read
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self.help[name] = help
+        self.histograms.setdefault(name, Histogram(buckets))
+
+    def inc(self, name, amount=1):
+        self.counters[name] += amount
+
+    def observe(self, name, value):
+        self.histograms[name].observe(value)
+
+    def render(self):
+        """Every metric in the Prometheus text format"""
+        lines = []
+        for name, value in self.counters.items():
+            self.describe(lines, name, "counter")
+            lines.append(f"{self.prefix}{name} {value}")
+        for name, read in self.gauges.items():
+            self.describe(lines, name, "gauge")
+            lines.append(f"{self.prefix}{name} {read()}")
+        for name, histogram in self.histograms.items():
+            self.describe(lines, name, "histogram")
+            # Bucket counts are cumulative
+            total = 0
+            for bound, count in zip(
+                    histogram.buckets + ["+Inf"], list(histogram.counts)):
+                total += count
+                lines.append(
+                    f'{self.prefix}{name}_bucket{{le="{bound}"}} {total}'
+                )
+            lines.append(f"{self.prefix}{name}_sum {histogram.sum}")
+            lines.append(f"{self.prefix}{name}_count {total}")
+        return "\n".join(lines) + "\n"
+
+    def describe(self, lines, name, kind):
+        lines.append(f"# HELP {self.prefix}{name} {self.help[name]}")
+        lines.append(f"# TYPE {self.prefix}{name} {kind}")
+
+    def serve(self, host="127.0.0.1", port=9337):
+        """Serve the metrics at /metrics from a background thread.
+        Returns the HTTP server so it can be shut down"""
+        http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        http_server.daemon_threads = True
+        http_server.metrics = self
+        thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+        thread.start()
+        logging.info("Serving metrics on %s port %s",
+                     host, http_server.server_address[1])
+        return http_server
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Every scrape would otherwise be printed to stderr
+        logging.debug(format, *args)
@@ -0,0 +1,154 @@
+import argparse
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+from ai import ComputerPlayer
+from board import Board
+
+# Start of a book file: what it is and the format version,
+# followed by the number of entries
+MAGIC = b"5ROWBK01"
+COUNT = struct.Struct("!I")
+# Each entry is a position's key and the column to play in it,
+# counted from 0. Entries are sorted by key
+ENTRY = struct.Struct("!QB")
+HEADER_SIZE = len(MAGIC) + COUNT.size
+# Every board size the server allows
+SIZES = [(width, height) for width in range(5, 10) for height in range(5, 10)]
+
+def position_key(board, marker, opponent):
+    """64 bit key for board with marker to move. Depends only on the
+    board size and where each side's counters are, so the same
+    position gets the same key however it was reached"""
+    size = (board.width * (board.height + 1) + 7) // 8
+    data = (
+        bytes([board.width, board.height])
+        + board.bitboards.get(marker, 0).to_bytes(size, "big")
+        + board.bitboards.get(opponent, 0).to_bytes(size, "big")
+    )
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+class OpeningBook():
+    """Best replies for the first few moves of a game on every board
+    size, read from a book file made by build_book. The file is
+    memory mapped and binary searched, so opening it costs next to
+    nothing and only the pages we look at are read"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, path):
+        with open(path, "rb") as book:
+            self.data = mmap.mmap(book.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(MAGIC)] != MAGIC:
+            self.data.close()
+            raise ValueError(f"{path} is not an opening book")
+        self.count, = COUNT.unpack_from(self.data, len(MAGIC))
+        logging.info("Opening book has %s positions", self.count)
+
+    def lookup(self, board, marker, opponent):
+        """Column for marker to play, counted from 0, or
+        None if the position isn't in the book"""
+        key = position_key(board, marker, opponent)
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, column = ENTRY.unpack_from(
+                self.data, HEADER_SIZE + middle * ENTRY.size
+            )
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                return column
+        return None
+
+    def close(self):
+        self.data.close()
+
+def book_positions(task):
+    """Best reply to every position in the first few moves on one
+    board size, as (key, column) pairs. Runs in a pool's processes
+    so it has to be at module level"""
+    width, height = task["size"]
+    computer = ComputerPlayer({
+        "depth": task["depth"],
+        "time_limit": task["time_limit"]
+    })
+    entries = {}
+
+    def visit(board, marker, opponent, moves):
+        key = position_key(board, marker, opponent)
+        if key in entries or moves >= task["plies"]:
+            return
+        entries[key] = computer.choose_move(board, marker, opponent)
+        for column in range(width):
+            row = board.drop(column, marker)
+            if row is None:
+                continue
+            if not board.has_five_through(column, row, marker):
+                visit(board, opponent, marker, moves + 1)
+            board.undo(column)
+
+    visit(Board(width, height), "X", "O", 0)
+    logging.info("Found %s positions on %sx%s", len(entries), width, height)
+    return list(entries.items())
+
+def build_book(path, kwargs={}):
+    """Search the best reply to every position in the first plies
+    moves on each board size, one process per size at a time, and
+    write them out as a book file"""
+    tasks = [{
+        "size": size,
+        "plies": kwargs.get("plies", 3),
+        "depth": kwargs.get("depth", 8),
+        "time_limit": kwargs.get("time_limit", 0.2)
+    } for size in kwargs.get("sizes", SIZES)]
+
+    entries = []
+    workers = kwargs.get("workers", os.cpu_count())
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            for positions in pool.imap_unordered(book_positions, tasks):
+                entries += positions
+    else:
+        for task in tasks:
+            entries += book_positions(task)
+    entries.sort()
+
+    # Written to one side then moved into place so a server
+    # never maps a half written book
+    with open(path + ".tmp", "wb") as book:
+        book.write(MAGIC + COUNT.pack(len(entries)))
+        for key, column in entries:
+            book.write(ENTRY.pack(key, column))
+    os.replace(path + ".tmp", path)
+    return len(entries)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build an opening book for the computer player"
+    )
+    parser.add_argument("path", nargs="?", default="openings.book")
+    parser.add_argument("--plies", type=int, default=3,
+                        help="number of moves into the game to cover")
+    parser.add_argument("--depth", type=int, default=8,
+                        help="deepest search for each position")
+    parser.add_argument("--time-limit", type=float, default=0.2,
+                        help="seconds to search each position")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of processes to search in")
+    args = parser.parse_args()
+
+    count = build_book(args.path, {
+        "plies": args.plies,
+        "depth": args.depth,
+        "time_limit": args.time_limit,
+        "workers": args.workers
+    })
+    print(f"Wrote {count} positions to {args.path}")
@@ -0,0 +1,138 @@
+import logging
+import os
+import sys
+import threading
+
+class Profiler():
+    """Samples where client handlers are spending their time.
+
+    A background thread looks at every thread's stack a few hundred
+    times a second and counts the ones running a client handler,
+    from the handler down. With the asyncio engine that's whichever
+    handler task the event loop is running at the time. Stopping
+    writes the counts out as collapsed stacks, one "a;b;c count" line
+    per stack, ready for flamegraph.pl or speedscope.
+
+    Nothing runs until start is called, so it costs nothing the
+    rest of the time"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        # Seconds between samples
+        self.interval = kwargs.get("interval", 0.005)
+        # Where to write the stacks. {pid} is filled in so every
+        # worker process writes its own file, and added before the
+        # extension if the path doesn't have it
+        self.path = kwargs.get("path", None) or "profile-{pid}.folded"
+        if "{pid}" not in self.path:
+            root, extension = os.path.splitext(self.path)
+            self.path = root + "-{pid}" + extension
+        # Functions stacks are counted from
+        self.roots = kwargs.get(
+            "roots",
+            {"server:Server.connect_client", "server:Server.connect_client_async"}
+        )
+        # Stacks ending in one of these are waiting for the client
+        # rather than doing anything, so aren't counted
+        self.idle = kwargs.get("idle", {"protocol:Connection.recv"})
+        # Count of each stack seen, as tuples of function names
+        self.samples = {}
+        # Names of functions by code object so each is only made once
+        self.names = {}
+        self.thread = None
+        self.stopping = threading.Event()
+        # Process that's sampling, as the thread doesn't survive a fork
+        self.pid = None
+
+    def running(self):
+        return self.thread is not None and self.pid == os.getpid()
+
+    def start(self):
+        if self.running():
+            return
+        self.pid = os.getpid()
+        self.samples = {}
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logging.info("Started profiling")
+
+    def stop(self):
+        """Stop sampling and write out the stacks. Returns the path
+        written to, or None if we weren't sampling"""
+        if not self.running():
+            return None
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        path = self.path.replace("{pid}", str(os.getpid()))
+        self.dump(path)
+        logging.info("Wrote profile to %s", path)
+        return path
+
+    def toggle(self):
+        # Called from the SIGUSR1 handler
+        if self.running():
+            self.stop()
+        else:
+            self.start()
+
+    def after_fork(self):
+        """Carry on sampling in a forked process if we were before"""
+        if self.thread is not None and not self.running():
+            self.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        me = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stack = self.handler_stack(frame)
+            if stack and stack[-1] not in self.idle:
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def handler_stack(self, frame):
+        """Names of the functions in frame's stack from the outermost
+        handler in, or None if it isn't running a handler"""
+        names = []
+        while frame is not None:
+            names.append(self.name(frame))
+            frame = frame.f_back
+        names.reverse()
+        for depth, name in enumerate(names):
+            if name in self.roots:
+                return tuple(names[depth:])
+        return None
+
+    def name(self, frame):
+        code = frame.f_code
+        name = self.names.get(code)
+        if name is None:
+            module = frame.f_globals.get("__name__", "?")
+            if module == "__main__":
+                # Running server.py directly
+                module = os.path.splitext(
+                    os.path.basename(code.co_filename))[0]
+            name = f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+            self.names[code] = name
+        return name
+
+    def collapsed(self):
+        """Stacks in the collapsed format, most sampled first"""
+        return [
+            ";".join(stack) + f" {count}"
+            for stack, count in sorted(
+                self.samples.items(), key=lambda item: -item[1]
+            )
+        ]
+
+    def dump(self, path):
+        with open(path, "w") as profile:
+            for line in self.collapsed():
+                profile.write(line + "\n")
@@ -0,0 +1,237 @@
+import json
+import struct
+
+# Every message is sent as a 4 byte big endian payload
+# length followed by the payload itself
+HEADER = struct.Struct("!I")
+# Largest payload we'll accept from the other end
+MAX_MESSAGE_SIZE = 64 * 1024
+
+# Clients ask for the binary protocol when they join. Anyone
+# who doesn't ask keeps talking JSON
+BINARY = "binary"
+# Clients that keep their own copy of the board ask for delta
+# updates when they join. They're sent the last move instead
+# of the whole board each turn
+DELTA = "delta"
+# Players who don't want to wait for someone to join ask
+# to play against the computer instead
+COMPUTER = "computer"
+
+# In the binary protocol a payload starts with a byte giving
+# its type. Statuses are numbered in this order
+STATUSES = [
+    "200 JOIN", "200 WAIT_PLAYER", "200 READY", "200 WAIT_TURN",
+    "200 WIN", "200 LOSS", "200 DRAW", "200 DISC",
+    "400 FULL", "400 ERR", "400 COL_FULL"
+]
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+# Types that aren't statuses
+NEXT_MOVE = 0x80
+# Anything without a compact encoding is sent as JSON after this
+JSON_MESSAGE = 0xFF
+
+# Flags byte following a status saying which fields come next
+HAS_MARKER = 1
+HAS_BOARD = 2
+HAS_MOVE = 4
+HAS_SEQ = 8
+SEQ = struct.Struct("!H")
+
+# Board cells are packed 2 bits each, top row first
+CELLS = ["[ ]", "[X]", "[O]"]
+CELL_CODES = {cell: code for code, cell in enumerate(CELLS)}
+
+class ProtocolError(Exception):
+    """Raised when the other end sends something we can't decode"""
+
+def encode_message(message, binary=False):
+    # Frame a message so it can be written straight to a socket
+    if binary:
+        payload = encode_binary(message)
+    else:
+        payload = json.dumps(message).encode()
+    return HEADER.pack(len(payload)) + payload
+
+def decode_message(payload, binary=False):
+    try:
+        if binary:
+            message = decode_binary(payload)
+        else:
+            message = json.loads(payload.decode())
+    except (ValueError, IndexError, KeyError, struct.error):
+        raise ProtocolError("Could not decode message")
+    # Valid JSON isn't necessarily a message we can handle
+    if not isinstance(message, dict):
+        raise ProtocolError("Messages must be JSON objects")
+    for field in ("new_player", "next_move"):
+        if field in message and not isinstance(message[field], str):
+            raise ProtocolError(f"{field} must be a string")
+    return message
+
+def encode_binary(message):
+    """Pack a message into the binary protocol, falling back
+    to JSON for anything that doesn't have a compact form"""
+    keys = set(message)
+    if keys <= {"current_player", "next_move"} and "next_move" in keys:
+        # The server knows who sent the move so only the move is sent
+        return bytes([NEXT_MOVE]) + message["next_move"].encode()
+
+    status = message.get("status")
+    if (status in STATUS_CODES
+            and keys <= {"status", "marker", "board", "move", "seq"}):
+        try:
+            payload = bytearray([STATUS_CODES[status], 0])
+            if "marker" in message:
+                if len(message["marker"]) != 1:
+                    raise ValueError("Markers are a single character")
+                payload[1] |= HAS_MARKER
+                payload += message["marker"].encode("ascii")
+            if "board" in message:
+                payload[1] |= HAS_BOARD
+                payload += pack_board(message["board"])
+            if "move" in message:
+                # Column and row on the grid then the marker
+                column, row, marker = message["move"]
+                if len(marker) != 1:
+                    raise ValueError("Markers are a single character")
+                payload[1] |= HAS_MOVE
+                payload += bytes([column, row]) + marker.encode("ascii")
+            if "seq" in message:
+                payload[1] |= HAS_SEQ
+                payload += SEQ.pack(message["seq"])
+            return bytes(payload)
+        except (IndexError, KeyError, TypeError, ValueError, struct.error):
+            pass
+
+    return bytes([JSON_MESSAGE]) + json.dumps(message).encode()
+
+def decode_binary(payload):
+    kind = payload[0]
+    if kind == JSON_MESSAGE:
+        return json.loads(payload[1:].decode())
+    if kind == NEXT_MOVE:
+        return {"next_move": payload[1:].decode()}
+
+    message = {"status": STATUSES[kind]}
+    flags = payload[1]
+    position = 2
+    if flags & HAS_MARKER:
+        message["marker"] = chr(payload[position])
+        position += 1
+    if flags & HAS_BOARD:
+        width = payload[position]
+        height = payload[position + 1]
+        length = 2 + (2 * width * height + 7) // 8
+        message["board"] = unpack_board(
+            payload[position:position + length]
+        )
+        position += length
+    if flags & HAS_MOVE:
+        message["move"] = [
+            payload[position],
+            payload[position + 1],
+            chr(payload[position + 2])
+        ]
+        position += 3
+    if flags & HAS_SEQ:
+        message["seq"], = SEQ.unpack_from(payload, position)
+    return message
+
+def pack_board(board):
+    # Width and height then 2 bits per cell
+    height = len(board)
+    width = len(board[0])
+    value = 0
+    for row in board:
+        if len(row) != width:
+            raise ValueError("Board rows must all be the same width")
+        for cell in row:
+            value = value << 2 | CELL_CODES[cell]
+    return bytes([width, height]) + value.to_bytes(
+        (2 * width * height + 7) // 8, "big"
+    )
+
+def unpack_board(data):
+    width = data[0]
+    height = data[1]
+    cells = width * height
+    value = int.from_bytes(data[2:2 + (2 * cells + 7) // 8], "big")
+    board = []
+    for i in range(height):
+        row = []
+        for j in range(width):
+            shift = 2 * (cells - 1 - (i * width + j))
+            row.append(CELLS[value >> shift & 3])
+        board.append(row)
+    return board
+
+class MessageBuffer():
+    """Receive buffer for one connection. Bytes are fed in as they
+    arrive and complete messages are taken out one at a time, no
+    matter how the other end's writes were split or coalesced"""
+    # There's one per connection so keep them small
+    __slots__ = ("buffer",)
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_message(self, binary=False):
+        """Returns the next complete message, or None if we
+        haven't received all of it yet"""
+        if len(self.buffer) < HEADER.size:
+            return None
+        length, = HEADER.unpack_from(self.buffer)
+        if length > MAX_MESSAGE_SIZE:
+            raise ProtocolError(f"Message of {length} bytes is too large")
+        end = HEADER.size + length
+        if len(self.buffer) < end:
+            return None
+
+        payload = bytes(self.buffer[HEADER.size:end])
+        del self.buffer[:end]
+        return decode_message(payload, binary)
+
+class Connection():
+    """Blocking socket that sends and receives whole messages"""
+    __slots__ = ("sock", "buffer", "binary", "metrics")
+
+    def __init__(self, sock, metrics=None):
+        self.sock = sock
+        self.buffer = MessageBuffer()
+        # Switched on once both ends agree to use the binary protocol
+        self.binary = False
+        # Server metrics to count bytes and send errors in, if any
+        self.metrics = metrics
+
+    def send(self, message):
+        data = encode_message(message, self.binary)
+        # sendall keeps writing until the whole frame is sent
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            if self.metrics is not None:
+                self.metrics.inc("send_errors_total")
+            raise
+        if self.metrics is not None:
+            self.metrics.inc("sent_bytes_total", len(data))
+
+    def recv(self):
+        """Block until a whole message has arrived. Returns None
+        if the other end closes the connection"""
+        while True:
+            message = self.buffer.next_message(self.binary)
+            if message is not None:
+                return message
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            if self.metrics is not None:
+                self.metrics.inc("received_bytes_total", len(data))
+            self.buffer.feed(data)
+
+    def close(self):
+        self.sock.close()
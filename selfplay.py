@@ -0,0 +1,209 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+from ai import ComputerPlayer
+from game import Game
+
+# Kinds of player that can take part
+PLAYERS = ["random", "computer"]
+
+class Recorder():
+    """Stands in for a player's connection and keeps the result
+    the game sent them. The game goes on to prompt the players
+    after a result so other statuses are ignored"""
+    __slots__ = ("result",)
+
+    def __init__(self):
+        self.result = None
+
+    def send(self, message):
+        status = message.get("status")
+        if status in ("200 WIN", "200 LOSS", "200 DRAW"):
+            self.result = status
+
+class SelfPlay():
+    """Plays lots of games without any sockets, spread over a pool of
+    processes, and adds up how they turned out for each board size.
+
+    Games are played by the same Game class the server uses, so the
+    results follow exactly the same rules. Each process sends back
+    totals for a chunk of games rather than the games themselves"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        # Games to play on each board size
+        self.games = kwargs.get("games", 1000)
+        # (width, height) of each board size to play on
+        self.sizes = kwargs.get("sizes", [(9, 6)])
+        # What plays X and what plays O
+        self.players = kwargs.get("players", ("random", "random"))
+        # Search depth and time per move for computer players
+        self.depth = kwargs.get("depth", 2)
+        self.time_limit = kwargs.get("time_limit", 0.01)
+        self.workers = kwargs.get("workers", os.cpu_count())
+        # Games each process plays before reporting back
+        self.chunk = kwargs.get("chunk", 500)
+        self.seed = kwargs.get("seed", 0)
+        # Called with the totals so far after every chunk
+        self.progress = kwargs.get("progress", None)
+
+    def tasks(self):
+        # Chunks of games for the pool, each with its own seed
+        # so the same settings always give the same results
+        index = 0
+        for width, height in self.sizes:
+            for start in range(0, self.games, self.chunk):
+                yield {
+                    "width": width,
+                    "height": height,
+                    "games": min(self.chunk, self.games - start),
+                    "players": self.players,
+                    "depth": self.depth,
+                    "time_limit": self.time_limit,
+                    "seed": f"{self.seed}-{index}"
+                }
+                index += 1
+
+    def run(self):
+        """Returns totals for each board size, keyed by "WxH" """
+        totals = {}
+        if self.workers > 1:
+            with multiprocessing.Pool(self.workers) as pool:
+                for result in pool.imap_unordered(play_games, self.tasks()):
+                    self.add(totals, result)
+        else:
+            for task in self.tasks():
+                self.add(totals, play_games(task))
+        return {size: summarise(total) for size, total in totals.items()}
+
+    def add(self, totals, result):
+        total = totals.setdefault(result["size"], {
+            "games": 0, "X": 0, "O": 0, "draws": 0, "moves": 0
+        })
+        for key in total:
+            total[key] += result[key]
+        logging.info("Played %s games on %s", total["games"], result["size"])
+        if self.progress is not None:
+            self.progress(totals)
+
+def play_games(task):
+    """Play a chunk of games and return how they went. Runs
+    in the pool's processes so it has to be at module level"""
+    rng = random.Random(task["seed"])
+    computer = ComputerPlayer({
+        "depth": task["depth"],
+        "time_limit": task["time_limit"]
+    })
+    result = {
+        "size": f"{task['width']}x{task['height']}",
+        "games": 0, "X": 0, "O": 0, "draws": 0, "moves": 0
+    }
+    for game_number in range(task["games"]):
+        winner, moves = play_game(task, rng, computer)
+        result["games"] += 1
+        result["moves"] += moves
+        if winner is None:
+            result["draws"] += 1
+        else:
+            result[winner] += 1
+    return result
+
+def play_game(task, rng, computer):
+    """Play one game. Returns the winning marker, or None for
+    a draw, and the number of counters dropped"""
+    # Players are named after their markers: the first to
+    # join is X, though as on the server O moves first
+    connections = {"X": Recorder(), "O": Recorder()}
+    game = Game({
+        "boardwidth": task["width"],
+        "boardheight": task["height"],
+        "connections": connections,
+        # Only the last move is sent each turn so the
+        # board isn't rendered as a grid every time
+        "delta_players": {"X", "O"}
+    })
+    game.add_player("X")
+    game.add_player("O")
+    game.start_game()
+
+    kinds = dict(zip(["X", "O"], task["players"]))
+    board = game.bitboard
+    while True:
+        player = game.turn
+        if kinds[player] == "computer":
+            column = computer.choose_move(board, player, game.waiting)
+        else:
+            column = rng.choice([
+                column for column in range(board.width)
+                if board.heights[column] < board.height
+            ])
+        game.play_move(column + 1)
+
+        result = connections[player].result
+        if result == "200 WIN":
+            return player, board.moves
+        if result == "200 DRAW":
+            return None, board.moves
+
+def summarise(total):
+    games = total["games"]
+    return {
+        "games": games,
+        "x_win_rate": total["X"] / games,
+        "o_win_rate": total["O"] / games,
+        "draw_rate": total["draws"] / games,
+        "average_moves": total["moves"] / games
+    }
+
+def parse_size(size):
+    # "9x6" is 9 columns by 6 rows
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Play 5-in-a-row games offline and report the results"
+    )
+    parser.add_argument("--games", type=int, default=1000,
+                        help="games to play on each board size")
+    parser.add_argument("--sizes", default="9x6",
+                        help="comma separated board sizes, e.g. 9x6,7x7")
+    parser.add_argument("--x", choices=PLAYERS, default="random",
+                        help="who plays X")
+    parser.add_argument("--o", choices=PLAYERS, default="random",
+                        help="who plays O")
+    parser.add_argument("--depth", type=int, default=2,
+                        help="search depth for computer players")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of processes to play games in")
+    parser.add_argument("--chunk", type=int, default=500,
+                        help="games each process plays before reporting")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    results = SelfPlay({
+        "games": args.games,
+        "sizes": [parse_size(size) for size in args.sizes.split(",")],
+        "players": (args.x, args.o),
+        "depth": args.depth,
+        "workers": args.workers,
+        "chunk": args.chunk,
+        "seed": args.seed
+    }).run()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for size, stats in results.items():
+            print(f"{size}: {stats['games']} games, "
+                  f"X wins {stats['x_win_rate']:.1%}, "
+                  f"O wins {stats['o_win_rate']:.1%}, "
+                  f"draws {stats['draw_rate']:.1%}, "
+                  f"{stats['average_moves']:.1f} moves on average")
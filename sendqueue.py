@@ -0,0 +1,239 @@
+import collections
+import logging
+import os
+import selectors
+import socket
+import threading
+from protocol import Connection, encode_message
+
+# What to do with a client that isn't reading what we send it
+# once its queue is full: close its connection, or leave the board
+# out of its updates until it catches up. Every message says whose
+# turn it is or how the game ended, so none are dropped outright
+DISCONNECT = "disconnect"
+DROP = "drop"
+POLICIES = [DISCONNECT, DROP]
+
+def without_board(message):
+    """message with the board or move it carries left out, or None
+    if it doesn't carry either. The status and sequence number still
+    get through, so the client knows whose turn it is and can tell
+    it's missed a move and ask for the whole board again"""
+    if "board" not in message and "move" not in message:
+        return None
+    return {
+        key: value for key, value in message.items()
+        if key not in ("board", "move")
+    }
+
+class QueuedConnection(Connection):
+    """Server end of a client's socket that never blocks on send.
+
+    Each message is written straight away if the socket will take
+    it. Whatever it won't take is queued and written by the flusher
+    thread once the client has read enough to make room, so a slow
+    or stalled client can't hold up the player who's moving. The
+    queue is bounded, and a client whose queue fills up is dealt
+    with according to policy. Receiving blocks as before"""
+    __slots__ = (
+        "flusher", "max_bytes", "policy", "lock", "queue", "queued",
+        "closed"
+    )
+
+    def __init__(self, sock, flusher, kwargs={}):
+        super().__init__(sock, kwargs.get("metrics", None))
+        self.flusher = flusher
+        # Most bytes we'll hold for the client before giving up on it
+        self.max_bytes = kwargs.get("max_bytes", 256 * 1024)
+        self.policy = kwargs.get("policy", DISCONNECT)
+        # Guards the queue, which the flusher thread writes from
+        self.lock = threading.Lock()
+        # Encoded messages still to send, the first perhaps partly sent
+        self.queue = collections.deque()
+        self.queued = 0
+        self.closed = False
+
+    def send(self, message):
+        data = encode_message(message, self.binary)
+        with self.lock:
+            if self.closed:
+                raise BrokenPipeError("Connection already closed")
+            # Nothing ahead of us so try sending now
+            sent = 0
+            if not self.queue:
+                sent = self.write(data)
+                data = data[sent:]
+                if not data:
+                    return
+            if self.queued + len(data) > self.max_bytes:
+                # Once part of a message is sent the rest has to follow
+                data = self.slow_client(None if sent else message)
+                if data is None:
+                    return
+            self.queue.append(data)
+            self.queued += len(data)
+            waiting = len(self.queue) == 1
+        # Only the first message queued needs the flusher's attention
+        if waiting:
+            self.flusher.watch(self)
+
+    def write(self, data):
+        """Send as much of data as the socket will take without
+        waiting. Returns the number of bytes sent"""
+        try:
+            sent = self.sock.send(data, socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return 0
+        except OSError:
+            if self.metrics is not None:
+                self.metrics.inc("send_errors_total")
+            raise
+        if self.metrics is not None:
+            self.metrics.inc("sent_bytes_total", sent)
+        return sent
+
+    def flush(self):
+        """Send as much of the queue as the socket will take. Called
+        by the flusher once the socket has room. Returns True once
+        there's nothing more to send"""
+        with self.lock:
+            while self.queue:
+                data = self.queue[0]
+                try:
+                    sent = self.write(data)
+                except OSError:
+                    # The client's gone. Its own handler will notice
+                    self.queue.clear()
+                    self.queued = 0
+                    return True
+                self.queued -= sent
+                if sent < len(data):
+                    self.queue[0] = data[sent:]
+                    return False
+                self.queue.popleft()
+            return True
+
+    def slow_client(self, message):
+        # Called with the lock held when a message won't fit. Returns
+        # what to queue instead, or None once the client's cut off
+        if self.policy == DROP and message is not None:
+            smaller = without_board(message)
+            if smaller is not None:
+                data = encode_message(smaller, self.binary)
+                if self.queued + len(data) <= self.max_bytes:
+                    logging.info("Left the board out for a slow client")
+                    if self.metrics is not None:
+                        self.metrics.inc("dropped_messages_total")
+                    return data
+        logging.info("Disconnecting a slow client")
+        if self.metrics is not None:
+            self.metrics.inc("slow_client_disconnects_total")
+        self.hang_up()
+        return None
+
+    def hang_up(self):
+        # Called with the lock held
+        self.closed = True
+        self.queue.clear()
+        self.queued = 0
+        # Wakes the client's handler, which ends its session
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def shutdown(self):
+        """Cut the client off from any thread. Its handler then
+        sees the connection close and cleans up after it"""
+        with self.lock:
+            self.hang_up()
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.clear()
+                self.queued = 0
+        self.flusher.forget(self)
+        self.sock.close()
+
+class Flusher():
+    """Background thread that finishes sending every connection's
+    queued messages as their sockets become writable. One serves
+    all of a process's connections"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self):
+        # Guards starting up and the list of changes
+        self.lock = threading.Lock()
+        # Started by the process that sends, so workers forked
+        # from the server each get their own thread
+        self.pid = None
+
+    def start(self):
+        # Called with the lock held
+        self.pid = os.getpid()
+        # Connections to start or stop watching, in the order asked.
+        # Only the flusher thread touches the selector
+        self.changes = collections.deque()
+        self.selector = selectors.DefaultSelector()
+        self.wakeup, self.waker = socket.socketpair()
+        self.wakeup.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def watch(self, connection):
+        """Write connection's queue out once its socket has room"""
+        self.change(connection, True)
+
+    def forget(self, connection):
+        """Stop watching a connection that's being closed. Its socket
+        number may be reused by the next client to connect"""
+        if self.pid == os.getpid():
+            self.change(connection, False)
+
+    def change(self, connection, watch):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.start()
+            self.changes.append((connection, watch))
+        try:
+            self.waker.send(b"\0", socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            # Already plenty of wakeups waiting
+            pass
+
+    def run(self):
+        while True:
+            for key, events in self.selector.select():
+                if key.fileobj is self.wakeup:
+                    self.apply_changes()
+                elif key.data.flush():
+                    self.selector.unregister(key.fileobj)
+
+    def apply_changes(self):
+        try:
+            while self.wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.changes:
+            connection, watch = self.changes.popleft()
+            registered = self.registered(connection)
+            if watch and not registered and not connection.closed:
+                self.selector.register(
+                    connection.sock, selectors.EVENT_WRITE, connection
+                )
+            elif not watch and registered:
+                self.selector.unregister(connection.sock)
+
+    def registered(self, connection):
+        try:
+            self.selector.get_key(connection.sock)
+            return True
+        # A socket that's been closed can't be looked up by number
+        # so raises ValueError unless it's registered
+        except (KeyError, ValueError):
+            return False
@@ -1,11 +1,51 @@
+import argparse
+import asyncio
+import atexit
+import concurrent.futures
+import itertools
 import socket
-import json
 import logging
+import struct
+import multiprocessing
 import os
+import queue
+import selectors
+import signal
 import sys
 import threading
-from threading import RLock
 import time
+from threading import RLock
+from ai import ComputerPlayer
+from game import Game
+from gamelog import GameLog
+from matchmaker import Matchmaker
+from metrics import Metrics
+from profiler import Profiler
+from openings import OpeningBook
+from solver import Solver
+from protocol import (
+    BINARY, COMPUTER, DELTA, MessageBuffer, ProtocolError,
+    encode_message
+)
+from sendqueue import (
+    DISCONNECT, DROP, POLICIES, Flusher, QueuedConnection, without_board
+)
+from session import Session
+from timers import TimerWheel
+
+# What workers tell the acceptor about the connections it passes
+# them, a byte at a time, so it knows where players are waiting.
+# A connection starts waiting in a new room, takes a room that was
+# waiting, or leaves or plays the computer without needing a room.
+# Rooms can also close before anyone arrives
+WAITING = b"w"
+PAIRED = b"p"
+PLACED = b"n"
+ROOM_CLOSED = b"c"
+# Sent along with each connection passed to a worker: whether the
+# acceptor is counting on hearing where it ends up, and how many
+# bytes follow that it read from the client before passing it on
+HANDOFF = struct.Struct("!BI")
 
 class Server():
     # Set log level to environment variable LOGLEVEL
@@ -16,26 +56,76 @@ class Server():
         self.reset_server(kwargs)
 
     def reset_server(self, kwargs={}):
-        # Keep track of players currently in the game
-        self.players = kwargs.get("players", [])
-        # Keep track of connections
-        self.connections = kwargs.get("connections", {})
-        # Lock for threads
+        # Keep track of every room by its game id. Each game has
+        # its own lock so games never wait on each other. Adding and
+        # removing rooms are single dict operations which the GIL
+        # already makes atomic
+        self.games = kwargs.get("games", {})
+        # Rooms waiting for a second player
+        self.matchmaker = kwargs.get("matchmaker", Matchmaker())
+        # Ids for the rooms we open. Taking the next one is atomic
+        self.game_ids = itertools.count(kwargs.get("next_game_id", 0))
+        # Best replies for the first few moves of a game, used by
+        # the computer player and for hints
+        self.opening_book = kwargs.get("opening_book", None)
+        # Answer hint and solve requests from every game. Each search
+        # takes a solver to itself, so requests from different games
+        # don't wait for each other. Their tables of positions are
+        # kept for the life of the server
+        solvers = kwargs.get("solvers", 4)
+        self.solvers = queue.SimpleQueue()
+        for solver in range(solvers):
+            self.solvers.put(Solver({"opening_book": self.opening_book}))
+        # Threads the asyncio engine searches in, off the event loop
+        self.search_pool = concurrent.futures.ThreadPoolExecutor(solvers)
+        # Deepest the computer player searches, in moves, and the
+        # seconds it spends on each move
+        self.computer_depth = kwargs.get("computer_depth", 6)
+        self.computer_time_limit = kwargs.get("computer_time_limit", 0.03)
+        # Seconds a client has to wait between solve requests
+        self.solve_interval = kwargs.get("solve_interval", 1.0)
+        # Where finished games are recorded, if anywhere
+        self.game_log = kwargs.get("game_log", None)
+        # Counters and timings served for monitoring, if wanted,
+        # and the port to serve them on
+        self.metrics = kwargs.get("metrics", None)
+        self.metrics_port = kwargs.get("metrics_port", None)
+        if self.metrics is not None:
+            self.register_metrics()
+        # Samples where handlers spend their time when switched on
+        self.profiler = kwargs.get("profiler", None)
+        # Finishes sending whatever clients' sockets won't take
+        # straight away. Each client can have at most
+        # send_queue_bytes waiting, after which the slow_clients
+        # policy says whether to disconnect it or leave the board
+        # out of its updates
+        self.flusher = kwargs.get("flusher", Flusher())
+        self.send_queue_bytes = kwargs.get("send_queue_bytes", 256 * 1024)
+        self.slow_clients = kwargs.get("slow_clients", DISCONNECT)
+        # Seconds a client can go without sending anything while
+        # it isn't in a room, and a player can take over a move,
+        # before they're cut off. None turns either off
+        self.idle_timeout = kwargs.get("idle_timeout", None)
+        self.turn_timeout = kwargs.get("turn_timeout", None)
+        # Runs every connection's and room's timeouts from one thread
+        self.timers = kwargs.get("timers", TimerWheel())
+        # Event loop timeouts are run on with the asyncio engine
+        self.loop = None
+        # Number of clients currently connected
+        self.connection_count = 0
+        # Only guards the connection count
         self.lock=RLock()
-        # Keep track of who's turn it is
-        self.turn = kwargs.get("turn", "")
-        self.waiting = kwargs.get("waiting", "")
-        self.markers = kwargs.get("markers", {})
-        # Keep track of whether we've started the game
-        # So that we don't try start it multiple times
-        self.game_started = kwargs.get("game_started", False)
-        # Board size
+        # Address to listen on
+        self.host = kwargs.get("host", "127.0.0.1")
+        self.port = kwargs.get("port", 1337)
+        # Sockets for passing connections to each worker
+        # process when games are spread over several, and a
+        # worker's end of its socket to the acceptor
+        self.worker_channels = []
+        self.acceptor = None
+        # Board size used for every new game
         self.boardheight = kwargs.get("boardheight", 6)
         self.boardwidth = kwargs.get("boardwidth", 9)
-        # Board state
-        self.board = kwargs.get("board", [])
-        # Check if column is full
-        self.column_full = False
 
         # Don't start the server unless the board is the right size
         if not(5 <= self.boardwidth <= 9 and 5 <= self.boardheight <= 9):
@@ -49,8 +139,8 @@ class Server():
 
     def setup_connection(self):
         # Setup connection parameters
-        host='127.0.0.1'
-        port=1337
+        host=self.host
+        port=self.port
 
         #Create server socket object to allow connection from client
         try:
@@ -86,275 +176,595 @@ class Server():
             )
             sys.exit()
 
-        self.client_socket.listen(5)
+        self.client_socket.listen(socket.SOMAXCONN)
         logging.info("Listening")
 
-    def connect_client(self, client_connection):
+    def connect_client(self, client_connection, first=b"", counted=False):
         """Run for each client that connects to the server
         Handles messages sent from the client and sends
-        corresponding responses"""
+        corresponding responses. first is anything the acceptor
+        already read from the client, and counted whether it wants
+        to hear where the client ends up"""
 
-        # Main connection loop. Handles all messages from client
-        while True:
-            try:
-                cmd = client_connection.recv(4096).decode()
-                logging.info("Received cmd: %s", cmd)
+        self.no_delay(client_connection)
+
+        # Player and room this connection belongs to once joined
+        session = Session(QueuedConnection(
+            client_connection, self.flusher, self.connection_settings()
+        ))
+        session.placed = not counted
+        if first:
+            session.connection.buffer.feed(first)
+            if self.metrics is not None:
+                self.metrics.inc("received_bytes_total", len(first))
+        self.count_connection(1)
+        self.start_idle_timer(session)
+
+        # Main connection loop. Handles all messages from client.
+        # However it ends, the room and connection are cleaned up
+        try:
+            while True:
+                try:
+                    cmd = session.connection.recv()
+                    session.last_active = time.monotonic()
+                    logging.info("Received cmd: %s", cmd)
+
+                    if cmd is None:
+                        logging.info("Empty message received")
+                        break
 
-                if not cmd:
-                    logging.info("Empty message received")
+                    if not self.handle_command(cmd, session):
+                        break
+
+                except (BrokenPipeError, ConnectionResetError) as conn_err:
+                    logging.error("Connection error")
+                    if self.metrics is not None:
+                        self.metrics.inc("connection_errors_total")
                     break
 
-                cmd = json.loads(cmd)
-                client_response = ""
-
-                # Keep track of who is currently playing
-                if "current_player" in cmd.keys():
-                    self.current_player = cmd["current_player"]
-
-                # Add a new player and set up match
-                if "new_player" in cmd.keys():
-                    self.current_player = cmd["new_player"]
-                    if self.add_player(cmd["new_player"]):
-                        client_response = json.dumps({
-                            "status": "200 JOIN"
-                        })
-                        client_connection.send(client_response.encode())
-
-                        # Add new player's connection to the list
-                        self.lock.acquire()
-                        self.connections[self.current_player] = client_connection
-                        self.lock.release()
-
-                        # Waiting for second player
-                        while len(self.players) == 1:
-                            client_response = json.dumps({
-                                "status": "200 WAIT_PLAYER"
-                            })
-                            client_connection.send(client_response.encode())
-                            time.sleep(2)
-
-                        # Second player has arrived we can start the game
-                        if len(self.players) == 2 and not self.game_started:
-                            # Initialise turn and markers
-                            self.turn = self.players[0]
-                            self.markers[self.players[0]] = 'X'
-                            self.waiting = self.players[1]
-                            self.markers[self.players[1]] = 'O'
-                            logging.info(
-                                "Starting game: %s goes first: ",
-                                self.turn
-                            )
-                            self.generate_board()
-                            self.prompt_players()
-                            self.game_started = True
-                    else:
-                        client_response = json.dumps({
-                            "status": "400 FULL"
-                        })
-                        client_connection.send(client_response.encode())
-
-                elif "next_move" in cmd.keys():
-                    move = cmd["next_move"]
-                    logging.info("Processing move %s: ", move)
-
-                    # Valid move
-                    if (move.isdigit() and len(move) == 1
-                            and int(move) <= self.boardwidth):
-                        logging.info("Valid move %s: ", move)
-                        self.mark_board(int(move))
-
-                        # Don't prompt both players if the
-                        # last column chosen was full
-                        if not self.column_full:
-                            self.prompt_players()
-                        else:
-                            self.column_full = False
-
-                    # User wants to exit
-                    elif move == "exit":
-                        logging.info(
-                            "self.current_player, self.players: %s %s",
-                            self.current_player,
-                            self.players
-                        )
-                        if self.current_player in self.players:
-                            self.lock.acquire()
-                            self.players.remove(self.current_player)
-                            self.lock.release()
-                        client_response = json.dumps({
-                            "status": "200 DISC"
-                        })
-                        client_connection.send(client_response.encode())
-                        client_connection.close()
-                        logging.info("Client disconnected")
-                        self.disconnect_clients()
+                except ProtocolError as protocol_err:
+                    logging.error("Protocol error: %s", protocol_err)
+                    break
+        finally:
+            self.end_connection(session)
+
+    def no_delay(self, sock):
+        # Moves are small messages that need to go straight away
+        # rather than wait on the client's delayed ACK
+        if sock is None:
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            # Not a TCP socket
+            pass
+
+    async def connect_client_async(self, reader, writer, first=b"",
+                                   counted=False):
+        """Asyncio version of connect_client. Runs as a task on
+        the event loop for each client that connects"""
+        # asyncio only turns off Nagle's algorithm for sockets it
+        # creates itself, and ours are made with protocol 0
+        self.no_delay(writer.get_extra_info("socket"))
+        # Player and room this connection belongs to once joined
+        session = Session(StreamConnection(
+            writer, self.connection_settings()
+        ))
+        session.placed = not counted
+        self.count_connection(1)
+        self.start_idle_timer(session)
+        connected = True
+
+        # Main connection loop. Handles all messages from client.
+        # However it ends, the room and connection are cleaned up
+        try:
+            while connected:
+                try:
+                    # Whatever the acceptor read from the client
+                    # before passing it on comes first
+                    data = first or await reader.read(4096)
+                    first = b""
+                    session.last_active = time.monotonic()
+
+                    if not data:
+                        logging.info("Empty message received")
                         break
+                    if self.metrics is not None:
+                        self.metrics.inc("received_bytes_total", len(data))
 
-                    # Unknown command
-                    else:
-                        client_response = json.dumps({"status": "400 ERR"})
-                        client_connection.send(client_response.encode())
-
-            except (BrokenPipeError, ConnectionResetError) as conn_err:
-                logging.error("Connection error")
-                self.disconnect_clients()
-
-    # Add player to the game if there is space
-    def add_player(self, player):
-        if len(self.players) < 2:
-            self.lock.acquire()
-            self.players.append(player)
-            self.lock.release()
-            logging.info("New player %s added", player)
-            logging.info("Current players: %s", self.players)
-            return True
+                    # Handle every complete message received so far
+                    session.connection.buffer.feed(data)
+                    cmd = session.connection.next_message()
+                    while cmd is not None:
+                        logging.info("Received cmd: %s", cmd)
+                        if not self.handle_command(cmd, session):
+                            connected = False
+                            break
+                        cmd = session.connection.next_message()
+
+                except (BrokenPipeError, ConnectionResetError) as conn_err:
+                    logging.error("Connection error")
+                    if self.metrics is not None:
+                        self.metrics.inc("connection_errors_total")
+                    break
+
+                except ProtocolError as protocol_err:
+                    logging.error("Protocol error: %s", protocol_err)
+                    break
+        finally:
+            self.end_connection(session)
+
+    def handle_command(self, cmd, session):
+        """Handle a single message from a client. Shared by the
+        thread and asyncio engines. Returns False once the
+        connection should be closed"""
+        game = session.game
+        client_connection = session.connection
+        if self.metrics is not None:
+            self.metrics.inc("messages_received_total")
+
+        # Add a new player and set up match
+        if "new_player" in cmd.keys():
+            if game is not None:
+                # Already seated in a room
+                client_connection.send({
+                    "status": "400 FULL"
+                })
+                return True
+
+            session.player = cmd["new_player"]
+            if cmd.get("opponent") == COMPUTER:
+                game = self.join_computer_game(
+                    session.player, client_connection
+                )
+                self.report(session, PLACED)
+                game.lock.acquire()
+            else:
+                # Comes back locked
+                game = self.join_game(session.player, client_connection)
+                self.report(
+                    session, PAIRED if len(game.players) == 2 else WAITING
+                )
+            try:
+                self.welcome(cmd, session, game)
+            finally:
+                game.lock.release()
+
+        # Client has lost track of the board
+        elif "resync" in cmd.keys() and game is not None:
+            with game.lock:
+                if game.game_started:
+                    game.send_snapshot(session.player)
+
+        # Player wants to know the best move, or how the game
+        # will end if both players play the best moves
+        elif (("hint" in cmd.keys() or "solve" in cmd.keys())
+                and game is not None):
+            with game.lock:
+                # Only for the player about to move in a game that's
+                # still going. On the opponent's turn the position
+                # searched would be one that can't happen
+                solve = "solve" in cmd.keys()
+                # A client gets one search at a time, and solves,
+                # which search for longer, only every so often
+                if (not game.game_started or game.result is not None
+                        or session.player != game.turn
+                        or session.searching
+                        or (solve and session.last_solve is not None
+                            and time.monotonic() - session.last_solve
+                            < self.solve_interval)):
+                    client_connection.send({"status": "400 ERR"})
+                    return True
+                session.searching = True
+                if solve:
+                    session.last_solve = time.monotonic()
+                # Searched on a copy so the game can carry on
+                board = game.bitboard.copy()
+                marker = game.markers[session.player]
+                opponent = next((
+                    game.markers[player] for player in game.players
+                    if player != session.player
+                ), "")
+
+            if self.loop is None:
+                self.send_search(
+                    session, game, self.search(board, marker, opponent, solve)
+                )
+            else:
+                # Searching on the event loop would hold up every
+                # client, so it's done in another thread
+                future = self.loop.run_in_executor(
+                    self.search_pool, self.search,
+                    board, marker, opponent, solve
+                )
+
+                def searched(future):
+                    if future.exception() is not None:
+                        session.searching = False
+                        logging.error("Search failed: %s", future.exception())
+                        return
+                    self.send_search(session, game, future.result())
+                future.add_done_callback(searched)
+
+        elif "next_move" in cmd.keys() and game is not None:
+            move = cmd["next_move"]
+            logging.info("Processing move %s: ", move)
+
+            # Everything that reads or changes the game's state, and
+            # the messages it sends, happens under the game's lock so
+            # both players see the same order of events
+            with game.lock:
+                # Valid move from the player whose turn it is
+                if (move.isdigit() and len(move) == 1
+                        and 1 <= int(move) <= game.boardwidth
+                        and game.game_started
+                        and session.player == game.turn):
+                    logging.info("Valid move %s: ", move)
+                    game.play_move(int(move))
+                    self.play_computer(game)
+                    self.start_turn(game)
+
+                # User wants to exit
+                elif move == "exit":
+                    logging.info(
+                        "player, game.players: %s %s",
+                        session.player,
+                        game.players
+                    )
+                    if session.player in game.players:
+                        game.players.remove(session.player)
+                    client_connection.send({
+                        "status": "200 DISC"
+                    })
+                    client_connection.close()
+                    logging.info("Client disconnected")
+                    self.end_session(session)
+                    return False
+
+                # Unknown command or not their turn
+                else:
+                    client_connection.send({"status": "400 ERR"})
+
+        # Anything else, including moves before joining a room
         else:
-            return False
+            client_connection.send({"status": "400 ERR"})
+
+        return True
+
+    def search(self, board, marker, opponent, solve):
+        """Response to a hint or solve request, found with
+        a solver this search has to itself"""
+        solver = self.solvers.get()
+        try:
+            if solve:
+                solution = solver.solve(board, marker, opponent)
+                return {
+                    "status": "200 SOLVE",
+                    "column": solution["column"] + 1,
+                    "result": solution["result"],
+                    "moves": solution["moves"]
+                }
+            column = solver.hint(board, marker, opponent)
+            return {"status": "200 HINT", "column": column + 1}
+        finally:
+            self.solvers.put(solver)
+
+    def send_search(self, session, game, response):
+        session.searching = False
+        # The game may be sending to this player too
+        with game.lock:
+            try:
+                session.connection.send(response)
+            except OSError:
+                # Left while we were searching
+                logging.info("Could not send search result")
+
+    def end_connection(self, session):
+        # Everything a connection holds on to is let go of here
+        self.report(session, PLACED)
+        self.end_session(session)
+        self.timers.cancel(session.idle_timer)
+        session.connection.close()
+        self.count_connection(-1)
 
-    def prompt_players(self):
-        """Prompts players for move and automatically switches turn"""
+    def end_session(self, session):
+        # Close the room this connection was playing in, if any
+        if session.game is not None:
+            self.close_game(session.game)
+            session.game = None
 
-        # Switch turn
-        if self.turn==self.players[0]:
-            self.turn=self.players[1]
-            self.waiting=self.players[0]
+    def welcome(self, cmd, session, game):
+        """Tell a player they've joined game, then start it or tell
+        them to wait. Called with the game's lock held so the game
+        can't start before they know they're in it"""
+        client_connection = session.connection
+        session.game = game
+        join_response = {"status": "200 JOIN"}
+        if cmd.get("protocol") == BINARY:
+            join_response["protocol"] = BINARY
+        if cmd.get("updates") == DELTA:
+            game.delta_players.add(session.player)
+            join_response["updates"] = DELTA
+        client_connection.send(join_response)
+
+        # Everything after the join response uses the protocol
+        # the client asked for. Old clients don't ask and keep JSON
+        client_connection.binary = "protocol" in join_response
+
+        # Second player has arrived we can start the game
+        if len(game.players) == 2:
+            game.start_game()
+            self.play_computer(game)
+            self.start_turn(game)
+
+        # Waiting for second player. Their arrival starts the game
+        # which tells this player straight away, so we only need
+        # to say we're waiting once
         else:
-            self.turn=self.players[0]
-            self.waiting=self.players[1]
-        logging.info(
-            "It's: %s's turn. %s is waiting",
-            self.turn,
-            self.waiting
+            client_connection.send({"status": "200 WAIT_PLAYER"})
+
+    def join_game(self, player, client_connection):
+        """Seat player in the room that has waited longest for a
+        second player, or open a new room if nobody is waiting.
+        Returns the room with its lock held, so nobody can start
+        the game before the player's been told they've joined.
+        The caller releases it"""
+        def open_room():
+            # Locked before anyone else can see it
+            game = self.new_game()
+            game.lock.acquire()
+            return game
+
+        # Players in the same room need distinct names as
+        # connections are looked up by player name
+        game, opened = self.matchmaker.join(player, open_room)
+        if not opened:
+            game.lock.acquire()
+
+        game.add_player(player)
+        game.connections[player] = client_connection
+        return game
+
+    def new_game(self):
+        # Open an empty room
+        game = Game({
+            "game_id": next(self.game_ids),
+            "boardheight": self.boardheight,
+            "boardwidth": self.boardwidth,
+            "game_log": self.game_log,
+            "metrics": self.metrics
+        })
+        self.games[game.game_id] = game
+        logging.info("Opened game %s", game.game_id)
+        if self.metrics is not None:
+            self.metrics.inc("games_opened_total")
+        return game
+
+    def join_computer_game(self, player, client_connection):
+        """Open a room where player takes on the computer"""
+        game = self.new_game()
+        game.add_player(player)
+        game.connections[player] = client_connection
+
+        # The computer needs a different name to the player
+        computer = ComputerPlayer({
+            "name": "Computer" if player != "Computer" else "Computer 2",
+            "opening_book": self.opening_book,
+            "depth": self.computer_depth,
+            "time_limit": self.computer_time_limit
+        })
+        game.add_player(computer.name)
+        game.connections[computer.name] = computer
+        return game
+
+    def play_computer(self, game):
+        """Let the computer take its turn if it's been told to.
+        Called with the game's lock held"""
+        computer = game.connections.get(game.turn)
+        if not isinstance(computer, ComputerPlayer) or not computer.ready:
+            return
+        if self.loop is None:
+            computer.play(game)
+            return
+
+        # Thinking on the event loop would hold up every client,
+        # so it's done in another thread on a copy of the board
+        computer.ready = False
+        moves = game.bitboard.moves
+        future = self.loop.run_in_executor(
+            self.search_pool, computer.choose_move,
+            game.bitboard.copy(), game.markers[computer.name],
+            game.markers[game.waiting]
         )
 
-        # Tell each player whether to go or else to wait
-        ready_json = {
-            "status": "200 READY",
-            "board": self.board,
-            "marker": self.markers[self.turn]
-        }
-        ready_response = json.dumps(ready_json)
-        self.connections[self.turn].send(ready_response.encode())
-        wait_json = {
-            "status": "200 WAIT_TURN",
-            "board": self.board,
-            "marker": self.markers[self.waiting]
-        }
-        wait_response = json.dumps(wait_json)
-        self.connections[self.waiting].send(wait_response.encode())
-
-
-    #generate empty board
-    def generate_board(self):
-        # Maintain board as a list of rows
-        for i in range(self.boardheight):
-            self.board.append(["[ ]"] * self.boardwidth)
-
-    def mark_board(self, move):
-        # Decrement move as list starts at 0
-        move -= 1
-        board_marked = False
-        # [0,0] is top left of the board so we need to loop
-        # from bottom to top of the column represented by move
-        # Offset by -1 as list starts at 0
-        for i in range(self.boardheight -1 , -1, -1):
-            if self.board[i][move] == "[ ]" and not board_marked:
-                self.board[i][move] = f"[{self.markers[self.turn]}]"
-                board_marked = True
-
-        # If we get to the end without marking
-        # the column must be full
-        if not board_marked:
-            self.column_full = True
-            col_full_response = json.dumps({"status": "400 COL_FULL"})
-            self.connections[self.turn].send(col_full_response.encode())
-            logging.info("Column full")
-
-        if self.check_winner():
-            # Inform players of result
-            logging.info("%s has won!", self.turn)
-            win_response = json.dumps({"status": "200 WIN"})
-            self.connections[self.turn].send(win_response.encode())
-            loss_response = json.dumps({"status": "200 LOSS"})
-            self.connections[self.waiting].send(loss_response.encode())
-            # TODO exit gracefully
-            # sys.exit()
-
-        if self.check_draw():
-            # Inform players of result
-            logging.info("The game has ended in a draw")
-            draw_response = json.dumps({"status": "200 DRAW"})
-            self.connections[self.turn].send(draw_response.encode())
-            self.connections[self.waiting].send(draw_response.encode())
-            # TODO exit gracefully
-            # sys.exit()
-
-    def check_winner(self):
-        # x is the row number y is the column number
-
-        #check horizontal spaces
-        for y in range(self.boardwidth):
-            for x in range(self.boardheight - 4):
-                if (self.markers[self.turn] in self.board[x][y] and
-                        self.markers[self.turn] in self.board[x+1][y] and
-                        self.markers[self.turn] in self.board[x+2][y] and
-                        self.markers[self.turn] in self.board[x+3][y] and
-                        self.markers[self.turn] in self.board[x+4][y]):
-                    return True
+        def chosen(future):
+            if future.exception() is not None:
+                logging.error("Computer move failed: %s", future.exception())
+                return
+            with game.lock:
+                # The player may have left while the computer thought
+                if (game.result is not None or computer.game_over
+                        or game.bitboard.moves != moves):
+                    return
+                computer.move(game, future.result())
+                self.start_turn(game)
+        future.add_done_callback(chosen)
 
-        #check vertical spaces
-        for x in range(self.boardheight):
-            for y in range(self.boardwidth - 4):
-                if (self.markers[self.turn] in self.board[x][y] and
-                        self.markers[self.turn] in self.board[x][y+1] and
-                        self.markers[self.turn] in self.board[x][y+2] and
-                        self.markers[self.turn] in self.board[x][y+3] and
-                        self.markers[self.turn] in self.board[x][y+4]):
-                    return True
+    def close_game(self, game):
+        """Disconnect everyone left in a room and forget about it"""
+        self.games.pop(game.game_id, None)
+        if self.matchmaker.remove(game):
+            self.tell_acceptor(ROOM_CLOSED)
+        with game.lock:
+            self.timers.cancel(game.turn_timer)
+            game.turn_timer = None
+            game.disconnect_clients()
+        logging.info("Closed game %s", game.game_id)
 
-        # #check / diagonal spaces
-        for x in range(self.boardheight - 4):
-            for y in range(4, self.boardwidth):
-                if (self.markers[self.turn] in self.board[x][y] and
-                        self.markers[self.turn] in self.board[x+1][y-1] and
-                        self.markers[self.turn] in self.board[x+2][y-2] and
-                        self.markers[self.turn] in self.board[x+3][y-3] and
-                        self.markers[self.turn] in self.board[x+4][y-4]):
-                    return True
+    def schedule(self, delay, callback):
+        """Call callback in about delay seconds. With the asyncio
+        engine it's called on the event loop, as that's the only
+        thread that may use the connections"""
+        loop = self.loop
+        if loop is None:
+            return self.timers.schedule(delay, callback)
+        return self.timers.schedule(
+            delay, lambda: loop.call_soon_threadsafe(callback)
+        )
 
-        #check \ diagonal spaces
-        for x in range(self.boardheight - 4):
-            for y in range(self.boardwidth - 4):
-                if (self.markers[self.turn] in self.board[x][y] and
-                        self.markers[self.turn] in self.board[x+1][y+1] and
-                        self.markers[self.turn] in self.board[x+2][y+2] and
-                        self.markers[self.turn] in self.board[x+3][y+3] and
-                        self.markers[self.turn] in self.board[x+4][y+4]):
-                    return True
+    def start_idle_timer(self, session):
+        session.last_active = time.monotonic()
+        if self.idle_timeout is not None:
+            session.idle_timer = self.schedule(
+                self.idle_timeout, lambda: self.check_idle(session)
+            )
 
-        return False
+    def check_idle(self, session):
+        """Cut off a client that's gone quiet without being in a
+        game that's still going, so it doesn't hold on to a
+        connection, or a finished room, for ever"""
+        game = session.game
+        if (game is not None and self.games.get(game.game_id) is game
+                and game.result is None):
+            # Waiting for an opponent or for them to move is fine.
+            # Taking too long over a move is up to the turn timer
+            remaining = self.idle_timeout
+        else:
+            remaining = (session.last_active + self.idle_timeout
+                         - time.monotonic())
+        if remaining > 0:
+            session.idle_timer = self.schedule(
+                remaining, lambda: self.check_idle(session)
+            )
+            return
 
-    def check_draw(self):
-        # Check if the top row is full
-        if "[ ]" not in self.board[0]:
-            if not self.check_winner():
-                return True
-        return False
+        logging.info("Disconnecting idle client")
+        if self.metrics is not None:
+            self.metrics.inc("idle_disconnects_total")
+        session.idle_timer = None
+        # The client's handler sees the connection close and
+        # cleans up after it
+        session.connection.shutdown()
 
-    def disconnect_clients(self):
-        logging.info("Disconnecting all players")
-        for player in self.players:
-            # Try tell each player to disconnect and remove them from list
-            try:
-                self.players.remove(player)
-                ready_response = json.dumps({"status": "200 DISC"})
-                self.connections[player].send(ready_response.encode())
-            except:
-                logging.info("Socket for %s already closed", player)
-        self.reset_server()
+    def start_turn(self, game):
+        """Give the player whose turn it is turn_timeout seconds to
+        move. Called with the game's lock held after every move"""
+        self.timers.cancel(game.turn_timer)
+        game.turn_timer = None
+        if (self.turn_timeout is None or not game.game_started
+                or game.result is not None
+                or isinstance(game.connections.get(game.turn),
+                              ComputerPlayer)):
+            return
+        player = game.turn
+        moves = game.bitboard.moves
+        game.turn_timer = self.schedule(
+            self.turn_timeout,
+            lambda: self.turn_timed_out(game, player, moves)
+        )
+
+    def turn_timed_out(self, game, player, moves):
+        """player took too long to move so loses the game, which
+        is then closed"""
+        with game.lock:
+            # They moved just in time, or the game's already over
+            if (game.turn != player or game.bitboard.moves != moves
+                    or self.games.get(game.game_id) is not game):
+                return
+            if not game.forfeit(player):
+                return
+            game.turn_timer = None
+            connection = game.connections.get(player)
+        if self.metrics is not None:
+            self.metrics.inc("turn_timeouts_total")
+        self.close_game(game)
+        # Free up whatever is serving them too
+        if connection is not None:
+            connection.shutdown()
+
+    def stats(self):
+        """Server wide counts. Read without taking any locks
+        so they can be checked as often as we like"""
+        return {
+            "connections": self.connection_count,
+            "games": len(self.games),
+            "waiting": self.matchmaker.waiting()
+        }
+
+    def connection_settings(self):
+        return {
+            "metrics": self.metrics,
+            "max_bytes": self.send_queue_bytes,
+            "policy": self.slow_clients
+        }
+
+    def register_metrics(self):
+        metrics = self.metrics
+        metrics.counter("connections_total", "Clients that have connected")
+        metrics.counter("games_opened_total", "Rooms opened")
+        metrics.counter("moves_total", "Counters dropped by either player")
+        metrics.counter(
+            "messages_received_total", "Messages received from clients"
+        )
+        metrics.counter("received_bytes_total", "Bytes received from clients")
+        metrics.counter("sent_bytes_total", "Bytes sent to clients")
+        metrics.counter(
+            "send_errors_total", "Messages that couldn't be sent"
+        )
+        metrics.counter(
+            "connection_errors_total", "Connections dropped by a socket error"
+        )
+        metrics.counter(
+            "dropped_messages_total",
+            "Board updates sent without the board because a client's "
+            "send queue was full"
+        )
+        metrics.counter(
+            "slow_client_disconnects_total",
+            "Clients disconnected because their send queue was full"
+        )
+        metrics.counter(
+            "idle_disconnects_total",
+            "Clients disconnected for not sending anything"
+        )
+        metrics.counter(
+            "turn_timeouts_total", "Games lost by taking too long to move"
+        )
+        # Read from the same counts as stats() when scraped
+        metrics.gauge(
+            "connections", "Clients currently connected",
+            lambda: self.connection_count
+        )
+        metrics.gauge(
+            "games", "Rooms currently open", lambda: len(self.games)
+        )
+        metrics.gauge(
+            "waiting_games", "Rooms waiting for a second player",
+            self.matchmaker.waiting
+        )
+        metrics.histogram(
+            "mark_board_seconds",
+            "Time to drop a counter, check for a win or draw "
+            "and send any result"
+        )
+
+    def start_metrics(self, worker=0):
+        """Serve metrics over HTTP if a port was given. Each worker
+        process has its own and serves them on the next port up"""
+        if self.metrics is not None and self.metrics_port is not None:
+            return self.metrics.serve(port=self.metrics_port + worker)
+
+    def count_connection(self, change):
+        self.lock.acquire()
+        self.connection_count += change
+        self.lock.release()
+        if change > 0 and self.metrics is not None:
+            self.metrics.inc("connections_total")
 
     def run(self):
         self.setup_connection()
+        self.start_metrics()
+        self.stop_on_sigterm()
 
         # Main program loop
         while True:
@@ -365,5 +775,498 @@ class Server():
             )
             client_thread.start()
 
+    def run_async(self):
+        """Serve every client from a single asyncio event loop
+        instead of starting a thread per connection"""
+        self.setup_connection()
+        self.start_metrics()
+        asyncio.run(self.serve_async())
+
+    async def serve_async(self):
+        self.client_socket.setblocking(False)
+        self.loop = asyncio.get_running_loop()
+        self.stop_on_sigterm()
+        async_server = await asyncio.start_server(
+            self.connect_client_async,
+            sock=self.client_socket
+        )
+        logging.info("Serving clients on asyncio event loop")
+        async with async_server:
+            await async_server.serve_forever()
+
+    def run_workers(self, workers, engine="threads"):
+        """Spread games over several worker processes so they can
+        use every core. This process only accepts connections and
+        passes each one on to a worker, which serves it with the
+        chosen engine. We read each connection's first message before
+        passing it on, so we know who's joining to play, and workers
+        tell us where the players we pass them end up. Each new player
+        goes to a worker where someone is waiting for an opponent if
+        there is one"""
+        self.setup_connection()
+
+        # Fork so workers start with the listening socket already set
+        # up. Each one gets its own end of a socket pair to be sent
+        # new connections over
+        context = multiprocessing.get_context("fork")
+        processes = []
+        for worker in range(workers):
+            channel, worker_channel = socket.socketpair()
+            self.worker_channels.append(channel)
+            process = context.Process(
+                target=self.run_worker,
+                args=(worker_channel, engine, worker),
+                daemon=True
+            )
+            process.start()
+            worker_channel.close()
+            processes.append(process)
+        logging.info("Started %s worker processes", workers)
+
+        self.client_socket.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(self.client_socket, selectors.EVENT_READ)
+        for worker, channel in enumerate(self.worker_channels):
+            selector.register(channel, selectors.EVENT_READ, worker)
+        # Rooms each worker has waiting for a second player, and
+        # players passed to it that haven't found a room yet
+        waiting = [0] * workers
+        pending = [0] * workers
+        # Connections whose first message hasn't all arrived, with
+        # what they've sent so far and when they connected
+        arriving = {}
+
+        # Take the workers down with us when we're told to stop
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+        count = 0
+        try:
+            while True:
+                # Catch up on what the workers have told us before
+                # passing on any new player
+                ready = sorted(
+                    selector.select(1 if arriving else None),
+                    key=lambda item: (item[0].fileobj is self.client_socket,
+                                      item[0].fileobj in arriving)
+                )
+                for key, events in ready:
+                    if key.fileobj is self.client_socket:
+                        self.accept_arrivals(selector, arriving)
+                        continue
+                    if key.fileobj not in arriving:
+                        self.hear_from_worker(selector, key, waiting, pending)
+                        continue
+                    first = self.read_arrival(selector, arriving, key.fileobj)
+                    if first is None:
+                        continue
+                    conn, data, joining = first
+                    if joining:
+                        worker = self.pick_worker(waiting, pending, count)
+                        pending[worker] += 1
+                    else:
+                        worker = count % workers
+                    count += 1
+                    socket.send_fds(
+                        self.worker_channels[worker],
+                        [HANDOFF.pack(joining, len(data)) + data],
+                        [conn.fileno()]
+                    )
+                    # The worker has its own copy now
+                    conn.close()
+                self.drop_idle_arrivals(selector, arriving)
+        finally:
+            # Each worker writes out its game log when it gets SIGTERM,
+            # so wait for them all to finish doing that
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+
+    def accept_arrivals(self, selector, arriving):
+        # Take every connection waiting to be accepted and hold on
+        # to it until its first message is in
+        while True:
+            try:
+                conn, addr = self.client_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            conn.setblocking(False)
+            selector.register(conn, selectors.EVENT_READ)
+            arriving[conn] = (MessageBuffer(), bytearray(), time.monotonic())
+
+    def read_arrival(self, selector, arriving, conn):
+        """Read what a new connection has sent. Returns the connection,
+        everything read from it and whether it's joining to play
+        against someone once its first message is in, else None"""
+        buffer, data, connected = arriving[conn]
+        try:
+            received = conn.recv(4096)
+        except BlockingIOError:
+            return None
+        except OSError:
+            received = b""
+        buffer.feed(received)
+        data += received
+        try:
+            message = buffer.next_message() if received else None
+        except ProtocolError as protocol_err:
+            logging.error("Protocol error: %s", protocol_err)
+            received = b""
+        if not received:
+            # Left, or sent something nobody could handle, before
+            # a worker ever heard about it
+            self.forget_arrival(selector, arriving, conn)
+            conn.close()
+            return None
+        if message is None:
+            return None
+        self.forget_arrival(selector, arriving, conn)
+        conn.setblocking(True)
+        joining = ("new_player" in message
+                   and message.get("opponent") != COMPUTER)
+        return conn, bytes(data), joining
+
+    def forget_arrival(self, selector, arriving, conn):
+        selector.unregister(conn)
+        del arriving[conn]
+
+    def drop_idle_arrivals(self, selector, arriving):
+        # Clients that connect and never say anything are cut off
+        # after the idle timeout, the same as they would be by a worker
+        if self.idle_timeout is None:
+            return
+        now = time.monotonic()
+        for conn, (buffer, data, connected) in list(arriving.items()):
+            if now - connected > self.idle_timeout:
+                logging.info("Disconnecting a client that never joined")
+                self.forget_arrival(selector, arriving, conn)
+                conn.close()
+
+    def hear_from_worker(self, selector, key, waiting, pending):
+        """Keep count of where players are waiting from what a
+        worker has told us"""
+        worker = key.data
+        news = key.fileobj.recv(4096)
+        if not news:
+            logging.error("Worker %s has gone", worker)
+            selector.unregister(key.fileobj)
+            return
+        for byte in news:
+            byte = bytes([byte])
+            if byte in (WAITING, PAIRED, PLACED):
+                pending[worker] = max(pending[worker] - 1, 0)
+            if byte == WAITING:
+                waiting[worker] += 1
+            elif byte in (PAIRED, ROOM_CLOSED):
+                waiting[worker] = max(waiting[worker] - 1, 0)
+
+    def pick_worker(self, waiting, pending, count):
+        """Worker to pass the next player to, given how many rooms
+        each has waiting and how many players passed to it haven't
+        found a room yet. count is how many connections have been
+        passed so far, for sharing out the rest"""
+        # A waiting room that nobody already on their way will take
+        for worker in range(len(waiting)):
+            if waiting[worker] > pending[worker]:
+                return worker
+        # Someone on their way who'll be left without an opponent
+        for worker in range(len(waiting)):
+            if (waiting[worker] + pending[worker]) % 2:
+                return worker
+        return count % len(waiting)
+
+    def run_worker(self, channel, engine, worker=0):
+        """Serve every connection the acceptor passes to us. Each
+        worker has its own rooms and matchmaker"""
+        # Only the acceptor takes new connections. Closing our copies
+        # of its channels lets other workers notice when it's gone
+        self.client_socket.close()
+        for acceptor_channel in self.worker_channels:
+            acceptor_channel.close()
+        self.worker_channels = []
+        # Where we tell the acceptor what became of its connections
+        self.acceptor = channel
+        self.start_metrics(worker)
+        if self.profiler is not None:
+            self.profiler.after_fork()
+
+        if engine == "asyncio":
+            asyncio.run(self.serve_worker_async(channel))
+            return
+
+        self.stop_on_sigterm()
+
+        while True:
+            handoff = self.receive_connection(channel)
+            if handoff is None:
+                break
+            client_thread = threading.Thread(
+                target=self.connect_client,
+                args=handoff
+            )
+            client_thread.start()
+
+    def report(self, session, news):
+        """Tell the acceptor where a connection it passed us ended
+        up. Only the first news of each connection is sent"""
+        if session.placed:
+            return
+        session.placed = True
+        self.tell_acceptor(news)
+
+    def tell_acceptor(self, news):
+        # Only workers have an acceptor to tell
+        if self.acceptor is None:
+            return
+        try:
+            self.acceptor.send(news)
+        except OSError:
+            # The acceptor's gone. We'll notice when we next
+            # wait for a connection from it
+            pass
+
+    def stop_on_sigterm(self):
+        """Write out the game log before going when we're told to
+        stop. Workers end without running atexit handlers, and client
+        threads keep a single process from ever getting to them"""
+        if self.loop is not None:
+            # Wait until the loop is between callbacks, as one of
+            # them could be part way through recording a game
+            self.loop.add_signal_handler(signal.SIGTERM, self.terminated)
+        else:
+            signal.signal(
+                signal.SIGTERM, lambda signum, frame: self.terminated()
+            )
+
+    def terminated(self):
+        logging.info("Stopping")
+        if self.game_log is not None:
+            self.game_log.close()
+        if self.profiler is not None:
+            self.profiler.stop()
+        # Then go the way SIGTERM would have taken us
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    async def serve_worker_async(self, channel):
+        loop = asyncio.get_running_loop()
+        self.loop = loop
+        self.stop_on_sigterm()
+        acceptor_closed = loop.create_future()
+        # Keep hold of the tasks so they aren't garbage collected
+        tasks = set()
+
+        def accept():
+            handoff = self.receive_connection(channel)
+            if handoff is None:
+                loop.remove_reader(channel)
+                acceptor_closed.set_result(None)
+                return
+            handoff[0].setblocking(False)
+            task = loop.create_task(self.connect_socket_async(*handoff))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        loop.add_reader(channel, accept)
+        logging.info("Serving clients on asyncio event loop")
+        await acceptor_closed
+
+    async def connect_socket_async(self, conn, first, counted):
+        reader, writer = await asyncio.open_connection(sock=conn)
+        await self.connect_client_async(reader, writer, first, counted)
+
+    def receive_connection(self, channel):
+        """Next connection passed over by the acceptor, with what
+        it read from the client and whether it's counting on hearing
+        where the connection ends up. Returns None once the acceptor
+        has gone away"""
+        message, fds, flags, address = socket.recv_fds(
+            channel, HANDOFF.size, 1
+        )
+        if not fds:
+            return None
+        counted, length = HANDOFF.unpack(message)
+        first = channel.recv(length, socket.MSG_WAITALL) if length else b""
+        return socket.socket(fileno=fds[0]), first, bool(counted)
+
+class StreamConnection():
+    """Wraps an asyncio StreamWriter so the game can send to it
+    the same way it sends to a blocking socket"""
+    __slots__ = ("writer", "buffer", "binary", "metrics", "max_bytes", "policy")
+
+    def __init__(self, writer, kwargs={}):
+        self.writer = writer
+        self.buffer = MessageBuffer()
+        # Switched on once both ends agree to use the binary protocol
+        self.binary = False
+        # Server metrics to count bytes and send errors in, if any
+        self.metrics = kwargs.get("metrics", None)
+        # Most bytes the transport may hold for the client and what
+        # to do with the client once it's holding that many
+        self.max_bytes = kwargs.get("max_bytes", 256 * 1024)
+        self.policy = kwargs.get("policy", DISCONNECT)
+
+    def send(self, message):
+        # Queued on the transport and flushed by the event loop
+        # so this never blocks
+        if self.writer.is_closing():
+            if self.metrics is not None:
+                self.metrics.inc("send_errors_total")
+            raise BrokenPipeError("Stream already closed")
+        data = encode_message(message, self.binary)
+        if not self.fits(data):
+            data = self.slow_client(message)
+            if data is None:
+                return
+        self.writer.write(data)
+        if self.metrics is not None:
+            self.metrics.inc("sent_bytes_total", len(data))
+
+    def fits(self, data):
+        buffered = self.writer.transport.get_write_buffer_size()
+        return buffered + len(data) <= self.max_bytes
+
+    def slow_client(self, message):
+        # The client isn't reading what we send it. Returns what to
+        # send instead, or None once the client's cut off
+        if self.policy == DROP:
+            smaller = without_board(message)
+            if smaller is not None:
+                data = encode_message(smaller, self.binary)
+                if self.fits(data):
+                    logging.info("Left the board out for a slow client")
+                    if self.metrics is not None:
+                        self.metrics.inc("dropped_messages_total")
+                    return data
+        logging.info("Disconnecting a slow client")
+        if self.metrics is not None:
+            self.metrics.inc("slow_client_disconnects_total")
+        self.shutdown()
+        return None
+
+    def shutdown(self):
+        # Closes straight away without waiting to send what's
+        # buffered. The client's handler then sees end of file.
+        # Only call from the event loop's thread
+        self.writer.transport.abort()
+
+    def next_message(self):
+        # Next whole message fed into the buffer, if there is one
+        return self.buffer.next_message(self.binary)
+
+    def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
+
 if __name__ == "__main__":
-    Server().run()
+    parser = argparse.ArgumentParser(description="5-in-a-row server")
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="serve clients with a thread each or on one asyncio loop"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1337)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="spread games over this many worker processes"
+    )
+    parser.add_argument(
+        "--game-log",
+        default=None,
+        help="directory to record every finished game in"
+    )
+    parser.add_argument(
+        "--opening-book",
+        default=None,
+        help="opening book made by openings.py for the computer player"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="serve Prometheus metrics on this local port"
+    )
+    parser.add_argument(
+        "--send-queue-bytes",
+        type=int,
+        default=256 * 1024,
+        help="most bytes to hold for a client that isn't reading"
+    )
+    parser.add_argument(
+        "--slow-clients",
+        choices=POLICIES,
+        default=DISCONNECT,
+        help="disconnect clients whose send queue is full or leave "
+             "the board out of their updates until they catch up"
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=300,
+        help="seconds a client can send nothing while not in a room "
+             "before it's disconnected, or 0 for no limit"
+    )
+    parser.add_argument(
+        "--turn-timeout",
+        type=float,
+        default=120,
+        help="seconds a player has to move before losing the game, "
+             "or 0 for no limit"
+    )
+    parser.add_argument(
+        "--computer-depth",
+        type=int,
+        default=6,
+        help="deepest the computer player searches, in moves"
+    )
+    parser.add_argument(
+        "--computer-time",
+        type=float,
+        default=0.03,
+        help="seconds the computer player spends on each move"
+    )
+    args = parser.parse_args()
+
+    opening_book = None
+    if args.opening_book is not None:
+        opening_book = OpeningBook(args.opening_book)
+
+    game_log = None
+    if args.game_log is not None:
+        game_log = GameLog({"directory": args.game_log})
+        # Write out whatever is still buffered when we exit
+        atexit.register(game_log.close)
+
+    # Sample where handlers spend their time. Starts straight away
+    # if PROFILE is set, and SIGUSR1 switches it on or off without
+    # a restart, writing out the stacks when it's switched off
+    profiler = Profiler({"path": os.environ.get("PROFILE")})
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.toggle())
+    atexit.register(profiler.stop)
+    if os.environ.get("PROFILE"):
+        profiler.start()
+
+    server = Server({
+        "host": args.host,
+        "port": args.port,
+        "game_log": game_log,
+        "opening_book": opening_book,
+        "metrics": Metrics() if args.metrics_port is not None else None,
+        "metrics_port": args.metrics_port,
+        "profiler": profiler,
+        "send_queue_bytes": args.send_queue_bytes,
+        "slow_clients": args.slow_clients,
+        "idle_timeout": args.idle_timeout or None,
+        "turn_timeout": args.turn_timeout or None,
+        "computer_depth": args.computer_depth,
+        "computer_time_limit": args.computer_time
+    })
+    if args.workers > 0:
+        server.run_workers(args.workers, args.engine)
+    elif args.engine == "asyncio":
+        server.run_async()
+    else:
+        server.run()
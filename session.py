@@ -0,0 +1,30 @@
+class Session():
+    """Everything the server knows about one client connection.
+    Each connection's handler owns its session so nothing about a
+    client is kept on the Server where other handlers could race
+    on it. Slots keep thousands of these small"""
+    __slots__ = (
+        "player", "game", "connection", "last_active", "idle_timer",
+        "searching", "last_solve", "placed"
+    )
+
+    def __init__(self, connection):
+        # Name the client joined with
+        self.player = None
+        # Room the client is playing in once joined
+        self.game = None
+        # Sends and receives whole messages. Holds the
+        # socket or stream and the receive buffer
+        self.connection = connection
+        # When the client last sent us anything, by time.monotonic,
+        # and the timer that checks it hasn't gone quiet
+        self.last_active = None
+        self.idle_timer = None
+        # Whether a hint or solve is being searched for the client,
+        # and when it last asked to solve, so it can't tie up every
+        # solver on the server
+        self.searching = False
+        self.last_solve = None
+        # Whether the acceptor that passed us the connection has
+        # been told where it ended up
+        self.placed = False
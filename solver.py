@@ -0,0 +1,195 @@
+import logging
+import os
+import random
+from threading import Lock
+from ai import WIN, ComputerPlayer
+
+# Scores this close to WIN can only come from a forced result. No
+# board has more cells than this so no game can take longer
+MAX_MOVES = 81
+# How a stored score relates to the true score of a position
+EXACT = 0
+# True score is at least this much
+LOWER = 1
+# True score is at most this much
+UPPER = 2
+
+class Solver(ComputerPlayer):
+    """Answers hint and solve requests for any game on the server.
+
+    Uses the computer player's search, backed by a transposition
+    table. Positions are reached by many different orders of moves,
+    so each one is stored under its Zobrist hash. The table is kept
+    for the life of the server, so popular positions are answered
+    from it. It's a fixed size: when two positions want the same
+    slot, the deeper search wins unless the old entry is from an
+    earlier request"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        super().__init__({
+            "depth": kwargs.get("depth", MAX_MOVES),
+            "time_limit": kwargs.get("time_limit", 0.05),
+            "opening_book": kwargs.get("opening_book", None)
+        })
+        # Seconds to spend proving a result when asked to solve.
+        # The game's other player waits while we do
+        self.solve_time_limit = kwargs.get("solve_time_limit", 0.25)
+        # Number of slots in the table, rounded up to a power of two
+        # so a hash can be turned into a slot with a mask
+        size = 1 << (kwargs.get("table_size", 1 << 16) - 1).bit_length()
+        self.mask = size - 1
+        # Each slot holds a tuple of
+        # (hash, depth, score, bound, generation) or None
+        self.table = [None] * size
+        # Bumped for every request so entries from earlier
+        # requests can be told apart and replaced first
+        self.generation = 0
+        # Random numbers for every marker on every cell and for
+        # whose turn it is. Seeded so hashes are the same every run
+        self.random = random.Random(kwargs.get("seed", 0))
+        self.keys = {}
+        self.turn_keys = 0
+        # Hash of the position the search is looking at
+        self.hash = 0
+        self.hits = 0
+        # Only one request can use the search at a time
+        self.lock = Lock()
+
+    def cell_keys(self, marker):
+        """Random numbers for marker on each cell. The one after
+        the last cell is for it being marker's turn"""
+        if marker not in self.keys:
+            self.keys[marker] = [
+                self.random.getrandbits(64)
+                for cell in range(MAX_MOVES + 10)
+            ]
+        return self.keys[marker]
+
+    def position_hash(self, board, marker):
+        """Zobrist hash of board with marker to move"""
+        position = self.cell_keys(marker)[-1]
+        for other, bitboard in board.bitboards.items():
+            keys = self.cell_keys(other)
+            # XOR in the key for every set bit
+            while bitboard:
+                cell = (bitboard & -bitboard).bit_length() - 1
+                position ^= keys[cell]
+                bitboard &= bitboard - 1
+        return position
+
+    def hint(self, board, marker, opponent):
+        """Best column for marker, counted from 0, found within
+        the time allowed for a hint"""
+        if self.opening_book is not None:
+            column = self.opening_book.lookup(board, marker, opponent)
+            if column is not None:
+                return column
+        return self.solve(
+            board, marker, opponent, self.time_limit
+        )["column"]
+
+    def solve(self, board, marker, opponent, time_limit=None):
+        """Best column for marker, counted from 0, and the result
+        of the game if it can be proven in the time allowed: win,
+        loss or draw and in how many more moves"""
+        with self.lock:
+            self.generation += 1
+            self.hits = 0
+            default_time_limit = self.time_limit
+            if time_limit is None:
+                time_limit = self.solve_time_limit
+            self.time_limit = time_limit
+            self.hash = self.position_hash(board, marker)
+            # Every move changes whose turn it is
+            self.turn_keys = (
+                self.cell_keys(marker)[-1] ^ self.cell_keys(opponent)[-1]
+            )
+            try:
+                column, score, depth = self.search(board, marker, opponent)
+            finally:
+                self.time_limit = default_time_limit
+            logging.info(
+                "Solved to depth %s with %s table hits", depth, self.hits
+            )
+
+        solution = {"column": column, "result": None, "moves": None}
+        empty = board.width * board.height - board.moves
+        if abs(score) >= WIN - MAX_MOVES:
+            solution["result"] = "win" if score > 0 else "loss"
+            solution["moves"] = WIN - abs(score) + 1
+        elif depth >= empty:
+            # Every way the game could go has been looked at
+            # and nobody can force a win
+            solution["result"] = "draw"
+            solution["moves"] = empty
+        elif board.is_dead():
+            # Nobody can win however the game carries on
+            solution["result"] = "draw"
+            solution["moves"] = empty
+        return solution
+
+    def drop(self, board, column, marker):
+        row = board.drop(column, marker)
+        cell = column * (board.height + 1) + row
+        self.hash ^= self.cell_keys(marker)[cell] ^ self.turn_keys
+        return row
+
+    def undo(self, board, column, row, marker):
+        board.undo(column)
+        cell = column * (board.height + 1) + row
+        self.hash ^= self.cell_keys(marker)[cell] ^ self.turn_keys
+
+    def negamax(self, board, depth, alpha, beta, marker, opponent, ply,
+                timed=True):
+        entry = self.table[self.hash & self.mask]
+        if (entry is not None and entry[0] == self.hash
+                and entry[1] >= depth):
+            self.hits += 1
+            score = self.from_table(entry[2], ply)
+            bound = entry[3]
+            if (bound == EXACT
+                    or (bound == LOWER and score >= beta)
+                    or (bound == UPPER and score <= alpha)):
+                return score
+
+        original_alpha = alpha
+        score = super().negamax(
+            board, depth, alpha, beta, marker, opponent, ply, timed
+        )
+        if score <= original_alpha:
+            bound = UPPER
+        elif score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.store(depth, self.to_table(score, ply), bound)
+        return score
+
+    def store(self, depth, score, bound):
+        slot = self.hash & self.mask
+        entry = self.table[slot]
+        # Keep deeper searches of other positions from this request
+        if (entry is None or entry[0] == self.hash
+                or entry[4] != self.generation or entry[1] <= depth):
+            self.table[slot] = (
+                self.hash, depth, score, bound, self.generation
+            )
+
+    def to_table(self, score, ply):
+        # Wins and losses are stored counted from the position
+        # itself rather than from where the search started
+        if score >= WIN - MAX_MOVES:
+            return score + ply
+        if score <= -WIN + MAX_MOVES:
+            return score - ply
+        return score
+
+    def from_table(self, score, ply):
+        if score >= WIN - MAX_MOVES:
+            return score - ply
+        if score <= -WIN + MAX_MOVES:
+            return score + ply
+        return score
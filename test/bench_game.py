@@ -0,0 +1,125 @@
+"""Micro-benchmarks for the game logic hot paths
+
+Not collected by a plain `python -m pytest` run. Needs pytest-benchmark:
+
+    pip install pytest-benchmark
+    python -m pytest test/bench_game.py --benchmark-json=bench.json
+
+Save a run with --benchmark-autosave and compare the next one
+against it with --benchmark-compare"""
+import random
+import pytest
+from board import Board
+from game import Game
+from protocol import encode_message
+
+pytest.importorskip("pytest_benchmark")
+
+# Every board size reset_game allows
+SIZES = [
+    (width, height) for width in range(5, 10) for height in range(5, 10)
+]
+# Fraction of the board filled in early, mid and late game positions
+PHASES = {"early": 0.1, "mid": 0.5, "late": 0.9}
+ROUNDS = 500
+
+class NullConnection():
+    # Accepts messages without doing anything with them
+    def send(self, message):
+        pass
+
+class EncodingConnection():
+    # Encodes messages like a real connection without sending them
+    def __init__(self, binary=False):
+        self.binary = binary
+
+    def send(self, message):
+        encode_message(message, self.binary)
+
+def build_position(width, height, phase, seed=0):
+    """Moves for a position with the given fraction of the board
+    filled in, where nobody has won yet and the last column
+    played still has room for another counter"""
+    rng = random.Random(f"{width}x{height}-{phase}-{seed}")
+    target = int(width * height * PHASES[phase])
+    board = Board(width, height)
+    moves = []
+    markers = ["X", "O"]
+    while len(moves) < target:
+        marker = markers[len(moves) % 2]
+        columns = [
+            column for column in range(width)
+            if board.heights[column] < height - 1
+        ]
+        rng.shuffle(columns)
+        for column in columns:
+            row = board.drop(column, marker)
+            if not board.has_five_through(column, row, marker):
+                moves.append(column)
+                break
+            # Take back a winning move and try another column
+            board.undo(column)
+        else:
+            break
+    return board.to_grid(), moves
+
+def new_game(width, height, phase, connection=None):
+    grid, moves = build_position(width, height, phase)
+    connection = connection or NullConnection()
+    game = Game({
+        "boardwidth": width,
+        "boardheight": height,
+        "players": ["Alice", "Bob"],
+        "turn": "Alice",
+        "waiting": "Bob",
+        "markers": {"Alice": "X" if len(moves) % 2 == 0 else "O",
+                    "Bob": "O" if len(moves) % 2 == 0 else "X"},
+        "connections": {"Alice": connection, "Bob": connection},
+        "board": grid
+    })
+    # Column the next counter goes in, counted from 1
+    open_columns = [
+        column for column in range(width)
+        if game.bitboard.heights[column] < height
+    ]
+    return game, open_columns[len(moves) % len(open_columns)] + 1
+
+@pytest.mark.parametrize("phase", PHASES)
+@pytest.mark.parametrize("width,height", SIZES)
+def test_mark_board(benchmark, width, height, phase):
+    def setup():
+        game, column = new_game(width, height, phase)
+        return (game, column), {}
+
+    benchmark.pedantic(
+        lambda game, column: game.mark_board(column),
+        setup=setup,
+        rounds=ROUNDS
+    )
+
+@pytest.mark.parametrize("phase", PHASES)
+@pytest.mark.parametrize("width,height", SIZES)
+def test_check_winner(benchmark, width, height, phase):
+    game, column = new_game(width, height, phase)
+    benchmark.pedantic(game.check_winner, rounds=ROUNDS)
+
+@pytest.mark.parametrize("phase", PHASES)
+@pytest.mark.parametrize("width,height", SIZES)
+def test_check_draw(benchmark, width, height, phase):
+    game, column = new_game(width, height, phase)
+    benchmark.pedantic(game.check_draw, rounds=ROUNDS)
+
+@pytest.mark.parametrize("width,height", SIZES)
+def test_generate_board(benchmark, width, height):
+    game = Game({"boardwidth": width, "boardheight": height})
+    benchmark.pedantic(game.generate_board, rounds=ROUNDS)
+
+@pytest.mark.parametrize("binary", [False, True], ids=["json", "binary"])
+@pytest.mark.parametrize("phase", PHASES)
+@pytest.mark.parametrize("width,height", SIZES)
+def test_prompt_players(benchmark, width, height, phase, binary):
+    # Covers rendering the board and encoding both messages
+    game, column = new_game(
+        width, height, phase, EncodingConnection(binary)
+    )
+    benchmark.pedantic(game.prompt_players, rounds=ROUNDS)
@@ -0,0 +1,45 @@
+import pytest
+import time
+from ai import ComputerPlayer
+from board import Board
+
+def play(board, columns):
+    # Alternate X and O starting with X
+    for i, column in enumerate(columns):
+        board.drop(column, "XO"[i % 2])
+
+def test_takes_win():
+    board = Board(9, 6)
+    play(board, [1, 1, 2, 2, 3, 3, 4, 8])
+    assert ComputerPlayer().choose_move(board, "X") in (0, 5)
+
+def test_blocks_four():
+    board = Board(9, 6)
+    # X has four on the bottom row with one end blocked
+    play(board, [1, 0, 2, 2, 3, 3, 4])
+    assert ComputerPlayer().choose_move(board, "O") == 5
+    # The board we were given is left as it was
+    assert board.moves == 7
+
+def test_skips_full_columns():
+    board = Board(5, 5)
+    play(board, [2] * 5 + [1] * 5)
+    assert ComputerPlayer().choose_move(board, "X") not in (1, 2)
+
+def test_time_limit():
+    computer = ComputerPlayer({"depth": 20, "time_limit": 0.02})
+    start = time.perf_counter()
+    column = computer.choose_move(Board(9, 9), "X")
+    assert time.perf_counter() - start < 0.2
+    # Centre column is the best opening
+    assert column == 4
+
+def test_only_moves_when_ready():
+    computer = ComputerPlayer()
+    computer.send({"status": "200 WAIT_TURN"})
+    assert not computer.ready
+    computer.send({"status": "200 READY"})
+    assert computer.ready
+    computer.send({"status": "200 WIN"})
+    computer.send({"status": "200 READY"})
+    assert computer.game_over
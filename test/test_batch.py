@@ -0,0 +1,51 @@
+import pytest
+from board import Board
+from game import Game
+
+np = pytest.importorskip("numpy")
+import batch
+
+def test_evaluate():
+    game = Game()
+    empty = game.board
+    x_wins = [row[:] for row in empty]
+    for column in range(2, 7):
+        x_wins[5][column] = "[X]"
+    o_wins = [row[:] for row in empty]
+    for i in range(5):
+        o_wins[5 - i][i] = "[O]"
+    # Columns alternate in pairs so nobody gets five
+    draw = [
+        ["[X]", "[X]", "[O]", "[O]"] * 2 + ["[X]"] if row % 2 else
+        ["[O]", "[O]", "[X]", "[X]"] * 2 + ["[O]"]
+        for row in range(6)
+    ]
+
+    boards = batch.encode_grids([empty, x_wins, o_wins, draw])
+    assert boards.shape == (4, 6, 9)
+    x, o, draws = batch.evaluate(boards)
+    assert list(x) == [False, True, False, False]
+    assert list(o) == [False, False, True, False]
+    assert list(draws) == [False, False, False, True]
+
+def test_matches_board():
+    # Random boards give the same answers as the bitboards
+    rng = np.random.default_rng(0)
+    boards = rng.integers(0, 3, size=(500, 7, 8), dtype=np.uint8)
+    x, o, draws = batch.evaluate(boards)
+    for i, cells in enumerate(boards):
+        board = Board(8, 7)
+        board.load_grid([[f"[{' XO'[cell]}]" for cell in row]
+                         for row in cells])
+        assert x[i] == board.has_five("X")
+        assert o[i] == board.has_five("O")
+        assert draws[i] == (board.is_full() and not (x[i] or o[i]))
+
+def test_chunks(monkeypatch):
+    # Big batches are checked a chunk at a time
+    monkeypatch.setattr(batch, "CHUNK", 3)
+    boards = np.zeros((10, 5, 5), dtype=np.uint8)
+    boards[7, :, 0] = batch.X
+    x, o, draws = batch.evaluate(boards)
+    assert list(np.flatnonzero(x)) == [7]
+    assert not o.any()
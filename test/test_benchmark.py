@@ -0,0 +1,70 @@
+import pytest
+from benchmark import Benchmark, child_pids, peak_rss, percentile
+from gamelog import log_files, read_log
+
+def test_percentile():
+    values = [i / 100 for i in range(100)]
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 99) == 0.99
+    assert percentile([], 50) == 0.0
+
+def test_benchmark_asyncio():
+    # Real games over loopback against a server subprocess
+    results = Benchmark({
+        "engine": "asyncio",
+        "bots": 4,
+        "games": 4,
+        "binary": True,
+        "delta": True,
+        "timeout": 5
+    }).run()
+    assert results["games"] >= 4
+    assert results["errors"] == 0
+    assert results["moves"] > 0
+
+def test_peak_rss_counts_workers():
+    benchmark = Benchmark({"engine": "asyncio", "workers": 2})
+    benchmark.start_server()
+    try:
+        pid = benchmark.server_process.pid
+        workers = child_pids(pid)
+        assert len(workers) == 2
+        # Peaks only ever grow, so read the parts first
+        parts = sum(peak_rss(process) for process in [pid] + workers)
+        assert benchmark.server_peak_rss() >= parts > peak_rss(pid)
+    finally:
+        benchmark.stop_server()
+
+def test_benchmark_workers():
+    # Players matched on the same worker process, even though the
+    # benchmark's connection to check the server is up never joins
+    # and with just the two bots one would otherwise be left waiting
+    # on the other worker
+    results = Benchmark({
+        "engine": "asyncio",
+        "workers": 2,
+        "bots": 2,
+        "games": 4,
+        "timeout": 5
+    }).run()
+    assert results["games"] >= 4
+    assert results["errors"] == 0
+
+@pytest.mark.parametrize("engine,workers", [
+    ("threads", 0), ("asyncio", 0), ("threads", 2), ("asyncio", 2)
+])
+def test_games_logged_when_stopped(tmp_path, engine, workers):
+    # The server is stopped with SIGTERM straight after the last game,
+    # well before the game log's next flush
+    results = Benchmark({
+        "engine": engine,
+        "workers": workers,
+        "bots": 4,
+        "games": 4,
+        "timeout": 5,
+        "game_log": tmp_path
+    }).run()
+    logged = [
+        game for path in log_files(str(tmp_path)) for game in read_log(path)
+    ]
+    assert len(logged) >= results["games"] >= 4
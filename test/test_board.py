@@ -0,0 +1,118 @@
+import pytest
+from board import Board
+
+def test_drop():
+    board = Board(9, 6)
+    assert board.drop(0, "X") == 0
+    assert board.drop(0, "O") == 1
+    for i in range(4):
+        board.drop(0, "X")
+    # Column is now full
+    assert board.drop(0, "O") is None
+    assert board.heights[0] == 6
+
+def test_has_five():
+    # Vertical
+    board = Board(9, 6)
+    for i in range(5):
+        board.drop(3, "X")
+    assert board.has_five("X")
+    assert not board.has_five("O")
+
+    # Horizontal
+    board = Board(9, 6)
+    for column in range(4, 9):
+        board.drop(column, "O")
+    assert board.has_five("O")
+
+    # Four in a row isn't enough
+    board = Board(9, 6)
+    for column in range(4):
+        board.drop(column, "O")
+    assert not board.has_five("O")
+
+def test_has_five_does_not_wrap():
+    # Counters at the top of one column and the bottom of the
+    # next are neighbours in the bit layout but not on the board
+    board = Board(5, 5)
+    board.load_grid([
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[X]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[X]', '[ ]', '[ ]', '[ ]']
+    ])
+    assert not board.has_five("X")
+
+def test_grid_round_trip():
+    grid = [
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[X]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[O]', '[ ]', '[ ]'],
+        ['[X]', '[O]', '[X]', '[ ]', '[X]']
+    ]
+    board = Board(5, 5)
+    board.load_grid(grid)
+    assert board.to_grid() == grid
+    assert board.heights == [2, 1, 3, 0, 1]
+
+def test_has_five_through():
+    board = Board(9, 6)
+    board.load_grid([
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[X]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[X]', '[O]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[O]', '[X]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+    ])
+    assert board.moves == 10
+    # Completes the / diagonal from the bottom left
+    row = board.drop(4, "X")
+    assert not board.has_five_through(4, row, "X")
+    for marker in ["O", "O", "O", "X"]:
+        row = board.drop(4, marker)
+    assert board.has_five_through(4, row, "X")
+    assert board.has_five("X")
+
+    # Completing a line from the middle counts too
+    board = Board(9, 6)
+    for column in [0, 1, 3, 4]:
+        board.drop(column, "O")
+    row = board.drop(2, "O")
+    assert board.has_five_through(2, row, "O")
+
+def test_undo():
+    board = Board(5, 5)
+    board.drop(2, "X")
+    board.drop(2, "O")
+    board.undo(2)
+    assert board.heights[2] == 1
+    assert board.moves == 1
+    assert board.to_grid()[4][2] == "[X]"
+    assert board.to_grid()[3][2] == "[ ]"
+
+def test_line_table():
+    # 5 vertical, 5 horizontal and 2 diagonal lines on a 5x5 board
+    board = Board(5, 5)
+    assert len(board.lines) == 12
+    # Bottom left corner is on one line in each direction but \\
+    assert len(board.cell_lines[board.bit(0, 0).bit_length() - 1]) == 3
+    # Centre is on every line but the vertical and horizontal
+    # lines along the edges
+    assert len(board.cell_lines[board.bit(2, 2).bit_length() - 1]) == 4
+    assert len(Board(9, 6).lines) == 68
+    # Boards of the same size share one table
+    assert Board(9, 6).lines is Board(9, 6).lines
+
+def test_is_dead():
+    board = Board(5, 5)
+    assert not board.is_dead()
+    # Columns alternate so no line can be finished
+    columns = [0, 1, 2, 3, 4] * 2 + [1, 0, 3, 2, 4] * 2 + [0, 1]
+    for i, column in enumerate(columns):
+        board.drop(column, "XO"[i % 2])
+        # The top row is still open until both have played in it
+        assert board.is_dead() == (i == len(columns) - 1)
+    assert not board.is_full()
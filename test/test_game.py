@@ -0,0 +1,331 @@
+import pytest
+import mock
+from game import Game
+
+def test_add_players():
+    game = Game()
+
+    # Add first player
+    game.add_player("Alice")
+    assert game.players == ["Alice"]
+
+    # Add second player
+    game.add_player("Bob")
+    assert game.players == ["Alice", "Bob"]
+
+    # Game should not allow more than two players
+    game.add_player("Charlie")
+    assert game.players == ["Alice", "Bob"]
+
+def test_switch_player():
+    mock_socket = mock.Mock()
+    game = Game(
+        kwargs = {
+            "players": ["Alice", "Bob"],
+            "turn": "Alice",
+            "waiting": "Bob",
+            "markers": {"Alice": "X", "Bob": "O"},
+            "connections": {"Alice": mock_socket, "Bob": mock_socket},
+        }
+    )
+    game.prompt_players()
+    assert game.turn == "Bob"
+    assert game.waiting == "Alice"
+
+def test_generate_board():
+    game = Game()
+    game.generate_board()
+    print(game.board)
+    assert game.board == [
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+    ]
+
+def test_mark_board():
+    mock_socket = mock.Mock()
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "waiting": "Bob",
+            "markers": {"Alice": "X", "Bob": "O"},
+            "connections": {"Alice": mock_socket, "Bob": mock_socket},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+
+    game.mark_board(1)
+    assert game.board == [
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+    ]
+
+    game.turn = "Bob"
+    game.mark_board(2)
+    assert game.board == [
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+    ]
+
+    game.turn = "Alice"
+    game.mark_board(1)
+    assert game.board == [
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[O]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+    ]
+
+    assert game.column_full == True
+
+def test_check_winner():
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "X"},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+    assert game.check_winner() == True
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "O"},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[O]', '[O]', '[O]', '[O]']
+            ]
+        }
+    )
+    assert game.check_winner() == True
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "X"},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+    assert game.check_winner() == True
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "O"},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+    assert game.check_winner() == True
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "X"},
+            "board": [
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+    assert game.check_winner() == False
+
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "O"},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[O]', '[O]', '[X]', '[O]', '[O]', '[O]']
+            ]
+        }
+    )
+    assert game.check_winner() == False
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "X"},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+    assert game.check_winner() == False
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "O"},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+    assert game.check_winner() == False
+
+def test_check_draw():
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "X"},
+            "board": [
+                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
+                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
+                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
+                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]'],
+                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]'],
+                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]']
+            ]
+        }
+    )
+    assert game.check_draw() == True
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "X"},
+            "board": [
+                ['[O]', '[X]', '[O]', '[X]', '[X]', '[X]', '[X]', '[X]', '[X]'],
+                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
+                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
+                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]'],
+                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]'],
+                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]']
+            ]
+        }
+    )
+    assert game.check_draw() == False
+
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "markers": {"Alice": "X"},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+    assert game.check_draw() == False
+
+def test_mark_board_result():
+    alice_socket = mock.Mock()
+    bob_socket = mock.Mock()
+    game = Game(
+        kwargs = {
+            "turn": "Alice",
+            "waiting": "Bob",
+            "markers": {"Alice": "X", "Bob": "O"},
+            "connections": {"Alice": alice_socket, "Bob": bob_socket},
+            "board": [
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[O]', '[O]', '[O]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+                ['[X]', '[X]', '[X]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+            ]
+        }
+    )
+    game.mark_board(5)
+    alice_socket.send.assert_called_once_with({"status": "200 WIN"})
+    bob_socket.send.assert_called_once_with({"status": "200 LOSS"})
+
+def test_delta_updates():
+    alice_socket = mock.Mock()
+    bob_socket = mock.Mock()
+    game = Game(
+        kwargs = {
+            "players": ["Alice", "Bob"],
+            "connections": {"Alice": alice_socket, "Bob": bob_socket},
+            "delta_players": {"Alice"},
+        }
+    )
+    game.start_game()
+    # Everyone gets the whole board to start with
+    assert "board" in alice_socket.send.call_args[0][0]
+    assert "board" in bob_socket.send.call_args[0][0]
+
+    # Bob goes first as start_game switches turn
+    game.mark_board(3)
+    game.prompt_players()
+    alice_socket.send.assert_called_with({
+        "status": "200 READY",
+        "marker": "X",
+        "seq": 1,
+        "move": [2, 5, "O"]
+    })
+    assert bob_socket.send.call_args[0][0]["board"][5][2] == "[O]"
+
+    # Ask for the whole board again
+    game.send_snapshot("Alice")
+    assert alice_socket.send.call_args[0][0]["board"] == game.board
@@ -0,0 +1,150 @@
+import os
+import pytest
+import threading
+import time
+import mock
+from game import Game
+from gamelog import (
+    ABANDONED, FIRST_PLAYER_WON, MAGIC, SECOND_PLAYER_WON, RECORD, GameLog, decode_records,
+    encode_record, log_files, read_log
+)
+
+def finished_game(game_id=1, moves=None):
+    return {
+        "game_id": game_id,
+        "players": ["Alice", "Bob"],
+        "width": 9,
+        "height": 6,
+        "first": 1,
+        "moves": moves if moves is not None else [4, 4, 3, 3, 2, 2, 1, 1, 0],
+        "result": FIRST_PLAYER_WON,
+        "finished": 1600000000
+    }
+
+def test_record_size():
+    # Fixed size header, the names, then one byte per move
+    assert len(encode_record(finished_game())) == RECORD.size + 8 + 9
+
+def test_write_and_read(tmp_path):
+    game_log = GameLog({"directory": str(tmp_path), "flush_interval": 60})
+    game_log.record(finished_game(1))
+    game_log.record(finished_game(2))
+    # Nothing is written until the buffer is flushed
+    assert log_files(str(tmp_path)) == []
+    game_log.flush()
+    game_log.record(finished_game(3))
+    game_log.close()
+
+    files = log_files(str(tmp_path))
+    assert len(files) == 1
+    games = read_log(files[0])
+    assert [game["game_id"] for game in games] == [1, 2, 3]
+    assert games[0] == finished_game(1)
+
+def test_flushed_once_buffer_fills(tmp_path):
+    game_log = GameLog({
+        "directory": str(tmp_path),
+        "flush_interval": 60,
+        "flush_bytes": 1
+    })
+    game_log.record(finished_game())
+    # The background thread wakes up and writes it out
+    deadline = time.monotonic() + 5
+    while not log_files(str(tmp_path)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    game_log.close()
+    assert len(read_log(log_files(str(tmp_path))[0])) == 1
+
+def test_rotation(tmp_path):
+    game_log = GameLog({"directory": str(tmp_path), "max_bytes": 1})
+    for game_id in range(3):
+        game_log.record(finished_game(game_id))
+        game_log.flush()
+    game_log.close()
+    files = log_files(str(tmp_path))
+    assert len(files) == 3
+    assert [read_log(path)[0]["game_id"] for path in files] == [0, 1, 2]
+
+def test_rotation_after_old_logs_removed(tmp_path):
+    game_log = GameLog({"directory": str(tmp_path), "max_bytes": 1})
+    for game_id in range(3):
+        game_log.record(finished_game(game_id))
+        game_log.flush()
+    # Archiving the oldest mustn't make the next file reuse a number
+    os.remove(log_files(str(tmp_path))[0])
+    game_log.record(finished_game(3))
+    game_log.close()
+    files = log_files(str(tmp_path))
+    assert len(files) == 3
+    assert [read_log(path)[0]["game_id"] for path in files] == [1, 2, 3]
+    assert all(len(read_log(path)) == 1 for path in files)
+
+def test_games_finishing_together_all_recorded(tmp_path):
+    game_log = GameLog({"directory": str(tmp_path)})
+    start = game_log.start
+
+    def slow_start():
+        # Give the other threads every chance to start it too
+        time.sleep(0.01)
+        start()
+
+    game_log.start = slow_start
+    threads = [
+        threading.Thread(target=game_log.record, args=(finished_game(game_id),))
+        for game_id in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    game_log.close()
+    logged = [game for path in log_files(str(tmp_path))
+              for game in read_log(path)]
+    assert sorted(game["game_id"] for game in logged) == list(range(8))
+
+def test_partial_record_ignored():
+    data = MAGIC + encode_record(finished_game(1)) + encode_record(
+        finished_game(2))[:-3]
+    games = [game for offset, game in decode_records(data, len(MAGIC))]
+    assert [game["game_id"] for game in games] == [1]
+
+def test_game_records_result():
+    game_log = mock.Mock()
+    game = Game({
+        "game_id": 7,
+        "connections": {"Alice": mock.Mock(), "Bob": mock.Mock()},
+        "game_log": game_log
+    })
+    game.add_player("Alice")
+    game.add_player("Bob")
+    game.start_game()
+    # Bob goes first and gets five down the first column
+    for column in [1, 2] * 4 + [1]:
+        game.play_move(column)
+
+    record = game_log.record.call_args[0][0]
+    assert record["players"] == ["Alice", "Bob"]
+    assert record["first"] == 1
+    assert record["moves"] == [0, 1] * 4 + [0]
+    assert record["result"] == SECOND_PLAYER_WON
+
+    # Closing the room afterwards doesn't record it again
+    game.disconnect_clients()
+    assert game_log.record.call_count == 1
+
+def test_game_records_abandoned():
+    game_log = mock.Mock()
+    game = Game({
+        "connections": {"Alice": mock.Mock(), "Bob": mock.Mock()},
+        "game_log": game_log
+    })
+    game.add_player("Alice")
+    game.add_player("Bob")
+    game.start_game()
+    game.play_move(3)
+    game.players.remove("Bob")
+    game.disconnect_clients()
+    record = game_log.record.call_args[0][0]
+    assert record["result"] == ABANDONED
+    assert record["players"] == ["Alice", "Bob"]
+    assert record["moves"] == [2]
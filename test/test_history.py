@@ -0,0 +1,77 @@
+import pytest
+import datetime
+from gamelog import (
+    ABANDONED, DRAW, FIRST_PLAYER_WON, SECOND_PLAYER_WON, GameLog
+)
+from history import GameHistory, replay
+
+def write_games(directory, games, max_bytes=64 * 1024 * 1024):
+    game_log = GameLog({"directory": directory, "max_bytes": max_bytes})
+    for game_id, (players, result, finished) in enumerate(games):
+        game_log.record({
+            "game_id": game_id,
+            "players": players,
+            "width": 9,
+            "height": 6,
+            "first": 1,
+            "moves": [0, 1] * 4 + [0],
+            "result": result,
+            "finished": finished
+        })
+        game_log.flush()
+    game_log.close()
+
+GAMES = [
+    (["Alice", "Bob"], FIRST_PLAYER_WON, 1000),
+    (["Carol", "Alice"], SECOND_PLAYER_WON, 2000),
+    (["Bob", "Alice"], DRAW, 3000),
+    (["Bob", "Carol"], ABANDONED, 4000),
+    (["Alice", "Bob"], SECOND_PLAYER_WON, 5000)
+]
+
+def test_queries(tmp_path):
+    # Spread over several files
+    write_games(str(tmp_path), GAMES, max_bytes=1)
+    history = GameHistory({"directory": str(tmp_path)})
+    assert len(history.paths) == 5
+
+    games = history.player_games("Alice")
+    assert [game["finished"] for game in games] == [5000, 3000, 2000, 1000]
+    assert [game["game_id"] for game in history.player_games("Bob", 2)] == [
+        4, 3
+    ]
+    assert [game["game_id"] for game in history.head_to_head(
+        "Alice", "Bob")] == [4, 2, 0]
+    assert history.player_games("Dave") == []
+    assert [game["game_id"] for game in history.result_games(DRAW)] == [2]
+    assert [game["game_id"] for game in history.games_between(
+        2000, 4000)] == [1, 2]
+    start = datetime.datetime.fromtimestamp(0)
+    assert len(history.games_between(
+        start, start + datetime.timedelta(seconds=1500))) == 1
+
+    # Abandoned games don't count
+    assert history.leaderboard(2) == [
+        ("Alice", {"wins": 2, "losses": 1, "draws": 1}),
+        ("Bob", {"wins": 1, "losses": 1, "draws": 1})
+    ]
+    history.close()
+
+def test_refresh(tmp_path):
+    write_games(str(tmp_path), GAMES[:2])
+    history = GameHistory({"directory": str(tmp_path)})
+    assert len(history.player_games("Alice")) == 2
+    # Games the server writes later are picked up
+    write_games(str(tmp_path), GAMES[2:])
+    history.refresh()
+    assert len(history.player_games("Alice")) == 4
+    history.close()
+
+def test_replay():
+    game = {"width": 5, "height": 5, "first": 1, "moves": [2, 2, 3]}
+    boards = list(replay(game))
+    assert len(boards) == 3
+    # The second player to join is O
+    assert boards[0][4][2] == "[O]"
+    assert boards[1][3][2] == "[X]"
+    assert boards[2][4][3] == "[O]"
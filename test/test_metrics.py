@@ -0,0 +1,87 @@
+import pytest
+import mock
+import urllib.request
+from metrics import Histogram, Metrics
+from protocol import Connection
+from server import Server
+from session import Session
+
+def test_histogram_buckets():
+    histogram = Histogram([0.001, 0.01])
+    histogram.observe(0.0005)
+    histogram.observe(0.001)
+    histogram.observe(0.005)
+    histogram.observe(1)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.sum == pytest.approx(1.0065)
+
+def test_render():
+    metrics = Metrics()
+    metrics.counter("moves_total", "Moves played")
+    metrics.gauge("connections", "Clients connected", lambda: 3)
+    metrics.histogram("move_seconds", "Time per move", [0.001, 0.01])
+    metrics.inc("moves_total")
+    metrics.inc("moves_total", 2)
+    metrics.observe("move_seconds", 0.005)
+    metrics.observe("move_seconds", 0.5)
+
+    lines = metrics.render().splitlines()
+    assert "# TYPE fiveinarow_moves_total counter" in lines
+    assert "fiveinarow_moves_total 3" in lines
+    assert "fiveinarow_connections 3" in lines
+    # Buckets count everything up to their bound
+    assert 'fiveinarow_move_seconds_bucket{le="0.001"} 0' in lines
+    assert 'fiveinarow_move_seconds_bucket{le="0.01"} 1' in lines
+    assert 'fiveinarow_move_seconds_bucket{le="+Inf"} 2' in lines
+    assert "fiveinarow_move_seconds_count 2" in lines
+
+def test_server_counts_moves():
+    metrics = Metrics()
+    server = Server({"metrics": metrics})
+    alice = Session(mock.Mock())
+    bob = Session(mock.Mock())
+    server.handle_command({"new_player": "Alice"}, alice)
+    server.handle_command({"new_player": "Bob"}, bob)
+    # Bob has O, which moves first
+    server.handle_command({"next_move": "1"}, bob)
+    server.handle_command({"next_move": "2"}, alice)
+
+    assert metrics.counters["games_opened_total"] == 1
+    assert metrics.counters["moves_total"] == 2
+    assert metrics.counters["messages_received_total"] == 4
+    assert sum(metrics.histograms["mark_board_seconds"].counts) == 2
+    assert "fiveinarow_games 1" in metrics.render().splitlines()
+
+def test_connection_counts_bytes():
+    metrics = Metrics()
+    Server({"metrics": metrics})
+    sock = mock.Mock()
+    connection = Connection(sock, metrics)
+    connection.send({"status": "200 JOIN"})
+    assert metrics.counters["sent_bytes_total"] == len(
+        sock.sendall.call_args[0][0]
+    )
+
+    sock.sendall.side_effect = BrokenPipeError
+    with pytest.raises(BrokenPipeError):
+        connection.send({"status": "200 JOIN"})
+    assert metrics.counters["send_errors_total"] == 1
+
+def test_metrics_endpoint():
+    server = Server({"metrics": Metrics(), "metrics_port": 0})
+    http_server = server.start_metrics()
+    port = http_server.server_address[1]
+    try:
+        with urllib.request.urlopen(
+                f"http://127.0.0.1:{port}/metrics") as response:
+            body = response.read().decode()
+        assert "fiveinarow_connections 0" in body.splitlines()
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+
+def test_no_metrics_by_default():
+    server = Server()
+    assert server.start_metrics() is None
+    game = server.new_game()
+    assert game.metrics is None
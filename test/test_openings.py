@@ -0,0 +1,75 @@
+import pytest
+import mock
+from ai import ComputerPlayer
+from board import Board
+from openings import (
+    ENTRY, HEADER_SIZE, OpeningBook, build_book, position_key
+)
+
+def small_book(tmp_path):
+    path = str(tmp_path / "test.book")
+    count = build_book(path, {
+        "sizes": [(5, 5), (6, 5)],
+        "plies": 2,
+        "depth": 2,
+        "time_limit": 1,
+        "workers": 1
+    })
+    return path, count
+
+def test_build_and_lookup(tmp_path):
+    path, count = small_book(tmp_path)
+    # The empty board and every first move on each size
+    assert count == 1 + 5 + 1 + 6
+    book = OpeningBook(path)
+    assert book.count == count
+
+    keys = [
+        ENTRY.unpack_from(book.data, HEADER_SIZE + i * ENTRY.size)[0]
+        for i in range(count)
+    ]
+    assert keys == sorted(keys)
+
+    computer = ComputerPlayer({"depth": 2, "time_limit": 1})
+    board = Board(5, 5)
+    assert book.lookup(board, "X", "O") == computer.choose_move(
+        board, "X", "O")
+    board.drop(0, "X")
+    assert book.lookup(board, "O", "X") == computer.choose_move(
+        board, "O", "X")
+    # Deeper than the book goes
+    board.drop(1, "O")
+    assert book.lookup(board, "X", "O") is None
+    # Other board sizes have their own entries
+    assert book.lookup(Board(9, 6), "X", "O") is None
+    book.close()
+
+def test_position_key():
+    first = Board(9, 6)
+    first.drop(0, "X")
+    first.drop(1, "O")
+    first.drop(2, "X")
+    second = Board(9, 6)
+    second.drop(2, "X")
+    second.drop(1, "O")
+    second.drop(0, "X")
+    # Same position whatever order the moves came in
+    assert position_key(first, "O", "X") == position_key(second, "O", "X")
+    assert position_key(first, "O", "X") != position_key(first, "X", "O")
+    assert position_key(Board(9, 6), "X", "O") != position_key(
+        Board(9, 5), "X", "O")
+
+def test_computer_uses_book():
+    book = mock.Mock()
+    book.lookup.return_value = 3
+    computer = ComputerPlayer({"opening_book": book})
+    assert computer.choose_move(Board(9, 6), "X", "O") == 3
+    # Falls back to searching once out of the book
+    book.lookup.return_value = None
+    assert computer.choose_move(Board(9, 6), "X", "O") == 4
+
+def test_not_a_book(tmp_path):
+    path = tmp_path / "bad.book"
+    path.write_bytes(b"not a book at all")
+    with pytest.raises(ValueError):
+        OpeningBook(str(path))
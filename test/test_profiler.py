@@ -0,0 +1,114 @@
+import pytest
+import socket
+import sys
+import threading
+import time
+from profiler import Profiler
+from server import Server
+
+def handler(started, stop, wait=False):
+    work(started, stop, wait)
+
+def work(started, stop, wait):
+    started.set()
+    if wait:
+        stop.wait()
+    while not stop.is_set():
+        pass
+
+def run_handler(profiler):
+    started = threading.Event()
+    stop = threading.Event()
+    thread = threading.Thread(target=handler, args=(started, stop))
+    thread.start()
+    started.wait()
+    return thread, stop
+
+def test_samples_handler_stacks():
+    profiler = Profiler({"roots": {f"{__name__}:handler"}})
+    thread, stop = run_handler(profiler)
+    try:
+        for i in range(5):
+            profiler.sample()
+    finally:
+        stop.set()
+        thread.join()
+
+    # Stacks start at the handler, and other threads aren't counted
+    assert len(profiler.samples) >= 1
+    for stack in profiler.samples:
+        assert stack[0] == f"{__name__}:handler"
+    assert sum(profiler.samples.values()) == 5
+    line = profiler.collapsed()[0]
+    assert line.startswith(f"{__name__}:handler;{__name__}:work")
+
+def test_idle_stacks_skipped():
+    # Stacks ending where the handler waits aren't counted
+    profiler = Profiler({
+        "roots": {f"{__name__}:handler"},
+        "idle": {"threading:Condition.wait"}
+    })
+    started = threading.Event()
+    stop = threading.Event()
+    thread = threading.Thread(target=handler, args=(started, stop, True))
+    thread.start()
+    started.wait()
+    try:
+        time.sleep(0.01)
+        profiler.sample()
+    finally:
+        stop.set()
+        thread.join()
+    assert profiler.samples == {}
+
+def test_server_handler_stack():
+    # A thread engine handler waiting for its client counts as idle
+    server = Server()
+    server_end, client_end = socket.socketpair()
+    thread = threading.Thread(target=server.connect_client, args=(server_end,))
+    thread.start()
+    profiler = Profiler()
+    try:
+        time.sleep(0.05)
+        stack = profiler.handler_stack(sys._current_frames()[thread.ident])
+        assert stack[0] == "server:Server.connect_client"
+        assert stack[-1] == "protocol:Connection.recv"
+        profiler.sample()
+        assert profiler.samples == {}
+    finally:
+        client_end.close()
+        thread.join()
+
+def test_toggle_writes_profile(tmp_path):
+    profiler = Profiler({
+        "interval": 0.001,
+        "path": str(tmp_path / "profile-{pid}.folded"),
+        "roots": {f"{__name__}:handler"}
+    })
+    thread, stop = run_handler(profiler)
+    try:
+        profiler.toggle()
+        assert profiler.running()
+        time.sleep(0.05)
+        profiler.toggle()
+        assert not profiler.running()
+    finally:
+        stop.set()
+        thread.join()
+
+    files = list(tmp_path.iterdir())
+    assert len(files) == 1
+    lines = files[0].read_text().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stack.startswith(f"{__name__}:handler")
+    assert int(count) > 0
+
+def test_path_always_has_pid():
+    # Forked workers would otherwise overwrite each other's profile
+    assert Profiler({"path": "out.folded"}).path == "out-{pid}.folded"
+    assert Profiler({"path": "out"}).path == "out-{pid}"
+    assert Profiler({"path": "{pid}.folded"}).path == "{pid}.folded"
+
+def test_stop_when_not_running():
+    assert Profiler().stop() is None
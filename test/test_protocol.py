@@ -0,0 +1,99 @@
+import pytest
+import mock
+from protocol import (
+    Connection, MessageBuffer, ProtocolError, encode_message
+)
+
+def test_coalesced_messages():
+    buffer = MessageBuffer()
+    buffer.feed(
+        encode_message({"status": "200 READY"})
+        + encode_message({"status": "200 WAIT_TURN"})
+    )
+    assert buffer.next_message() == {"status": "200 READY"}
+    assert buffer.next_message() == {"status": "200 WAIT_TURN"}
+    assert buffer.next_message() is None
+
+def test_split_message():
+    data = encode_message({"status": "400 COL_FULL"})
+    buffer = MessageBuffer()
+    for i in range(len(data)):
+        assert buffer.next_message() is None
+        buffer.feed(data[i:i+1])
+    assert buffer.next_message() == {"status": "400 COL_FULL"}
+
+def test_bad_messages():
+    buffer = MessageBuffer()
+    buffer.feed(b"\xff\xff\xff\xff")
+    with pytest.raises(ProtocolError):
+        buffer.next_message()
+
+    buffer = MessageBuffer()
+    buffer.feed(b"\x00\x00\x00\x03{{{")
+    with pytest.raises(ProtocolError):
+        buffer.next_message()
+
+def test_messages_must_be_objects():
+    # Valid JSON the server can't handle is rejected too
+    for message in [[1], "hello", {"next_move": 5}, {"new_player": None}]:
+        buffer = MessageBuffer()
+        buffer.feed(encode_message(message))
+        with pytest.raises(ProtocolError):
+            buffer.next_message()
+
+def test_connection_recv():
+    data = encode_message({"new_player": "Alice"})
+    mock_socket = mock.Mock()
+    mock_socket.recv.side_effect = [data[:3], data[3:], b""]
+    connection = Connection(mock_socket)
+    assert connection.recv() == {"new_player": "Alice"}
+    assert connection.recv() is None
+
+def test_binary_round_trip():
+    board = [
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
+        ['[ ]', '[ ]', '[X]', '[ ]', '[ ]'],
+        ['[O]', '[ ]', '[O]', '[ ]', '[ ]'],
+        ['[X]', '[O]', '[X]', '[ ]', '[X]']
+    ]
+    messages = [
+        {"status": "200 READY", "board": board, "marker": "X"},
+        {"status": "400 COL_FULL"},
+        {"next_move": "3"},
+        {"next_move": "exit"},
+        # No compact form so falls back to JSON
+        {"status": "200 JOIN", "protocol": "binary"},
+    ]
+    buffer = MessageBuffer()
+    for message in messages:
+        buffer.feed(encode_message(message, binary=True))
+    for message in messages:
+        assert buffer.next_message(binary=True) == message
+
+def test_binary_is_smaller():
+    board = [["[ ]"] * 9 for i in range(6)]
+    message = {"status": "200 READY", "board": board, "marker": "X"}
+    binary = encode_message(message, binary=True)
+    assert len(binary) < 30
+    assert len(binary) * 10 < len(encode_message(message))
+
+def test_binary_drops_current_player():
+    buffer = MessageBuffer()
+    buffer.feed(encode_message(
+        {"current_player": "Alice", "next_move": "4"}, binary=True
+    ))
+    assert buffer.next_message(binary=True) == {"next_move": "4"}
+
+def test_binary_delta_update():
+    message = {
+        "status": "200 WAIT_TURN",
+        "marker": "O",
+        "move": [8, 0, "X"],
+        "seq": 300
+    }
+    buffer = MessageBuffer()
+    data = encode_message(message, binary=True)
+    assert len(data) < 15
+    buffer.feed(data)
+    assert buffer.next_message(binary=True) == message
@@ -0,0 +1,51 @@
+import pytest
+from selfplay import SelfPlay, parse_size, play_games
+
+def task(players=("random", "random"), seed=0):
+    return {
+        "width": 7,
+        "height": 6,
+        "games": 20,
+        "players": players,
+        "depth": 1,
+        "time_limit": 1,
+        "seed": seed
+    }
+
+def test_play_games():
+    result = play_games(task())
+    assert result["size"] == "7x6"
+    assert result["games"] == 20
+    assert result["X"] + result["O"] + result["draws"] == 20
+    # Every game ends with at least one line of five
+    # or a full board
+    assert 9 * 20 <= result["moves"] <= 42 * 20
+    # Same seed plays the same games
+    assert play_games(task()) == result
+
+def test_computer_beats_random():
+    result = play_games(task(("random", "computer")))
+    assert result["O"] > result["X"]
+
+def test_self_play_pool():
+    progress = []
+    results = SelfPlay({
+        "games": 30,
+        "sizes": [(9, 6), (5, 5)],
+        "workers": 2,
+        "chunk": 10,
+        "progress": lambda totals: progress.append(
+            sum(total["games"] for total in totals.values())
+        )
+    }).run()
+    assert set(results) == {"9x6", "5x5"}
+    for stats in results.values():
+        assert stats["games"] == 30
+        assert stats["x_win_rate"] + stats["o_win_rate"] + stats[
+            "draw_rate"] == pytest.approx(1)
+    # Totals are reported as each chunk comes back
+    assert len(progress) == 6
+    assert progress[-1] == 60
+
+def test_parse_size():
+    assert parse_size("9x6") == (9, 6)
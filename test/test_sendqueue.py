@@ -0,0 +1,139 @@
+import pytest
+import mock
+import socket
+import time
+from metrics import Metrics
+from protocol import Connection
+from sendqueue import DROP, Flusher, QueuedConnection
+from server import Server, StreamConnection
+
+def message(number):
+    return {"status": "200 WAIT_TURN", "seq": number, "padding": "x" * 10000}
+
+def connection_pair(kwargs={}):
+    server_end, client_end = socket.socketpair()
+    # Small buffers so the socket fills up after a few messages
+    server_end.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    client_end.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    return QueuedConnection(server_end, Flusher(), kwargs), Connection(client_end)
+
+def test_send_never_blocks():
+    queued, client = connection_pair({"max_bytes": 10 * 1024 * 1024})
+    # Far more than the socket can hold while nobody reads
+    start = time.monotonic()
+    for number in range(50):
+        queued.send(message(number))
+    assert time.monotonic() - start < 1
+    assert queued.queued > 0
+
+    # The flusher sends the rest, whole and in order, as they're read
+    for number in range(50):
+        assert client.recv()["seq"] == number
+    assert queued.queued == 0
+    queued.close()
+    client.close()
+
+def test_slow_client_disconnected():
+    metrics = Metrics()
+    Server({"metrics": metrics})
+    queued, client = connection_pair({
+        "max_bytes": 50 * 1024, "metrics": metrics
+    })
+    for number in range(20):
+        if queued.closed:
+            break
+        queued.send(message(number))
+    assert queued.closed
+    assert metrics.counters["slow_client_disconnects_total"] == 1
+    with pytest.raises(BrokenPipeError):
+        queued.send(message(20))
+
+    # The client gets what was sent before the queue filled, then
+    # finds the connection closed
+    while True:
+        try:
+            response = client.recv()
+        except ConnectionResetError:
+            break
+        if response is None:
+            break
+    queued.close()
+    client.close()
+
+def board_update(number):
+    return {"status": "200 WAIT_TURN", "seq": number, "board": "x" * 10000}
+
+def test_slow_client_boards_dropped():
+    metrics = Metrics()
+    Server({"metrics": metrics})
+    queued, client = connection_pair({
+        "max_bytes": 50 * 1024, "policy": DROP, "metrics": metrics
+    })
+    for number in range(20):
+        queued.send(board_update(number))
+    assert not queued.closed
+    dropped = metrics.counters["dropped_messages_total"]
+    assert dropped > 0
+
+    # Every message arrives whole and in order, some without a board
+    received = [client.recv() for number in range(20)]
+    assert [response["seq"] for response in received] == list(range(20))
+    assert all(response["status"] == "200 WAIT_TURN" for response in received)
+    assert sum("board" not in response for response in received) == dropped
+    queued.close()
+    client.close()
+
+def test_slow_client_never_drops_status():
+    metrics = Metrics()
+    Server({"metrics": metrics})
+    queued, client = connection_pair({
+        "max_bytes": 50 * 1024, "policy": DROP, "metrics": metrics
+    })
+    # A message with no board to leave out disconnects the client
+    # rather than being lost
+    for number in range(20):
+        if queued.closed:
+            break
+        queued.send(message(number))
+    assert queued.closed
+    assert metrics.counters["slow_client_disconnects_total"] == 1
+    assert metrics.counters["dropped_messages_total"] == 0
+    queued.close()
+    client.close()
+
+def test_close_forgets_connection():
+    queued, client = connection_pair()
+    for number in range(10):
+        queued.send(message(number))
+    flusher = queued.flusher
+    queued.close()
+    # The flusher stops watching before the socket number is reused
+    deadline = time.monotonic() + 1
+    while len(flusher.selector.get_map()) > 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(flusher.selector.get_map()) == 1
+    client.close()
+
+def test_stream_connection_slow_client():
+    writer = mock.Mock()
+    writer.is_closing.return_value = False
+    writer.transport.get_write_buffer_size.return_value = 1024 * 1024
+    connection = StreamConnection(writer, {"max_bytes": 64 * 1024})
+    connection.send({"status": "200 READY"})
+    writer.write.assert_not_called()
+    writer.transport.abort.assert_called_once()
+
+    writer.transport.abort.reset_mock()
+    connection.policy = DROP
+    # Status messages are never dropped
+    connection.send({"status": "200 WIN"})
+    writer.write.assert_not_called()
+    writer.transport.abort.assert_called_once()
+
+    # Board updates go without their board if that's small enough
+    writer.transport.abort.reset_mock()
+    writer.transport.get_write_buffer_size.return_value = 64 * 1024 - 100
+    connection.send({"status": "200 READY", "seq": 3, "board": "x" * 1000})
+    writer.transport.abort.assert_not_called()
+    sent = writer.write.call_args[0][0]
+    assert b"READY" in sent and b"board" not in sent
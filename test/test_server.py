@@ -1,278 +1,501 @@
+import asyncio
 import pytest
 import mock
-from server import Server
+import socket
+import threading
+import time
+from benchmark import Benchmark
+from gamelog import DRAW
+from protocol import Connection
+from server import PAIRED, PLACED, ROOM_CLOSED, WAITING, Server
+from session import Session
 
-def test_add_players():
+def new_session(connection=None):
+    return Session(connection or mock.Mock())
+
+def test_join_game_pairs_players():
     server = Server()
 
-    # Add first player
-    server.add_player("Alice")
-    assert server.players == ["Alice"]
+    alice = new_session()
+    server.handle_command({"new_player": "Alice"}, alice)
+    assert list(server.matchmaker.queue) == [alice.game]
+    bob = new_session()
+    server.handle_command({"new_player": "Bob"}, bob)
+    assert bob.game is alice.game
+    assert alice.game.players == ["Alice", "Bob"]
+    assert server.matchmaker.waiting() == 0
 
-    # Add second player
-    server.add_player("Bob")
-    assert server.players == ["Alice", "Bob"]
+    # A third player gets a room of their own instead of 400 FULL
+    charlie = new_session()
+    server.handle_command({"new_player": "Charlie"}, charlie)
+    assert charlie.game is not alice.game
+    assert charlie.game.players == ["Charlie"]
+    assert len(server.games) == 2
 
-    # Server should not allow more than two players
-    server.add_player("Charlie")
-    assert server.players == ["Alice", "Bob"]
+def test_players_joining_together_share_a_room():
+    server = Server()
+    new_game = server.new_game
 
-def test_switch_player():
-    mock_socket = mock.Mock()
-    server = Server(
-        kwargs = {
-            "players": ["Alice", "Bob"],
-            "turn": "Alice",
-            "waiting": "Bob",
-            "markers": {"Alice": "X", "Bob": "O"},
-            "connections": {"Alice": mock_socket, "Bob": mock_socket},
-        }
-    )
-    server.prompt_players()
-    assert server.turn == "Bob"
-    assert server.waiting == "Alice"
+    def slow_new_game():
+        # Give the other joins every chance to get in between
+        game = new_game()
+        time.sleep(0.01)
+        return game
 
-def test_generate_board():
-    server = Server()
-    server.generate_board()
-    print(server.board)
-    assert server.board == [
-        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
+    server.new_game = slow_new_game
+    sessions = [new_session() for player in range(8)]
+    threads = [
+        threading.Thread(
+            target=server.handle_command,
+            args=({"new_player": f"Player {number}"}, session)
+        )
+        for number, session in enumerate(sessions)
     ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Nobody's left waiting alone however the joins interleave
+    assert len(server.games) == 4
+    assert server.matchmaker.waiting() == 0
+    for session in sessions:
+        statuses = [call[0][0]["status"]
+                    for call in session.connection.send.call_args_list]
+        # Always told they've joined before anything else
+        assert statuses[0] == "200 JOIN"
 
-def test_mark_board():
-    mock_socket = mock.Mock()
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "waiting": "Bob",
-            "markers": {"Alice": "X", "Bob": "O"},
-            "connections": {"Alice": mock_socket, "Bob": mock_socket},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-            ]
-        }
-    )
+def test_waiting_players_paired_in_order():
+    server = Server()
+    sessions = {}
+    for name in ["Alice", "Alice", "Bob", "Charlie"]:
+        session = new_session()
+        server.handle_command({"new_player": name}, session)
+        sessions.setdefault(name, []).append(session)
 
-    server.mark_board(1)
-    assert server.board == [
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-    ]
+    # Two players called Alice can't share a room so Bob gets
+    # the first and Charlie the second
+    first, second = sessions["Alice"]
+    assert first.game is not second.game
+    assert sessions["Bob"][0].game is first.game
+    assert sessions["Charlie"][0].game is second.game
+    assert server.matchmaker.waiting() == 0
 
-    server.turn = "Bob"
-    server.mark_board(2)
-    assert server.board == [
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-    ]
+def test_wait_player_sent_once():
+    alice_socket = mock.Mock()
+    server = Server()
+    server.handle_command({"new_player": "Alice"}, new_session(alice_socket))
+    alice_socket.send.assert_called_with({"status": "200 WAIT_PLAYER"})
+    assert alice_socket.send.call_count == 2
 
-    server.turn = "Alice"
-    server.mark_board(1)
-    assert server.board == [
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-        ['[O]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-    ]
+    # Opponent arriving starts the game right away
+    server.handle_command({"new_player": "Bob"}, new_session())
+    assert alice_socket.send.call_args[0][0]["status"] == "200 WAIT_TURN"
 
-    assert server.column_full == True
-
-def test_check_winner():
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "X"},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-            ]
-        }
-    )
-    assert server.check_winner() == True
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "O"},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[O]', '[O]', '[O]', '[O]']
-            ]
-        }
-    )
-    assert server.check_winner() == True
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "X"},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-            ]
-        }
-    )
-    assert server.check_winner() == True
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "O"},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-            ]
-        }
-    )
-    assert server.check_winner() == True
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "X"},
-            "board": [
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-            ]
-        }
-    )
-    assert server.check_winner() == False
-
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "O"},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[O]', '[O]', '[X]', '[O]', '[O]', '[O]']
-            ]
-        }
-    )
-    assert server.check_winner() == False
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "X"},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-            ]
-        }
+def test_close_game():
+    mock_socket = mock.Mock()
+    server = Server()
+    game = server.join_game("Alice", mock_socket)
+    game.lock.release()
+    assert server.matchmaker.waiting() == 1
+    server.close_game(game)
+    assert server.games == {}
+    assert game.players == []
+    assert server.matchmaker.waiting() == 0
+
+def test_workers_tell_acceptor_where_players_wait():
+    server = Server()
+    acceptor, server.acceptor = socket.socketpair()
+    sessions = [new_session() for name in ["Alice", "Bob", "Charlie"]]
+    for name, session in zip(["Alice", "Bob", "Charlie"], sessions):
+        server.handle_command({"new_player": name}, session)
+    server.handle_command(
+        {"new_player": "Dave", "opponent": "computer"}, new_session()
     )
-    assert server.check_winner() == False
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "O"},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[X]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[ ]', '[ ]', '[ ]', '[O]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-            ]
-        }
+    # Leaving before joining is news too, but each connection is
+    # only reported once. Leaving a room nobody came to closes it
+    server.end_connection(new_session())
+    server.end_connection(sessions[2])
+    assert acceptor.recv(100) == (
+        WAITING + PAIRED + WAITING + PLACED + PLACED + ROOM_CLOSED
     )
-    assert server.check_winner() == False
-
-def test_check_draw():
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "X"},
-            "board": [
-                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
-                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
-                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
-                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]'],
-                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]'],
-                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]']
-            ]
-        }
+    acceptor.close()
+    server.acceptor.close()
+
+def test_connections_passed_where_players_wait():
+    server = Server()
+    acceptor, worker = socket.socketpair()
+    key = mock.Mock(fileobj=acceptor, data=1)
+    waiting = [0, 0]
+    pending = [0, 0]
+
+    # Nobody waiting anywhere so connections are shared out
+    assert server.pick_worker(waiting, pending, 0) == 0
+    assert server.pick_worker(waiting, pending, 1) == 1
+
+    # Someone passed to worker 1 will need an opponent there
+    # whether or not they've found a room yet
+    pending[1] += 1
+    assert server.pick_worker(waiting, pending, 2) == 1
+    worker.send(WAITING)
+    server.hear_from_worker(None, key, waiting, pending)
+    assert (waiting, pending) == ([0, 1], [0, 0])
+    assert server.pick_worker(waiting, pending, 2) == 1
+
+    # A connection that left without joining doesn't count
+    pending[1] += 1
+    worker.send(PAIRED)
+    server.hear_from_worker(None, key, waiting, pending)
+    pending[1] += 1
+    assert server.pick_worker(waiting, pending, 2) == 1
+    worker.send(PLACED)
+    server.hear_from_worker(None, key, waiting, pending)
+    assert (waiting, pending) == ([0, 0], [0, 0])
+    assert server.pick_worker(waiting, pending, 2) == 0
+    acceptor.close()
+    worker.close()
+
+def test_handle_command_starts_game():
+    alice_socket = mock.Mock()
+    bob_socket = mock.Mock()
+    server = Server()
+    alice = new_session(alice_socket)
+    bob = new_session(bob_socket)
+
+    assert server.handle_command({"new_player": "Alice"}, alice)
+    assert server.handle_command({"new_player": "Bob"}, bob)
+    assert alice.game is bob.game
+    assert alice.game.game_started
+
+    # Exiting closes the room for both players
+    assert not server.handle_command(
+        {"current_player": "Bob", "next_move": "exit"}, bob
     )
-    assert server.check_draw() == True
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "X"},
-            "board": [
-                ['[O]', '[X]', '[O]', '[X]', '[X]', '[X]', '[X]', '[X]', '[X]'],
-                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
-                ['[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]'],
-                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]'],
-                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]'],
-                ['[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]', '[O]', '[X]']
-            ]
-        }
+    assert server.games == {}
+
+def test_protocol_negotiation():
+    server = Server()
+    old_client = mock.Mock()
+    old_client.binary = False
+    server.handle_command({"new_player": "Alice"}, new_session(old_client))
+    old_client.send.assert_any_call({"status": "200 JOIN"})
+    assert not old_client.binary
+
+    new_client = mock.Mock()
+    new_client.binary = False
+    server.handle_command(
+        {"new_player": "Bob", "protocol": "binary"},
+        new_session(new_client)
     )
-    assert server.check_draw() == False
-
-    server = Server(
-        kwargs = {
-            "turn": "Alice",
-            "markers": {"Alice": "X"},
-            "board": [
-                ['[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]'],
-                ['[X]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]', '[ ]']
-            ]
-        }
+    assert new_client.binary
+
+def test_moves_only_from_player_whose_turn_it_is():
+    alice_socket = mock.Mock()
+    bob_socket = mock.Mock()
+    server = Server()
+    alice = new_session(alice_socket)
+    bob = new_session(bob_socket)
+    server.handle_command({"new_player": "Alice"}, alice)
+    server.handle_command({"new_player": "Bob"}, bob)
+    game = alice.game
+    waiting = alice if game.turn == "Bob" else bob
+
+    server.handle_command({"next_move": "1"}, waiting)
+    waiting.connection.send.assert_called_with({"status": "400 ERR"})
+    assert game.bitboard.moves == 0
+
+def test_stats():
+    server = Server()
+    server.count_connection(1)
+    server.handle_command({"new_player": "Alice"}, new_session())
+    assert server.stats() == {"connections": 1, "games": 1, "waiting": 1}
+
+def test_sessions_kept_apart():
+    # Each connection's player and room live on its own session
+    server = Server()
+    alice = new_session()
+    bob = new_session()
+    server.handle_command({"new_player": "Alice"}, alice)
+    server.handle_command({"new_player": "Bob"}, bob)
+    assert (alice.player, bob.player) == ("Alice", "Bob")
+    assert not hasattr(server, "current_player")
+    with pytest.raises(AttributeError):
+        alice.score = 0
+
+def test_play_computer():
+    server = Server()
+    alice = new_session()
+    server.handle_command(
+        {"new_player": "Alice", "opponent": "computer"}, alice
     )
-    assert server.check_draw() == False
+    game = alice.game
+    assert game.players == ["Alice", "Computer"]
+    assert game.game_started
+    assert server.matchmaker.waiting() == 0
+
+    # The computer answers every move straight away
+    for move in range(3):
+        assert game.turn == "Alice"
+        moves = game.bitboard.moves
+        server.handle_command({"next_move": str(move + 1)}, alice)
+        assert game.bitboard.moves == moves + 2
+
+def test_computer_moves_off_event_loop():
+    async def run():
+        server = Server({"computer_depth": 2, "computer_time_limit": 0.01})
+        server.loop = asyncio.get_running_loop()
+        alice = new_session()
+        server.handle_command(
+            {"new_player": "Alice", "opponent": "computer"}, alice
+        )
+        game = alice.game
+        computer = game.connections["Computer"]
+        assert (computer.depth, computer.time_limit) == (2, 0.01)
+        for move in range(3):
+            # Made on a later pass of the loop, once the computer's
+            # thought about it in another thread
+            while game.turn != "Alice":
+                await asyncio.sleep(0.01)
+            moves = game.bitboard.moves
+            server.handle_command({"next_move": str(move + 1)}, alice)
+            assert game.bitboard.moves == moves + 1
+        # Leaving while the computer thinks stops it moving
+        computer.move = mock.Mock()
+        server.end_connection(alice)
+        await asyncio.sleep(0.1)
+        computer.move.assert_not_called()
+    asyncio.run(run())
+
+def test_hint():
+    server = Server()
+    alice = new_session()
+    server.handle_command({"new_player": "Alice"}, alice)
+    # No hints before the game starts
+    server.handle_command({"hint": True}, alice)
+    alice.connection.send.assert_called_with({"status": "400 ERR"})
+
+    bob = new_session()
+    server.handle_command({"new_player": "Bob"}, bob)
+    # Nor on the other player's turn. Bob has O so moves first
+    server.handle_command({"hint": True}, alice)
+    alice.connection.send.assert_called_with({"status": "400 ERR"})
+    server.handle_command({"next_move": "1"}, bob)
+
+    server.handle_command({"hint": True}, alice)
+    response = alice.connection.send.call_args[0][0]
+    assert response["status"] == "200 HINT"
+    assert 1 <= response["column"] <= 9
+
+    server.handle_command({"solve": True}, alice)
+    response = alice.connection.send.call_args[0][0]
+    assert response["status"] == "200 SOLVE"
+    assert response["result"] is None
+
+def last_timer(timers):
+    # Callback of the last timer scheduled on a mock wheel
+    return timers.schedule.call_args[0][1]
+
+def test_turn_timeout():
+    timers = mock.Mock()
+    server = Server({"timers": timers, "turn_timeout": 30})
+    alice = new_session()
+    bob = new_session()
+    server.handle_command({"new_player": "Alice"}, alice)
+    server.handle_command({"new_player": "Bob"}, bob)
+    game = alice.game
+    # Bob has O so moves first
+    assert timers.schedule.call_args[0][0] == 30
+    server.handle_command({"next_move": "1"}, bob)
+    # Bob's timer stops once Bob moves and Alice's starts
+    timers.cancel.assert_called()
+    timed_out = last_timer(timers)
+
+    timed_out()
+    alice.connection.send.assert_any_call({"status": "200 LOSS"})
+    bob.connection.send.assert_any_call({"status": "200 WIN"})
+    alice.connection.shutdown.assert_called_once()
+    assert game.game_id not in server.games
+
+def test_turn_timeout_after_move():
+    timers = mock.Mock()
+    server = Server({"timers": timers, "turn_timeout": 30})
+    alice = new_session()
+    bob = new_session()
+    server.handle_command({"new_player": "Alice"}, alice)
+    server.handle_command({"new_player": "Bob"}, bob)
+    timed_out = last_timer(timers)
+    # A timer that fires just after Bob moved does nothing
+    server.handle_command({"next_move": "1"}, bob)
+    timed_out()
+    assert alice.game.game_id in server.games
+    bob.connection.shutdown.assert_not_called()
+
+def test_idle_timeout():
+    timers = mock.Mock()
+    server = Server({"timers": timers, "idle_timeout": 60})
+    session = new_session()
+    server.start_idle_timer(session)
+    check = last_timer(timers)
+
+    # Still time left so it checks again later
+    check()
+    session.connection.shutdown.assert_not_called()
+    assert 0 < timers.schedule.call_args[0][0] <= 60
+
+    session.last_active -= 60
+    last_timer(timers)()
+    session.connection.shutdown.assert_called_once()
+
+def test_no_idle_timeout_while_in_room():
+    timers = mock.Mock()
+    server = Server({"timers": timers, "idle_timeout": 60})
+    session = new_session()
+    server.start_idle_timer(session)
+    server.handle_command({"new_player": "Alice"}, session)
+    # Waiting for an opponent isn't being idle
+    session.last_active -= 120
+    last_timer(timers)()
+    session.connection.shutdown.assert_not_called()
+
+def test_idle_timeout_after_game_over():
+    timers = mock.Mock()
+    server = Server({"timers": timers, "idle_timeout": 60})
+    alice = new_session()
+    server.start_idle_timer(alice)
+    server.handle_command({"new_player": "Alice"}, alice)
+    server.handle_command({"new_player": "Bob"}, new_session())
+    # A room whose game has ended is no reason to stay connected
+    alice.game.finish(DRAW)
+    alice.last_active -= 120
+    last_timer(timers)()
+    alice.connection.shutdown.assert_called_once()
+
+def test_bad_message_cleans_up():
+    server = Server()
+    server_end, client_end = socket.socketpair()
+    client = Connection(client_end)
+    thread = threading.Thread(target=server.connect_client, args=(server_end,))
+    thread.start()
+    client.send({"new_player": "Alice"})
+    assert client.recv()["status"] == "200 JOIN"
+    assert client.recv()["status"] == "200 WAIT_PLAYER"
+
+    # Valid JSON but not a move the server can handle
+    client.send({"next_move": 5})
+    thread.join(2)
+    assert not thread.is_alive()
+    assert server.stats() == {"connections": 0, "games": 0, "waiting": 0}
+    # Told the room's closed, then the connection is
+    assert client.recv()["status"] == "200 DISC"
+    assert client.recv() is None
+    client.close()
+
+def test_no_hint_after_game_over():
+    # A 5x5 board played out to a draw has nowhere left to play
+    server = Server({"boardwidth": 5, "boardheight": 5})
+    alice = new_session()
+    bob = new_session()
+    server.handle_command({"new_player": "Alice"}, alice)
+    server.handle_command({"new_player": "Bob"}, bob)
+    game = alice.game
+    for column in [2, 5, 1, 3, 1, 4, 4, 4, 4, 2, 1, 4, 1, 5, 5, 1, 5, 3,
+                   3, 5, 2, 2, 3, 2, 3]:
+        player = alice if game.turn == "Alice" else bob
+        server.handle_command({"next_move": str(column)}, player)
+    assert game.bitboard.is_full()
+    assert game.result == DRAW
+
+    player = alice if game.turn == "Alice" else bob
+    for request in [{"hint": True}, {"solve": True}]:
+        server.handle_command(request, player)
+        player.connection.send.assert_called_with({"status": "400 ERR"})
+
+def start_game_for_hints(server):
+    alice = new_session()
+    bob = new_session()
+    server.handle_command({"new_player": "Alice"}, alice)
+    server.handle_command({"new_player": "Bob"}, bob)
+    # Bob has O so moves first, leaving it Alice's turn
+    server.handle_command({"next_move": "1"}, bob)
+    return alice
+
+def test_solves_rate_limited():
+    server = Server({"solve_interval": 60})
+    alice = start_game_for_hints(server)
+    server.handle_command({"solve": True}, alice)
+    assert alice.connection.send.call_args[0][0]["status"] == "200 SOLVE"
+    server.handle_command({"solve": True}, alice)
+    alice.connection.send.assert_called_with({"status": "400 ERR"})
+    # Hints are quick so aren't limited
+    server.handle_command({"hint": True}, alice)
+    assert alice.connection.send.call_args[0][0]["status"] == "200 HINT"
+
+def test_search_off_event_loop():
+    async def run():
+        server = Server()
+        server.loop = asyncio.get_running_loop()
+        alice = start_game_for_hints(server)
+        server.handle_command({"solve": True}, alice)
+        # Answered once the search finishes in another thread, and
+        # only one search at a time
+        assert alice.searching
+        server.handle_command({"hint": True}, alice)
+        alice.connection.send.assert_called_with({"status": "400 ERR"})
+        for attempt in range(200):
+            if alice.connection.send.call_args[0][0]["status"] != "400 ERR":
+                break
+            await asyncio.sleep(0.01)
+        assert alice.connection.send.call_args[0][0]["status"] == "200 SOLVE"
+        assert not alice.searching
+    asyncio.run(run())
+
+def test_asyncio_connections_skip_nagle():
+    async def run():
+        server = Server()
+        writers = []
+
+        async def connect(reader, writer):
+            writers.append(writer)
+            await server.connect_client_async(reader, writer)
+
+        # Made the way setup_connection makes the real listener
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        async_server = await asyncio.start_server(connect, sock=listener)
+        reader, writer = await asyncio.open_connection(
+            *listener.getsockname()
+        )
+        for attempt in range(200):
+            if writers:
+                break
+            await asyncio.sleep(0.01)
+        sock = writers[0].get_extra_info("socket")
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        writer.close()
+        async_server.close()
+        await async_server.wait_closed()
+    asyncio.run(run())
+
+@pytest.mark.parametrize("engine", ["threads", "asyncio"])
+def test_players_matched_across_workers(engine):
+    # A connection that never joins, and the benchmark's probe that
+    # leaves straight away, mustn't split two players up
+    benchmark = Benchmark({"engine": engine, "workers": 2})
+    benchmark.start_server()
+    address = (benchmark.host, benchmark.port)
+    idle = socket.create_connection(address)
+    try:
+        players = []
+        for name in ["Alice", "Bob"]:
+            player = Connection(socket.create_connection(address, timeout=5))
+            player.send({"new_player": name})
+            assert player.recv()["status"] == "200 JOIN"
+            players.append(player)
+        assert players[0].recv()["status"] == "200 WAIT_PLAYER"
+        statuses = {players[0].recv()["status"], players[1].recv()["status"]}
+        assert statuses == {"200 READY", "200 WAIT_TURN"}
+        for player in players:
+            player.close()
+    finally:
+        idle.close()
+        benchmark.stop_server()
@@ -0,0 +1,68 @@
+import pytest
+from board import Board
+from solver import Solver
+
+def play(board, columns):
+    # Alternate X and O starting with X
+    for i, column in enumerate(columns):
+        board.drop(column, "XO"[i % 2])
+
+def test_solve_forced_win():
+    board = Board(9, 6)
+    # Open three on the bottom row becomes an open four
+    play(board, [2, 8, 3, 8, 4, 7])
+    solution = Solver().solve(board, "X", "O")
+    assert solution["column"] in (1, 5)
+    assert solution["result"] == "win"
+    assert solution["moves"] == 3
+
+    # The other side sees the loss coming
+    board.drop(5, "X")
+    solution = Solver().solve(board, "O", "X")
+    assert solution["result"] == "loss"
+    assert solution["moves"] == 2
+
+def test_solve_draw():
+    board = Board(5, 5)
+    # Columns alternate so there's no line of five anywhere
+    play(board, [0, 1, 2, 3, 4] * 2 + [1, 0, 3, 2, 4] * 2 + [0, 1, 2])
+    solution = Solver().solve(board, "X", "O")
+    assert solution["result"] == "draw"
+    assert solution["moves"] == 2
+
+def test_hash_ignores_move_order():
+    solver = Solver()
+    first = Board(9, 6)
+    play(first, [0, 1, 2, 3])
+    second = Board(9, 6)
+    play(second, [2, 3, 0, 1])
+    assert (solver.position_hash(first, "X")
+            == solver.position_hash(second, "X"))
+    assert (solver.position_hash(first, "X")
+            != solver.position_hash(first, "O"))
+
+    # Same keys from the same seed
+    assert (Solver({"seed": 1}).position_hash(first, "X")
+            == Solver({"seed": 1}).position_hash(first, "X"))
+
+def test_incremental_hash():
+    solver = Solver()
+    board = Board(9, 6)
+    play(board, [4, 4, 3])
+    solver.hash = solver.position_hash(board, "O")
+    solver.turn_keys = solver.cell_keys("X")[-1] ^ solver.cell_keys("O")[-1]
+    row = solver.drop(board, 5, "O")
+    assert solver.hash == solver.position_hash(board, "X")
+    solver.undo(board, 5, row, "O")
+    assert solver.hash == solver.position_hash(board, "O")
+
+def test_table_is_bounded_and_reused():
+    solver = Solver({"table_size": 1000, "time_limit": 0.02})
+    assert len(solver.table) == 1024
+    board = Board(9, 6)
+    play(board, [4, 4])
+    solver.hint(board, "X", "O")
+    assert len(solver.table) == 1024
+    # Asking again is answered from what we stored last time
+    solver.hint(board, "X", "O")
+    assert solver.hits > 0
@@ -0,0 +1,55 @@
+import pytest
+import threading
+from timers import Timer, TimerWheel
+
+def run_until(wheel, tick):
+    # Advance the wheel by hand, noting when each timer comes due
+    fired = []
+    while wheel.now < tick:
+        for timer in wheel.advance():
+            fired.append((wheel.now, timer.callback))
+    return fired
+
+def test_timers_fire_on_their_tick():
+    wheel = TimerWheel({"slots": 4, "levels": 3})
+    # Due in the first wheel, the second, the third and
+    # beyond what any wheel reaches
+    for expires in [1, 3, 5, 17, 40, 63, 64, 200]:
+        wheel.add(Timer(expires, expires))
+    fired = run_until(wheel, 250)
+    assert fired == [(expires, expires)
+                     for expires in [1, 3, 5, 17, 40, 63, 64, 200]]
+
+def test_timers_added_as_wheel_turns():
+    wheel = TimerWheel({"slots": 4, "levels": 3})
+    expected = []
+    for start in range(0, 100, 7):
+        run_until(wheel, start)
+        for delay in [1, 4, 9, 30]:
+            wheel.add(Timer(wheel.now + delay, (start, delay)))
+            expected.append((wheel.now + delay, (start, delay)))
+        assert sorted(run_until(wheel, start + 7)) == sorted(
+            item for item in expected if item[0] <= start + 7
+        )
+        expected = [item for item in expected if item[0] > start + 7]
+
+def test_cancel():
+    wheel = TimerWheel({"slots": 4, "levels": 3})
+    kept = Timer(10, "kept")
+    cancelled = Timer(10, "cancelled")
+    wheel.add(kept)
+    wheel.add(cancelled)
+    wheel.cancel(cancelled)
+    # Cancelling twice, or a timer that never was, is fine
+    wheel.cancel(cancelled)
+    wheel.cancel(None)
+    assert run_until(wheel, 20) == [(10, "kept")]
+
+def test_schedule_runs_callback():
+    wheel = TimerWheel({"tick": 0.01})
+    done = threading.Event()
+    cancelled = threading.Event()
+    wheel.schedule(0.03, done.set)
+    wheel.cancel(wheel.schedule(0.02, cancelled.set))
+    assert done.wait(2)
+    assert not cancelled.is_set()
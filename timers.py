@@ -0,0 +1,142 @@
+import logging
+import math
+import os
+import threading
+import time
+
+class Timer():
+    """A callback waiting in the wheel. Cancel it with
+    TimerWheel.cancel"""
+    __slots__ = ("expires", "callback", "slot")
+
+    def __init__(self, expires, callback):
+        # Tick to run on
+        self.expires = expires
+        self.callback = callback
+        # Set of timers it's waiting in, or None once it's run
+        # or been cancelled
+        self.slot = None
+
+class TimerWheel():
+    """Runs callbacks after a delay from one background thread,
+    however many timers are waiting.
+
+    Timers are kept in a hierarchy of wheels of slots. The first
+    wheel has a slot for each of the next few ticks. Each wheel
+    after it covers slots times as long, with each of its slots
+    spanning a whole turn of the wheel below. Adding and cancelling
+    a timer is a set operation, and each tick only looks at the
+    timers due then, plus now and again moving a slot's timers down
+    a wheel as their time gets close. Timers further off than the
+    last wheel reaches wait in its furthest slot and are put back
+    when they get there.
+
+    Callbacks run on the wheel's thread so should be quick"""
+    # Set log level to environment variable LOGLEVEL
+    # or default to ERROR
+    logging.basicConfig(level=os.environ.get("LOGLEVEL", "ERROR"))
+
+    def __init__(self, kwargs={}):
+        # Seconds per tick. Timers run up to a tick late
+        self.tick = kwargs.get("tick", 0.1)
+        self.slots = kwargs.get("slots", 64)
+        # With the defaults the last wheel reaches 19 days ahead
+        self.levels = kwargs.get("levels", 4)
+        # Guards the wheels
+        self.lock = threading.Lock()
+        self.wheels = [
+            [set() for slot in range(self.slots)]
+            for level in range(self.levels)
+        ]
+        # Ticks gone by since the wheel started
+        self.now = 0
+        # Started by the process that schedules, so workers forked
+        # from the server each get their own thread
+        self.pid = None
+
+    def start(self):
+        # Called with the lock held
+        self.pid = os.getpid()
+        self.started = time.monotonic()
+        self.now = 0
+        for wheel in self.wheels:
+            for slot in wheel:
+                slot.clear()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def schedule(self, delay, callback):
+        """Call callback in about delay seconds. Returns a Timer"""
+        with self.lock:
+            if self.pid != os.getpid():
+                self.start()
+            timer = Timer(
+                self.now + max(1, math.ceil(delay / self.tick)), callback
+            )
+            self.add(timer)
+        return timer
+
+    def cancel(self, timer):
+        """Stop timer running if it hasn't already"""
+        if timer is None:
+            return
+        with self.lock:
+            if timer.slot is not None:
+                timer.slot.discard(timer)
+                timer.slot = None
+
+    def add(self, timer):
+        # Called with the lock held. Put timer in the first wheel
+        # whose turn reaches its tick
+        ticks = timer.expires - self.now
+        span = 1
+        for level in range(self.levels):
+            if ticks < span * self.slots or level == self.levels - 1:
+                break
+            span *= self.slots
+        # Too far off for any wheel, so park it in the last wheel's
+        # furthest slot until it's nearer
+        expires = min(timer.expires, self.now + span * self.slots - 1)
+        slot = self.wheels[level][expires // span % self.slots]
+        slot.add(timer)
+        timer.slot = slot
+
+    def advance(self):
+        """Move on a tick. Returns the timers due on it"""
+        with self.lock:
+            self.now += 1
+            # Move timers down from any wheel that's come round to
+            # its next slot, highest first so they fall all the way
+            span = self.slots ** (self.levels - 1)
+            for level in range(self.levels - 1, 0, -1):
+                if self.now % span == 0:
+                    slot = self.wheels[level][self.now // span % self.slots]
+                    timers = list(slot)
+                    slot.clear()
+                    for timer in timers:
+                        self.add(timer)
+                span //= self.slots
+
+            slot = self.wheels[0][self.now % self.slots]
+            due = []
+            for timer in list(slot):
+                slot.discard(timer)
+                if timer.expires <= self.now:
+                    timer.slot = None
+                    due.append(timer)
+                else:
+                    # Parked further off than the wheels reach
+                    self.add(timer)
+            return due
+
+    def run(self):
+        while True:
+            target = int((time.monotonic() - self.started) / self.tick)
+            while self.now < target:
+                for timer in self.advance():
+                    try:
+                        timer.callback()
+                    except Exception:
+                        logging.exception("Timer callback failed")
+            time.sleep(max(
+                0, self.started + (self.now + 1) * self.tick - time.monotonic()
+            ))